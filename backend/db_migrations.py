@@ -0,0 +1,49 @@
+"""
+启动时的数据库迁移
+
+表结构由 Base.metadata.create_all（init_db.py）创建，已有的表不会补上后加的约束；
+这里在每次启动时幂等地补齐。多个 worker 同时启动时用 advisory lock 串行执行。
+"""
+import logging
+
+from sqlalchemy import text
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+VOCAB_CARD_CONSTRAINT = "uq_vocab_cards_version_word"
+
+
+async def ensure_vocab_card_constraint():
+    """
+    vocab_cards 的 (version_id, word) 唯一约束
+
+    并发查词曾插入重复词卡，直接加约束会失败：先删除重复行（每组保留 id 最小的一张），
+    再添加约束。version_id 为空的行不受唯一约束限制，不做处理。
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": VOCAB_CARD_CONSTRAINT})
+        if (await conn.execute(text("SELECT to_regclass('vocab_cards')"))).scalar() is None:
+            return
+        exists = await conn.execute(
+            text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": VOCAB_CARD_CONSTRAINT}
+        )
+        if exists.scalar() is not None:
+            return
+        removed = await conn.execute(text(
+            "DELETE FROM vocab_cards a USING vocab_cards b "
+            "WHERE a.version_id = b.version_id AND a.word = b.word AND a.id > b.id"
+        ))
+        await conn.execute(text(
+            f"ALTER TABLE vocab_cards ADD CONSTRAINT {VOCAB_CARD_CONSTRAINT} UNIQUE (version_id, word)"
+        ))
+    logger.info(f"[Migrations] Added {VOCAB_CARD_CONSTRAINT} (removed {removed.rowcount} duplicate vocab cards)")
+
+
+async def run_startup_migrations():
+    """迁移失败（如数据库暂不可用）只记录日志，不阻止服务启动"""
+    try:
+        await ensure_vocab_card_constraint()
+    except Exception as e:
+        logger.warning(f"[Migrations] vocab_cards unique constraint not applied: {e}")
@@ -0,0 +1,225 @@
+"""
+课堂压测 - 估算单个后端实例能同时承载多少个课堂
+
+默认在本机启动 LLM / TTS 桩服务和后端（uvicorn --workers W），后端的豆包配置
+和 VOCAB_TTS_URL 指向桩服务，然后按 scenario 模拟 N 个房间的流量，输出:
+- 每个端点的 p50 / p95 / p99 延迟和错误数（含 WebSocket 扇出延迟）
+- 扇出投递：应收到 / 实际收到 / 丢失
+- 每个 worker（以及桩服务和压测进程本身）的 CPU 和 RSS
+
+在 backend 目录下运行:
+    python -m loadtest --rooms 20 --students 2 --duration 60 --workers 1
+
+注意:
+- 查词会写入 vocab_cards（词以 loadtest 开头），请使用测试数据库（DATABASE_URL）
+- 多 worker 时需要 WS_ROOM_BUS=redis，否则同一房间的老师和学生可能落在不同 worker 上
+- LLM 限流（LLM_LIMIT_*）等配置沿用当前环境，与线上一致时结果才有参考价值
+- --target 压测已在运行的后端（不启动桩服务），--server-pid 指定其主进程以采样资源
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+from tabulate import tabulate
+
+from loadtest import procstats
+from loadtest.scenario import ClassroomSimulation
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m loadtest", description="Classroom load simulation for /ws and SSE endpoints")
+    parser.add_argument("--rooms", type=int, default=10, help="number of classrooms")
+    parser.add_argument("--students", type=int, default=1, help="students per classroom")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of steady traffic after ramp-up")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which rooms join")
+    parser.add_argument("--state-rate", type=float, default=4, help="teacher state updates per second")
+    parser.add_argument("--chat-interval", type=float, default=20, help="mean seconds between chat turns per student (0 = off)")
+    parser.add_argument("--lookup-interval", type=float, default=15, help="mean seconds between vocab lookups per student (0 = off)")
+    parser.add_argument("--signal-interval", type=float, default=30, help="seconds between WebRTC renegotiations (0 = off)")
+    parser.add_argument("--drain", type=float, default=5, help="seconds to wait for in-flight messages before counting drops")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the launched backend")
+    parser.add_argument("--port", type=int, default=0, help="backend port (default: random free port)")
+    parser.add_argument("--stub-port", type=int, default=0, help="stub server port (default: random free port)")
+    parser.add_argument("--target", default=None, help="base URL of an already running backend, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--server-pid", type=int, default=None, help="master pid of the --target backend, for CPU/RSS sampling")
+    parser.add_argument("--server-log", default=None, help="file for the launched backend's output (default: temp file)")
+    parser.add_argument("--json", dest="json_path", default=None, help="also write the report as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_healthy(url: str, timeout: float = 60) -> bool:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return True
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.3)
+    return False
+
+
+def backend_env(stub_url: str, snapshot_dir: str) -> Dict[str, str]:
+    """后端环境：LLM 走桩服务的豆包接口，TTS 走桩服务；其余配置沿用当前环境"""
+    env = dict(os.environ)
+    env.update({
+        "ARK_API_KEY": "loadtest-stub",
+        "ARK_BASE_URL": stub_url,
+        "ARK_MODEL": "loadtest-stub",
+        "DEFAULT_AI_MODEL": "doubao",
+        "LLM_PROVIDERS": "doubao",
+        "COACHING_AI_PROVIDER": "doubao",
+        "COACHING_AI_PROVIDERS": "doubao",
+        "VOCAB_TTS_URL": f"{stub_url}/tts",
+        "PYTHONUNBUFFERED": "1",
+    })
+    env.setdefault("ROOM_SNAPSHOT_DIR", snapshot_dir)
+    return env
+
+
+def stop(process: Optional[subprocess.Popen]):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def worker_pids(master: int) -> Dict[str, int]:
+    """uvicorn 多 worker 时采样子进程（排除 multiprocessing 的辅助进程），单 worker 时采样主进程"""
+    workers = []
+    for pid in procstats.children(master):
+        try:
+            cmdline = Path(f"/proc/{pid}/cmdline").read_bytes()
+        except OSError:
+            cmdline = b""
+        if b"resource_tracker" not in cmdline:
+            workers.append(pid)
+    if not workers:
+        return {"backend": master}
+    return {f"worker-{i}": pid for i, pid in enumerate(workers)}
+
+
+async def run(args: argparse.Namespace) -> dict:
+    stubs = backend = None
+    log_file = None
+    pids: Dict[str, int] = {}
+    try:
+        if args.target:
+            base_url = args.target.rstrip("/")
+            if args.server_pid:
+                pids.update(worker_pids(args.server_pid))
+        else:
+            if args.workers > 1 and os.getenv("WS_ROOM_BUS", "memory") != "redis":
+                print("⚠️ --workers > 1 without WS_ROOM_BUS=redis: rooms split across workers will not sync")
+            stub_port = args.stub_port or free_port()
+            port = args.port or free_port()
+            stub_url = f"http://127.0.0.1:{stub_port}"
+            base_url = f"http://127.0.0.1:{port}"
+            log_path = args.server_log or tempfile.mkstemp(prefix="loadtest-backend-", suffix=".log")[1]
+            log_file = open(log_path, "w")
+
+            stubs = subprocess.Popen(
+                [sys.executable, "-m", "loadtest.stubs", "--port", str(stub_port)],
+                cwd=BACKEND_DIR, stdout=log_file, stderr=subprocess.STDOUT
+            )
+            backend = subprocess.Popen(
+                [
+                    sys.executable, "-m", "uvicorn", "main:app",
+                    "--host", "127.0.0.1", "--port", str(port),
+                    "--workers", str(args.workers), "--log-level", "warning"
+                ],
+                cwd=BACKEND_DIR, stdout=log_file, stderr=subprocess.STDOUT,
+                env=backend_env(stub_url, tempfile.mkdtemp(prefix="loadtest-snapshots-"))
+            )
+            print(f"🚀 Backend on {base_url} ({args.workers} workers), stubs on {stub_url}, log: {log_path}")
+            if not await wait_healthy(f"{stub_url}/stats") or not await wait_healthy(f"{base_url}/health"):
+                raise RuntimeError(f"backend did not become healthy, see {log_path}")
+            # 等 worker 全部就绪后再取进程列表
+            await asyncio.sleep(1)
+            pids.update(worker_pids(backend.pid))
+            pids["stubs"] = stubs.pid
+
+        pids["loadgen"] = os.getpid()
+        sampler = procstats.ProcessSampler(pids) if procstats.available() else None
+        sampling = asyncio.create_task(sampler.run()) if sampler else None
+
+        simulation = ClassroomSimulation(
+            base_url,
+            rooms=args.rooms,
+            students=args.students,
+            duration=args.duration,
+            ramp=args.ramp,
+            state_rate=args.state_rate,
+            chat_interval=args.chat_interval,
+            lookup_interval=args.lookup_interval,
+            signal_interval=args.signal_interval,
+            drain=args.drain,
+            seed=args.seed,
+        )
+        print(f"🏫 {args.rooms} rooms × (1 teacher + {args.students} students), "
+              f"ramp {args.ramp:g}s, steady {args.duration:g}s")
+        recorder = await simulation.run()
+
+        if sampling:
+            sampling.cancel()
+        return {
+            "config": {key: value for key, value in vars(args).items() if key != "json_path"},
+            "endpoints": recorder.latency_rows(),
+            "fanout": recorder.fanout_rows(),
+            "errors": dict(recorder.errors),
+            "processes": sampler.summary() if sampler else [],
+        }
+    finally:
+        stop(backend)
+        stop(stubs)
+        if log_file is not None:
+            log_file.close()
+
+
+def print_report(report: dict):
+    print("\n== Latency (ms) ==")
+    print(tabulate(report["endpoints"], headers="keys", tablefmt="github", missingval="-"))
+    print("\n== Fan-out delivery ==")
+    print(tabulate(report["fanout"], headers="keys", tablefmt="github"))
+    if report["processes"]:
+        print("\n== Processes ==")
+        print(tabulate(report["processes"], headers="keys", tablefmt="github", missingval="-"))
+    if report["errors"]:
+        print("\n== Errors ==")
+        print(tabulate(sorted(report["errors"].items()), headers=["kind", "count"], tablefmt="github"))
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, ensure_ascii=False, indent=2))
+        print(f"\n📄 Report written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+进程资源采样 - 每个 uvicorn worker 的 CPU 和 RSS
+
+优先读取 /proc（Linux，无额外依赖）；没有 /proc 时使用 psutil（如已安装）。
+uvicorn 以 --workers N 启动时 worker 是主进程的子进程，单 worker 时主进程即 worker。
+"""
+import os
+import time
+import asyncio
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import psutil
+except ImportError:  # 只在没有 /proc 的系统上需要
+    psutil = None
+
+PROC = Path("/proc")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def available() -> bool:
+    return PROC.is_dir() or psutil is not None
+
+
+def children(pid: int) -> List[int]:
+    """直接子进程（uvicorn worker）"""
+    if psutil is not None and not PROC.is_dir():
+        try:
+            return [child.pid for child in psutil.Process(pid).children()]
+        except psutil.Error:
+            return []
+    found = []
+    for entry in PROC.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # 进程名可能含空格，从最后一个 ')' 之后解析
+        fields = stat[stat.rfind(")") + 2:].split()
+        if int(fields[1]) == pid:
+            found.append(int(entry.name))
+    return sorted(found)
+
+
+def read(pid: int) -> Optional[Tuple[float, int]]:
+    """(累计 CPU 秒数, RSS 字节)；进程已退出时返回 None"""
+    if psutil is not None and not PROC.is_dir():
+        try:
+            process = psutil.Process(pid)
+            cpu = process.cpu_times()
+            return cpu.user + cpu.system, process.memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        stat = (PROC / str(pid) / "stat").read_text()
+        status = (PROC / str(pid) / "status").read_text()
+    except OSError:
+        return None
+    fields = stat[stat.rfind(")") + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    rss = 0
+    for line in status.splitlines():
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1]) * 1024
+            break
+    return cpu, rss
+
+
+class ProcessSampler:
+    """按固定间隔采样一组进程的 CPU 占用率和 RSS"""
+
+    def __init__(self, pids: Dict[str, int], interval: float = 1.0):
+        self.pids = pids
+        self.interval = interval
+        # name -> [CPU 占用率 %]
+        self.cpu: Dict[str, List[float]] = {name: [] for name in pids}
+        self.rss: Dict[str, List[int]] = {name: [] for name in pids}
+        self._last: Dict[str, Tuple[float, float]] = {}
+
+    def sample(self):
+        now = time.monotonic()
+        for name, pid in self.pids.items():
+            reading = read(pid)
+            if reading is None:
+                continue
+            cpu, rss = reading
+            self.rss[name].append(rss)
+            last = self._last.get(name)
+            if last is not None and now > last[0]:
+                self.cpu[name].append((cpu - last[1]) / (now - last[0]) * 100)
+            self._last[name] = (now, cpu)
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def summary(self) -> List[dict]:
+        rows = []
+        for name, pid in self.pids.items():
+            cpu, rss = self.cpu[name], self.rss[name]
+            rows.append({
+                "process": name,
+                "pid": pid,
+                "cpu_avg_pct": round(sum(cpu) / len(cpu), 1) if cpu else None,
+                "cpu_max_pct": round(max(cpu), 1) if cpu else None,
+                "rss_end_mb": round(rss[-1] / 2**20, 1) if rss else None,
+                "rss_max_mb": round(max(rss) / 2**20, 1) if rss else None,
+            })
+        return rows
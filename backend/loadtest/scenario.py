@@ -0,0 +1,439 @@
+"""
+课堂模拟 - N 个房间，每个房间 1 位老师 + M 名学生
+
+每个模拟客户端都像前端一样使用增量协议（/ws?sync=delta）并回应 PING:
+- 老师: 高频滚动 / 聚焦段落（节流字段）、高亮追加、切换阶段；
+  学生进入后经 WEBRTC_SIGNAL 定向发送 OFFER / CANDIDATE，并定期重新协商
+- 学生: 滚动、与 AI 流式对话（/api/ai/chat/stream，回复追加到 messages）、
+  查词（/api/vocab/lookup，结果追加到 lookups）
+
+追加到列表的条目和信令都带 probe 编号，记录发出时刻和应收到的客户端：
+收到即记一次扇出延迟，结束时仍未收到的计为丢失。节流字段按设计会被合并，不计入。
+"""
+import json
+import time
+import random
+import asyncio
+import itertools
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set
+
+import httpx
+from websockets.asyncio.client import connect as ws_connect
+from websockets.exceptions import ConnectionClosed
+
+from services.ws_metrics import percentiles
+
+FANOUT_STATE = "ws fan-out: STATE_DELTA"
+FANOUT_SIGNAL = "ws fan-out: WEBRTC_SIGNAL"
+WS_CONNECT = "ws connect (WELCOME)"
+CHAT_TTFT = "POST /api/ai/chat/stream (first token)"
+CHAT_TOTAL = "POST /api/ai/chat/stream"
+VOCAB_LOOKUP = "POST /api/vocab/lookup"
+
+# 前缀便于在数据库和 static/audio 中识别压测产生的词卡
+WORDS = [f"loadtest{word}" for word in (
+    "apple", "river", "bright", "journey", "careful", "whisper", "ancient", "brave",
+    "harvest", "silent", "quickly", "mountain", "gentle", "curious", "shadow", "wander",
+)]
+# 真实 SDP 通常 2~4KB
+FAKE_SDP = "v=0\r\n" + "a=candidate:0 1 UDP 2122252543 192.168.0.2 50000 typ host\r\n" * 40
+CANDIDATES_PER_SIDE = 4
+
+
+class Recorder:
+    """汇总延迟样本、错误和扇出投递情况"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.sent: Counter = Counter()
+        self.expected: Counter = Counter()
+        self.delivered: Counter = Counter()
+        # probe -> [类别, 发出时刻, 尚未收到的客户端]
+        self._pending: Dict[str, list] = {}
+        self._ids = itertools.count()
+
+    def observe(self, name: str, seconds: float):
+        self.latencies[name].append(seconds)
+
+    def error(self, name: str):
+        self.errors[name] += 1
+
+    def probe(self, kind: str, recipients: Set[str]) -> str:
+        probe_id = f"p{next(self._ids)}"
+        self.sent[kind] += 1
+        self.expected[kind] += len(recipients)
+        if recipients:
+            self._pending[probe_id] = [kind, time.perf_counter(), set(recipients)]
+        return probe_id
+
+    def arrived(self, probe_id: str, recipient: str):
+        entry = self._pending.get(probe_id)
+        if entry is None or recipient not in entry[2]:
+            return
+        entry[2].discard(recipient)
+        self.delivered[entry[0]] += 1
+        self.latencies[entry[0]].append(time.perf_counter() - entry[1])
+        if not entry[2]:
+            del self._pending[probe_id]
+
+    def dropped(self) -> Counter:
+        dropped = Counter()
+        for kind, _, missing in self._pending.values():
+            dropped[kind] += len(missing)
+        return dropped
+
+    def latency_rows(self) -> List[dict]:
+        names = sorted(set(self.latencies) | set(self.errors))
+        return [
+            {
+                "endpoint": name,
+                "count": len(self.latencies.get(name, ())),
+                "errors": self.errors.get(name, 0),
+                **percentiles(self.latencies.get(name, [])),
+            }
+            for name in names
+        ]
+
+    def fanout_rows(self) -> List[dict]:
+        dropped = self.dropped()
+        return [
+            {
+                "kind": kind,
+                "sent": self.sent[kind],
+                "expected": self.expected[kind],
+                "delivered": self.delivered[kind],
+                "dropped": dropped[kind],
+            }
+            for kind in sorted(self.sent)
+        ]
+
+
+class SimRoom:
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.clients: List["SimClient"] = []
+        # 服务器分配的 clientId -> 模拟客户端
+        self.by_id: Dict[str, "SimClient"] = {}
+
+    def others(self, client: "SimClient") -> Set[str]:
+        return {other.name for other in self.clients if other is not client and other.online}
+
+
+class SimClient:
+    """一个模拟前端：增量同步 + WebRTC 信令"""
+
+    def __init__(self, sim: "ClassroomSimulation", room: SimRoom, name: str, role: str):
+        self.sim = sim
+        self.room = room
+        self.name = name
+        self.role = role  # coach | student
+        self.client_id: Optional[str] = None
+        self.online = False
+        self.closing = False
+        self.ws = None
+        self._welcomed = asyncio.Event()
+        self._reader: Optional[asyncio.Task] = None
+        # 已完成信令握手的对端
+        self.negotiated: Set[str] = set()
+
+    @property
+    def rec(self) -> Recorder:
+        return self.sim.recorder
+
+    async def connect(self) -> bool:
+        started = time.perf_counter()
+        try:
+            self.ws = await ws_connect(
+                f"{self.sim.ws_url}?room={self.room.room_id}&sync=delta",
+                max_size=None,
+                open_timeout=30,
+                ping_interval=None,
+            )
+            self._reader = asyncio.create_task(self._read())
+            await asyncio.wait_for(self._welcomed.wait(), 30)
+        except Exception:
+            self.rec.error(WS_CONNECT)
+            return False
+        self.rec.observe(WS_CONNECT, time.perf_counter() - started)
+        self.online = True
+        await self.send({"type": "JOIN", "role": self.role})
+        return True
+
+    async def close(self):
+        self.closing = True
+        self.online = False
+        if self.ws is not None:
+            await self.ws.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+    async def send(self, message: dict):
+        if self.ws is None:
+            return
+        message.setdefault("role", self.role)
+        message.setdefault("timestamp", int(time.time() * 1000))
+        try:
+            await self.ws.send(json.dumps(message))
+        except ConnectionClosed:
+            self.rec.error("ws send")
+
+    # ---- 收 ----
+
+    async def _read(self):
+        try:
+            async for raw in self.ws:
+                self._on_message(json.loads(raw))
+        except ConnectionClosed:
+            pass
+        finally:
+            if not self.closing:
+                self.online = False
+                self.rec.error("ws unexpected close")
+
+    def _on_message(self, message: dict):
+        msg_type = message.get("type")
+        if msg_type == "WELCOME":
+            self.client_id = message["clientId"]
+            self.room.by_id[self.client_id] = self
+            self._welcomed.set()
+        elif msg_type == "PING":
+            asyncio.create_task(self.send({"type": "PONG", "ts": message.get("ts")}))
+        elif msg_type == "STATE_DELTA":
+            self._on_delta(message)
+        elif msg_type == "STATE_DELTAS":
+            for delta in message.get("deltas", []):
+                self._on_delta(delta)
+        elif msg_type == "WEBRTC_SIGNAL":
+            payload = message.get("payload") or {}
+            if payload.get("probe"):
+                self.rec.arrived(payload["probe"], self.name)
+            self._on_signal(payload, message.get("senderId"))
+        elif msg_type == "SIGNAL_ERROR":
+            self.rec.error("ws SIGNAL_ERROR")
+
+    def _on_delta(self, delta: dict):
+        if delta.get("senderId") == self.client_id:
+            return
+        for op in delta.get("ops", []):
+            if op.get("op") != "append":
+                continue
+            for item in op.get("items", []):
+                if isinstance(item, dict) and item.get("probe"):
+                    self.rec.arrived(item["probe"], self.name)
+
+    # ---- WebRTC 信令（与 useWebRTC 相同的握手顺序） ----
+
+    def _on_signal(self, payload: dict, sender_id: Optional[str]):
+        peer = self.room.by_id.get(sender_id)
+        if peer is None or peer.role == self.role:
+            return
+        signal_type = payload.get("type")
+        if self.role == "coach" and signal_type == "STUDENT_HERE" and peer.name not in self.negotiated:
+            self.negotiated.add(peer.name)
+            asyncio.create_task(self.signal({"type": "OFFER", "sdp": FAKE_SDP}, peer))
+        elif self.role == "student" and signal_type == "TEACHER_HERE":
+            asyncio.create_task(self.signal({"type": "STUDENT_HERE"}, peer))
+        elif self.role == "student" and signal_type == "OFFER":
+            asyncio.create_task(self._answer(peer))
+        elif self.role == "coach" and signal_type == "ANSWER":
+            asyncio.create_task(self._candidates(peer))
+
+    async def _answer(self, peer: "SimClient"):
+        await self.signal({"type": "ANSWER", "sdp": FAKE_SDP}, peer)
+        await self._candidates(peer)
+
+    async def _candidates(self, peer: "SimClient"):
+        for i in range(CANDIDATES_PER_SIDE):
+            await self.signal({"type": "CANDIDATE", "candidate": {"candidate": f"candidate:{i}", "sdpMLineIndex": 0}}, peer)
+
+    async def signal(self, payload: dict, peer: Optional["SimClient"] = None):
+        """peer 为空时广播给房间内其他客户端"""
+        recipients = {peer.name} if peer is not None else self.room.others(self)
+        payload["probe"] = self.rec.probe(FANOUT_SIGNAL, recipients)
+        await self.send({
+            "type": "WEBRTC_SIGNAL",
+            "payload": payload,
+            "targetId": peer.client_id if peer is not None else None,
+        })
+
+    # ---- 状态 ----
+
+    async def patch(self, ops: List[dict]):
+        await self.send({"type": "STATE_PATCH", "ops": ops})
+
+    async def append(self, key: str, item: dict):
+        item["probe"] = self.rec.probe(FANOUT_STATE, self.room.others(self))
+        item.setdefault("id", item["probe"])
+        await self.patch([{"op": "append", "key": key, "items": [item]}])
+
+
+class ClassroomSimulation:
+    def __init__(
+        self,
+        base_url: str,
+        rooms: int = 10,
+        students: int = 1,
+        duration: float = 60.0,
+        ramp: float = 10.0,
+        state_rate: float = 4.0,
+        chat_interval: float = 20.0,
+        lookup_interval: float = 15.0,
+        signal_interval: float = 30.0,
+        drain: float = 5.0,
+        seed: Optional[int] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.ws_url = "ws" + self.base_url[len("http"):] + "/ws"
+        self.rooms = rooms
+        self.students = students
+        self.duration = duration
+        self.ramp = ramp
+        self.state_rate = state_rate
+        self.chat_interval = chat_interval
+        self.lookup_interval = lookup_interval
+        self.signal_interval = signal_interval
+        self.drain = drain
+        self.random = random.Random(seed)
+        self.recorder = Recorder()
+        self.http: Optional[httpx.AsyncClient] = None
+        self._clients: List[SimClient] = []
+        self._deadline = 0.0
+
+    async def run(self) -> Recorder:
+        limits = httpx.Limits(max_connections=self.rooms * self.students * 2 + 10)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=120, limits=limits) as self.http:
+            self._deadline = time.monotonic() + self.ramp + self.duration
+            tasks = [
+                asyncio.create_task(self._room(index, index * self.ramp / max(self.rooms, 1)))
+                for index in range(self.rooms)
+            ]
+            await asyncio.sleep(self.ramp + self.duration)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # 等待在途消息到达后再统计丢失
+            await asyncio.sleep(self.drain)
+            await asyncio.gather(*(client.close() for client in self._clients), return_exceptions=True)
+        return self.recorder
+
+    def _jitter(self, interval: float) -> float:
+        return interval * self.random.uniform(0.5, 1.5)
+
+    async def _room(self, index: int, delay: float):
+        await asyncio.sleep(delay)
+        room = SimRoom(f"loadtest-{index}")
+        teacher = SimClient(self, room, f"r{index}-teacher", "coach")
+        students = [SimClient(self, room, f"r{index}-student{i}", "student") for i in range(self.students)]
+        room.clients = [teacher, *students]
+        self._clients.extend(room.clients)
+
+        loops = []
+        try:
+            if await teacher.connect():
+                await teacher.signal({"type": "TEACHER_HERE"})
+                loops.append(asyncio.create_task(self._teacher_loop(teacher)))
+            for student, connected in zip(students, await asyncio.gather(*(s.connect() for s in students))):
+                if not connected:
+                    continue
+                await student.signal({"type": "STUDENT_HERE"})
+                loops.append(asyncio.create_task(self._student_loop(student)))
+                if self.chat_interval > 0:
+                    loops.append(asyncio.create_task(self._chat_loop(student)))
+                if self.lookup_interval > 0:
+                    loops.append(asyncio.create_task(self._lookup_loop(student)))
+            await asyncio.sleep(max(0.0, self._deadline - time.monotonic()))
+        finally:
+            for loop in loops:
+                loop.cancel()
+            await asyncio.gather(*loops, return_exceptions=True)
+
+    async def _teacher_loop(self, teacher: SimClient):
+        paragraph = 0
+        last_signal = time.monotonic()
+        while True:
+            await asyncio.sleep(self._jitter(1 / self.state_rate))
+            roll = self.random.random()
+            if roll < 0.5:
+                await teacher.patch([{"op": "set", "key": "scrollProgress", "value": round(self.random.random(), 3)}])
+            elif roll < 0.7:
+                paragraph = (paragraph + 1) % 12
+                await teacher.patch([{"op": "set", "key": "focusParagraphIndex", "value": paragraph}])
+            elif roll < 0.9:
+                await teacher.append("highlights", {
+                    "text": "highlighted words", "color": "yellow",
+                    "paragraphIndex": paragraph, "startOffset": self.random.randint(0, 300)
+                })
+            else:
+                await teacher.patch([{"op": "set", "key": "coachingStep", "value": self.random.randint(1, 5)}])
+
+            # 定期重新协商（网络切换、ICE restart）
+            if self.signal_interval > 0 and time.monotonic() - last_signal > self.signal_interval:
+                last_signal = time.monotonic()
+                teacher.negotiated.clear()
+                await teacher.signal({"type": "TEACHER_HERE"})
+
+    async def _student_loop(self, student: SimClient):
+        while True:
+            await asyncio.sleep(self._jitter(2 / self.state_rate))
+            await student.patch([{"op": "set", "key": "scrollProgress", "value": round(self.random.random(), 3)}])
+
+    async def _chat_loop(self, student: SimClient):
+        session_id = f"{student.room.room_id}-{student.name}"
+        context = {"module_type": "coaching", "student_name": student.name}
+        while True:
+            await asyncio.sleep(self._jitter(self.chat_interval))
+            reply = await self._chat_turn(session_id, context)
+            context = None
+            if reply is not None:
+                await student.append("messages", {"role": "user", "content": "我觉得答案是 B"})
+                await student.append("messages", {"role": "model", "content": reply})
+
+    async def _chat_turn(self, session_id: str, context: Optional[dict]) -> Optional[str]:
+        started = time.perf_counter()
+        first_token = None
+        reply = ""
+        body = {"session_id": session_id, "messages": [{"role": "user", "content": "我觉得答案是 B"}], "context": context}
+        try:
+            async with self.http.stream("POST", "/api/ai/chat/stream", json=body) as response:
+                if response.status_code != 200:
+                    self.recorder.error(CHAT_TOTAL)
+                    return None
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[6:])
+                    if event.get("type") == "text":
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        reply += event.get("content", "")
+                    elif event.get("type") == "error":
+                        self.recorder.error(CHAT_TOTAL)
+                        return None
+        except httpx.HTTPError:
+            self.recorder.error(CHAT_TOTAL)
+            return None
+        if first_token is not None:
+            self.recorder.observe(CHAT_TTFT, first_token)
+        self.recorder.observe(CHAT_TOTAL, time.perf_counter() - started)
+        return reply
+
+    async def _lookup_loop(self, student: SimClient):
+        while True:
+            await asyncio.sleep(self._jitter(self.lookup_interval))
+            word = self.random.choice(WORDS)
+            started = time.perf_counter()
+            try:
+                response = await self.http.post("/api/vocab/lookup", json={
+                    "word": word,
+                    "context_sentence": f"The {word} was mentioned in the passage."
+                })
+            except httpx.HTTPError:
+                self.recorder.error(VOCAB_LOOKUP)
+                continue
+            if response.status_code != 200:
+                self.recorder.error(VOCAB_LOOKUP)
+                continue
+            self.recorder.observe(VOCAB_LOOKUP, time.perf_counter() - started)
+            await student.append("lookups", {"word": word, "context": ""})
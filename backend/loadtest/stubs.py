@@ -0,0 +1,100 @@
+"""
+压测桩服务 - 替代外部 LLM 和语音提供商
+
+- POST /chat/completions  OpenAI 兼容接口（豆包 / 火山方舟格式），支持流式和非流式
+- GET  /tts               返回一段固定的 mp3 数据（VOCAB_TTS_URL）
+
+延迟可调，模拟真实提供商的首 token 延迟和逐 token 输出:
+    STUB_TTFT_MS       首个 token 前的等待（默认 300）
+    STUB_TOKEN_MS      相邻 token 的间隔（默认 20）
+    STUB_TOKENS        每次流式回复的 token 数（默认 40）
+    STUB_COMPLETION_MS 非流式请求的耗时（默认 400）
+    STUB_TTS_MS        TTS 请求的耗时（默认 150）
+
+单独运行:
+    python -m loadtest.stubs --port 9100
+"""
+import os
+import re
+import json
+import asyncio
+import argparse
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+TTFT = float(os.getenv("STUB_TTFT_MS", "300")) / 1000
+TOKEN_INTERVAL = float(os.getenv("STUB_TOKEN_MS", "20")) / 1000
+TOKENS = int(os.getenv("STUB_TOKENS", "40"))
+COMPLETION_DELAY = float(os.getenv("STUB_COMPLETION_MS", "400")) / 1000
+TTS_DELAY = float(os.getenv("STUB_TTS_MS", "150")) / 1000
+
+# 约 4KB 的静音 mp3 帧，足以覆盖写文件和静态文件服务的开销
+FAKE_MP3 = b"ID3\x03\x00\x00\x00\x00\x00\x00" + b"\xff\xfb\x90\x64" + b"\x00" * 4096
+
+app = FastAPI(title="Load Test Stubs")
+stats = {"chat_streams": 0, "completions": 0, "tts": 0}
+
+
+def _chunk(delta: dict, finish_reason=None) -> bytes:
+    body = {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+    return b"data: " + json.dumps(body, ensure_ascii=False).encode() + b"\n\n"
+
+
+async def _stream_reply():
+    await asyncio.sleep(TTFT)
+    for i in range(TOKENS):
+        yield _chunk({"content": "好" if i % 2 else "的"})
+        await asyncio.sleep(TOKEN_INTERVAL)
+    yield _chunk({}, finish_reason="stop")
+    yield b"data: [DONE]\n\n"
+
+
+def _completion_text(prompt: str) -> str:
+    """非流式请求目前只有查词类调用：返回可解析的 JSON"""
+    match = re.search(r'"([A-Za-z\- ]+)"', prompt)
+    word = match.group(1) if match else "word"
+    return json.dumps({
+        "phonetic": f"/{word}/",
+        "definition": "压测释义",
+        "syllables": [word],
+        "mnemonic": "压测助记",
+        "example": f"This is {word}.",
+    }, ensure_ascii=False)
+
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if body.get("stream"):
+        stats["chat_streams"] += 1
+        return StreamingResponse(_stream_reply(), media_type="text/event-stream")
+
+    stats["completions"] += 1
+    await asyncio.sleep(COMPLETION_DELAY)
+    prompt = (body.get("messages") or [{}])[-1].get("content", "")
+    return JSONResponse({
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": _completion_text(prompt)}}]
+    })
+
+
+@app.get("/tts")
+async def tts(text: str = "", voice: str = ""):
+    stats["tts"] += 1
+    await asyncio.sleep(TTS_DELAY)
+    return Response(FAKE_MP3, media_type="audio/mpeg")
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="LLM / TTS stub server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
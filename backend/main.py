@@ -1,12 +1,19 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import os
+import signal
 from pathlib import Path
 from dotenv import load_dotenv
 
 from routers import users, articles, sessions, websocket, vocab, ai, chat_stream
+from services.http_clients import http_clients
+from services.session_store import session_store
+from services.ws_pubsub import room_bus
+from services.room_snapshots import room_snapshots
+from db_migrations import run_startup_migrations
 
 # Load environment variables
 load_dotenv()
@@ -48,10 +55,49 @@ def check_ffmpeg():
 # 启动时检查 ffmpeg
 check_ffmpeg()
 
+def install_shutdown_hook():
+    """
+    uvicorn 收到退出信号后先关闭所有连接，之后才执行 lifespan 的关闭部分；
+    在信号处理器里先置位，关闭过程中断开的学生不会清空房间和删除快照
+    """
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+
+        def handler(signum, frame, previous=previous):
+            websocket.manager.begin_shutdown()
+            if callable(previous):
+                previous(signum, frame)
+
+        try:
+            signal.signal(sig, handler)
+        except ValueError:
+            # 非主线程（如测试客户端）无法注册信号处理器
+            return
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动时补齐数据库约束、建立出站连接池、连接会话存储和房间消息总线，
+    并在接受连接之前从快照恢复房间状态；关闭时写出未落盘的快照并释放
+    """
+    await run_startup_migrations()
+    http_clients.startup()
+    await session_store.startup()
+    await room_bus.startup()
+    await room_snapshots.startup()
+    install_shutdown_hook()
+    yield
+    websocket.manager.begin_shutdown()
+    await room_snapshots.aclose()
+    await room_bus.aclose()
+    await session_store.aclose()
+    await http_clients.aclose()
+
 app = FastAPI(
     title="Jarvis Backend API",
     description="Backend service for S9 Reading Classroom",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS Configuration
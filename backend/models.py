@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float, DateTime, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float, DateTime, JSON, Boolean, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -93,6 +93,8 @@ class SentenceSurgery(Base):
 
 class VocabCard(Base):
     __tablename__ = "vocab_cards"
+    # 同一版本同一单词只有一张卡（并发查词的兜底）；已有数据库由 db_migrations 在启动时去重后补上
+    __table_args__ = (UniqueConstraint("version_id", "word", name="uq_vocab_cards_version_word"),)
 
     id = Column(Integer, primary_key=True, index=True)
     version_id = Column(Integer, ForeignKey("versions.id"))
@@ -11,6 +11,7 @@ import os
 
 from database import get_db
 from models import Question, Version, Article
+from services.prompt_templates import prompt_templates
 
 router = APIRouter(prefix="/api/ai", tags=["ai"])
 
@@ -260,12 +261,8 @@ async def generate_coaching_script(
     # 获取当前阶段配置
     phase_config = COACHING_PHASES.get(request.phase, COACHING_PHASES[1])
     
-    # 读取 prompt 模板
-    prompt_path = os.path.join(os.path.dirname(__file__), "../prompts/coaching_tutor.md")
-    system_prompt = ""
-    if os.path.exists(prompt_path):
-        with open(prompt_path, "r", encoding="utf-8") as f:
-            system_prompt = f.read()
+    # 读取 prompt 模板（已缓存，文件修改后自动重新加载）
+    system_prompt = prompt_templates.get("coaching_tutor.md").text
     
     # 构建用户 prompt
     user_prompt = f"""
@@ -305,7 +302,8 @@ async def generate_coaching_script(
         script = await ai_service.generate_text(
             prompt=user_prompt,
             system_prompt=system_prompt[:2000] if system_prompt else None,
-            model="gemini"
+            model="gemini",
+            cache=True
         )
         
         # 清理可能的格式问题
@@ -350,6 +348,58 @@ async def generate_coaching_script(
     )
 
 
+@router.get("/cache/stats")
+async def get_llm_cache_stats():
+    """
+    获取 LLM 响应缓存统计（命中率、容量等）
+    """
+    from services.llm_cache import llm_cache
+    
+    return llm_cache.stats()
+
+
+@router.get("/router/stats")
+async def get_llm_router_stats():
+    """
+    获取各 LLM 提供商的路由统计（EWMA 延迟、TTFT、错误率、熔断状态）
+    """
+    from services.llm_router import llm_router
+    
+    return llm_router.stats()
+
+
+@router.get("/limiter/stats")
+async def get_llm_limiter_stats():
+    """
+    获取各 LLM 提供商的准入控制统计（排队深度、等待时间、进行中请求数）
+    """
+    from services.llm_limiter import llm_limiter
+    
+    return llm_limiter.stats()
+
+
+@router.get("/debug/metrics")
+async def get_llm_debug_metrics(limit: int = 50):
+    """
+    LLM 调用遥测（调试用）
+    
+    包含按提供商聚合的 TTFT / 总耗时直方图、错误分类、最近 limit 条调用记录，
+    以及缓存、路由、准入控制的统计
+    """
+    from services.llm_metrics import llm_metrics
+    from services.llm_cache import llm_cache
+    from services.llm_router import llm_router
+    from services.llm_limiter import llm_limiter
+    
+    return {
+        "summary": llm_metrics.summary(),
+        "recent": llm_metrics.recent(limit),
+        "cache": llm_cache.stats(),
+        "router": llm_router.stats(),
+        "limiter": llm_limiter.stats(),
+    }
+
+
 # ============================================================================
 # Agent API Endpoints - 有状态的 AI 教学助手
 # ============================================================================
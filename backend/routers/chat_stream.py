@@ -3,12 +3,19 @@
 
 提供 Server-Sent Events 流式响应，实现打字机效果
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Header
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
-import json
+from typing import List, Dict, Optional, Tuple
 import os
+import asyncio
+from contextlib import aclosing
+
+from services.chat_history import chat_history, append_summary_to_prompt
+from services.prompt_templates import prompt_templates, compact_json
+from services.session_store import session_store, new_session
+from services.async_utils import spawn_background
+from services.sse import StreamRun, chat_streams
 
 router = APIRouter(prefix="/api/ai", tags=["chat"])
 
@@ -29,166 +36,211 @@ class ToolCallEvent(BaseModel):
     arguments: Dict
 
 
-# 会话存储（生产环境应使用 Redis）
-_chat_sessions: Dict[str, Dict] = {}
-
-
-def get_system_prompt(context: Dict = None) -> str:
-    """获取系统提示词"""
-    module_type = context.get('module_type', 'coaching') if context else 'coaching'
-    
-    # 根据模块类型选择 prompt 模板
-    if module_type == 'surgery':
-        prompt_file = "surgery_tutor.md"
-    else:
-        prompt_file = "coaching_tutor_v2.md"
-        
-    prompt_path = os.path.join(os.path.dirname(__file__), f"../prompts/{prompt_file}")
-    print(f"[get_system_prompt] Loading prompt from: {prompt_file}")
-    
-    system_prompt = ""
-    if os.path.exists(prompt_path):
-        with open(prompt_path, "r", encoding="utf-8") as f:
-            system_prompt = f.read()
-    
-    # 如果有上下文，替换 prompt 中的占位符
-    if context:
-        # 准备替换数据
-        replacements = {
-            "{{article_content}}": context.get('article_content', ''),
-            "{{current_sentence}}": context.get('current_sentence', ''),
-            "{{surgery_chunks}}": json.dumps(context.get('surgery_chunks', []), ensure_ascii=False, indent=2)
-        }
-
-        if module_type == 'coaching':
-            # 定义不同题型的解题技巧（仅用于 coaching 模块）
-            skills_map = {
-                "细节理解题": """步骤1. 题干关键词定位：找到题目中的关键词（如时间、地点、人物或事件)
+# 不同题型的解题技巧（仅用于 coaching 模块）
+SOLVING_SKILLS = {
+    "细节理解题": """步骤1. 题干关键词定位：找到题目中的关键词（如时间、地点、人物或事件)
 步骤2. 翻译题干：翻译题干意思，关注特殊疑问词，理解需要回答内容 （原因、具体事物、时间、人物、地点、方式）
 步骤3. 文章信息定位：通过题干关键词迅速在文章中找到答题段落和句子
 步骤4. 仔细阅读答题段落和句子，与选项对比，选出最符合的答案""",
-                
-                "主旨大意题": """步骤1. 通读全文：快速通读文章，获取整体概念和主题
+    
+    "主旨大意题": """步骤1. 通读全文：快速通读文章，获取整体概念和主题
 步骤2. 寻找主题句：每段的第一句或最后一句通常是主题句，帮助归纳段落大意
 步骤3. 概括总结：结合每段主旨和文章概念，总结文章主旨
 步骤4. 验证选项：将选项对比总结的文章主旨，选出最接近的答案""",
-                
-                "推理判断题": """步骤1. 回归文章信息：明确题干要求，找到相关段落或相关句子作为答题依据
+    
+    "推理判断题": """步骤1. 回归文章信息：明确题干要求，找到相关段落或相关句子作为答题依据
 步骤2. 理解表面含义：翻译相关段落或句子，关注上下文
 步骤3. 分析隐含信息：关注相关句子和段落处的隐含信息，结合上下文进行逻辑推理
 步骤4. 验证选项：将选项逐一与所推断内容对比，选出与推断内容一致的答案""",
-                
-                "词义猜测题": """步骤1. 翻译上下文：仔细阅读目标词前后的句子，进行翻译
+    
+    "词义猜测题": """步骤1. 翻译上下文：仔细阅读目标词前后的句子，进行翻译
 步骤2. 注意逻辑关系：通过翻译分析上下文与目标词之间的逻辑关系，判断词义倾向
 步骤3. 结合语境推测：结合逻辑关系和上下文翻译，推测生词意思
 步骤4. 验证选项：将选项代入到目标词处，检查是否符合猜测的意思，选出正确选项""",
-                
-                "代词指代题": """步骤1. 定位代词：识别题干中相关的代词，并定位代词在原文的位置
+    
+    "代词指代题": """步骤1. 定位代词：识别题干中相关的代词，并定位代词在原文的位置
 步骤2. 理解上下文：阅读并翻译代词前后的句子或段落
 步骤3. 分析关系：判断代词与句子中的其他部分的指代关系，明确指代内容
 步骤4. 替换验证：将选项代入代词所在句子，验证是否符合语义和逻辑"""
-            }
-
-            # 获取当前题型的解题技巧，默认为细节理解题
-            q_type = context.get('question_type', '细节理解题')
-            current_skills = skills_map.get(q_type, skills_map["细节理解题"])
-            
-            replacements.update({
-                "{{question_stem}}": context.get('question_stem', ''),
-                "{{options}}": json.dumps(context.get('options', []), ensure_ascii=False, indent=2),
-                "{{correct_answer}}": context.get('correct_answer', ''),
-                "{{question_type}}": q_type,
-                "{{solving_skills}}": context.get('solving_skills', current_skills)
-            })
+}
+
+
+def get_system_prompt(context: Dict = None) -> str:
+    """获取系统提示词（模板已预编译，文件修改后自动重新加载）"""
+    module_type = context.get('module_type', 'coaching') if context else 'coaching'
+    
+    # 根据模块类型选择 prompt 模板
+    if module_type == 'surgery':
+        prompt_file = "surgery_tutor.md"
+    else:
+        prompt_file = "coaching_tutor_v2.md"
+    
+    template = prompt_templates.get(prompt_file)
+    
+    # 没有上下文时返回原始模板
+    if not context:
+        return template.text
+    
+    # 准备替换数据（JSON 紧凑序列化，减少 token）
+    values = {
+        "article_content": context.get('article_content', ''),
+        "current_sentence": context.get('current_sentence', ''),
+        "surgery_chunks": compact_json(context.get('surgery_chunks', []))
+    }
+    
+    if module_type == 'coaching':
+        # 获取当前题型的解题技巧，默认为细节理解题
+        q_type = context.get('question_type', '细节理解题')
+        current_skills = SOLVING_SKILLS.get(q_type, SOLVING_SKILLS["细节理解题"])
         
-        # 执行替换
-        for key, value in replacements.items():
-            system_prompt = system_prompt.replace(key, str(value))
-            
-    return system_prompt
+        values.update({
+            "question_stem": context.get('question_stem', ''),
+            "options": compact_json(context.get('options', [])),
+            "correct_answer": context.get('correct_answer', ''),
+            "question_type": q_type,
+            "solving_skills": context.get('solving_skills', current_skills)
+        })
+    
+    return template.render(values)
+
 
+def _save_partial_reply(session_id: str, content: str):
+    """保存被中断的回复；放到后台任务中，不受当前流取消的影响"""
+    print(f"[ChatStream] Stream interrupted, saving partial reply ({len(content)} chars)")
+    spawn_background(session_store.append_messages(
+        session_id, [{"role": "assistant", "content": content}]
+    ))
 
-async def generate_sse_stream(request: ChatRequest):
-    """生成 SSE 事件流"""
+
+async def _run_chat_turn(request: ChatRequest, run: StreamRun):
+    """执行一轮对话，事件写入 run（独立于 HTTP 连接）"""
     from services.ai_service import get_coaching_ai_generator
     from services.agents.coaching_tools import COACHING_TOOLS
     
     # 获取或创建会话
-    session = _chat_sessions.get(request.session_id, {
-        "messages": [],
-        "context": request.context or {},
-        "wrong_count": 0
-    })
-    
-    # 更新上下文
-    if request.context:
+    session = await session_store.get(request.session_id)
+    if session is None:
+        session = new_session(request.context)
+        await session_store.create(request.session_id, session)
+    elif request.context:
+        # 更新上下文
         session["context"].update(request.context)
+        await session_store.update(request.session_id, context=session["context"])
     
     # 添加用户消息到历史
-    for msg in request.messages:
-        if msg.role == "user":
-            session["messages"].append({"role": "user", "content": msg.content})
+    user_messages = [
+        {"role": "user", "content": msg.content}
+        for msg in request.messages if msg.role == "user"
+    ]
+    session["messages"].extend(user_messages)
+    await session_store.append_messages(request.session_id, user_messages)
+    
+    module_type = session["context"].get('module_type', 'coaching')
     
-    # 构建消息历史
-    messages = session["messages"]
+    # 构建消息历史：最近消息原样发送，更早的消息以摘要形式附加到系统提示词
+    messages, history_summary = chat_history.build_context(session, module_type)
     
     # 获取系统提示词
-    system_prompt = get_system_prompt(session["context"])
+    system_prompt = append_summary_to_prompt(get_system_prompt(session["context"]), history_summary)
     
     # 调用流式生成
     full_response = ""
     tool_calls = []
+    saved = False
+    
+    # 根据模块类型选择工具集
+    from services.agents.coaching_tools import SURGERY_TOOLS
+    tools = SURGERY_TOOLS if module_type == 'surgery' else COACHING_TOOLS
     
     try:
-        # 根据模块类型选择工具集
-        from services.agents.coaching_tools import SURGERY_TOOLS
-        module_type = session["context"].get('module_type', 'coaching')
-        tools = SURGERY_TOOLS if module_type == 'surgery' else COACHING_TOOLS
-        
-        async for event in get_coaching_ai_generator(
+        # 生成被取消（无人重连）时，aclosing 保证上游流立即关闭
+        async with aclosing(get_coaching_ai_generator(
             messages=messages,
             tools=tools,
             system_prompt=system_prompt
-        ):
-            if event["type"] == "text":
-                # 发送文本增量
-                data = json.dumps({"type": "text", "content": event["content"]}, ensure_ascii=False)
-                yield f"data: {data}\n\n"
-                full_response += event["content"]
-                
-            elif event["type"] == "tool_call":
-                # 发送工具调用
-                tool_calls.append(event["content"])
-                data = json.dumps({"type": "tool_call", "content": event["content"]}, ensure_ascii=False)
-                yield f"data: {data}\n\n"
-                
-            elif event["type"] == "done":
-                # 保存助手回复到历史
-                if full_response:
-                    session["messages"].append({"role": "assistant", "content": full_response})
-                
-                # 发送完成事件
-                data = json.dumps({
-                    "type": "done",
-                    "content": full_response,
-                    "tool_calls": tool_calls
-                }, ensure_ascii=False)
-                yield f"data: {data}\n\n"
-                
-            elif event["type"] == "error":
-                data = json.dumps({"type": "error", "content": event["content"]}, ensure_ascii=False)
-                yield f"data: {data}\n\n"
+        )) as events:
+            async for event in events:
+                if event["type"] == "text":
+                    # 发送文本增量
+                    run.publish_text(event["content"])
+                    full_response += event["content"]
+                    
+                elif event["type"] == "tool_call":
+                    # 发送工具调用
+                    tool_calls.append(event["content"])
+                    run.publish({"type": "tool_call", "content": event["content"]})
+                    
+                elif event["type"] == "done":
+                    # 保存助手回复到历史
+                    if full_response:
+                        assistant_message = {"role": "assistant", "content": full_response}
+                        session["messages"].append(assistant_message)
+                        await session_store.append_messages(request.session_id, [assistant_message])
+                    saved = True
+                    
+                    # 发送完成事件
+                    run.publish({
+                        "type": "done",
+                        "content": full_response,
+                        "tool_calls": tool_calls
+                    })
+                    
+                elif event["type"] == "error":
+                    run.publish({"type": "error", "content": event["content"]})
         
-        # 更新会话
-        _chat_sessions[request.session_id] = session
+        # 历史超出保留条数时，后台把更早的消息折叠进摘要，完成后写回存储
+        chat_history.maybe_compact(request.session_id, session, module_type)
         
     except Exception as e:
-        error_data = json.dumps({"type": "error", "content": str(e)}, ensure_ascii=False)
-        yield f"data: {error_data}\n\n"
+        run.publish({"type": "error", "content": str(e)})
+    
+    finally:
+        # 生成中途结束（无人重连被取消、上游出错）时，仍保存已生成的部分回复
+        if not saved and full_response:
+            _save_partial_reply(request.session_id, full_response)
+
+
+def _resolve_resume(session_id: Optional[str], last_event_id: Optional[str]) -> Optional[Tuple[StreamRun, int]]:
+    """
+    解析 Last-Event-ID
+
+    携带了 Last-Event-ID 却无法续传时直接拒绝，不当作新一轮对话重新调用 LLM
+    （否则同一条用户消息会被回复两次）：
+    - 409: 该会话的生成仍在进行，但请求的事件已不在回放缓冲区
+    - 410: 生成已结束且超过保留期（或服务重启），应重新加载会话历史
+    """
+    if not last_event_id:
+        return None
+    resumed = chat_streams.resume(session_id, last_event_id)
+    if resumed is not None:
+        print(f"[ChatStream] Resuming {session_id} after event {last_event_id}")
+        return resumed
+    if session_id and chat_streams.is_running(session_id):
+        raise HTTPException(status_code=409, detail="Stream is still running but cannot be resumed from this event")
+    raise HTTPException(status_code=410, detail="Stream is no longer available, reload the session history")
+
+
+async def generate_sse_stream(
+    request: ChatRequest,
+    http_request: Optional[Request] = None,
+    resumed: Optional[Tuple[StreamRun, int]] = None
+):
+    """生成 SSE 事件流；resumed 不为空时从回放缓冲区续传"""
+    if resumed:
+        run, after_seq = resumed
+    else:
+        run, after_seq = chat_streams.start(request.session_id, lambda run: _run_chat_turn(request, run)), 0
+    
+    async for frame in chat_streams.attach(run, after_seq, http_request):
+        yield frame
 
 
 @router.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(
+    request: ChatRequest,
+    http_request: Request,
+    last_event_id: Optional[str] = Header(None)
+):
     """
     流式对话接口，返回 SSE 事件流
     
@@ -197,9 +249,13 @@ async def chat_stream(request: ChatRequest):
     - tool_call: 工具调用 {"type": "tool_call", "content": {"name": "...", "arguments": {...}}}
     - done: 完成 {"type": "done", "content": "完整文本", "tool_calls": [...]}
     - error: 错误 {"type": "error", "content": "错误信息"}
+    
+    每个事件带 `id:`；断线后携带 Last-Event-ID 请求头重发同一请求即可续传，
+    不会重新调用 LLM。无法续传时返回 409 / 410。
     """
+    resumed = _resolve_resume(request.session_id, last_event_id)
     return StreamingResponse(
-        generate_sse_stream(request),
+        generate_sse_stream(request, http_request, resumed),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -209,35 +265,46 @@ async def chat_stream(request: ChatRequest):
     )
 
 
-async def generate_init_stream(request: ChatRequest):
-    """生成初始化问候语的 SSE 流"""
-    print("[generate_init_stream] v3 - Using async for loop")
+async def generate_init_stream(
+    request: ChatRequest,
+    http_request: Optional[Request] = None,
+    resumed: Optional[Tuple[StreamRun, int]] = None
+):
+    """生成初始化问候语的 SSE 流；resumed 不为空时从回放缓冲区续传"""
     import uuid
+    
+    if resumed:
+        run, after_seq = resumed
+    else:
+        session_id = request.session_id or str(uuid.uuid4())
+        run, after_seq = chat_streams.start(session_id, lambda run: _run_init_turn(request, session_id, run)), 0
+    
+    async for frame in chat_streams.attach(run, after_seq, http_request):
+        yield frame
+
+
+async def _run_init_turn(request: ChatRequest, session_id: str, run: StreamRun):
+    """生成初始化问候语，事件写入 run（独立于 HTTP 连接）"""
+    print("[generate_init_stream] v3 - Using async for loop")
     from services.ai_service import get_coaching_ai_generator
     from services.agents.coaching_tools import COACHING_TOOLS, SURGERY_TOOLS
     
-    session_id = request.session_id or str(uuid.uuid4())
-    
     # 创建会话
     context = request.context or {}
     print(f"[generate_init_stream] Received context: {context}")
     print(f"[generate_init_stream] module_type in context: {context.get('module_type', 'NOT FOUND')}")
     
-    _chat_sessions[session_id] = {
-        "messages": [],
-        "context": context,
-        "wrong_count": 0
-    }
+    await session_store.create(session_id, new_session(context))
     
     # 先发送 session_id
-    yield f"data: {json.dumps({'type': 'session', 'session_id': session_id}, ensure_ascii=False)}\n\n"
+    run.publish({"type": "session", "session_id": session_id})
     
     system_prompt = get_system_prompt(context)
     
     # 检查是否全对
     if context.get("all_correct"):
         full_greeting = "太棒了！你已经做全对了！🎉 我们可以直接进入下一阶段。"
-        yield f"data: {json.dumps({'type': 'text', 'content': full_greeting}, ensure_ascii=False)}\n\n"
+        run.publish_text(full_greeting)
         # 可以选择性地发送一个完成信号或工具调用
         return
 
@@ -255,20 +322,24 @@ async def generate_init_stream(request: ChatRequest):
     tools = SURGERY_TOOLS if module_type == 'surgery' else COACHING_TOOLS
     
     try:
-        async for event in get_coaching_ai_generator(
+        async with aclosing(get_coaching_ai_generator(
             messages=[{"role": "user", "content": init_message}],
             tools=tools,
             system_prompt=system_prompt
-        ):
-            if event["type"] == "text":
-                full_greeting += event["content"]
-                # 逐块发送文本
-                data = json.dumps({"type": "text", "content": event["content"]}, ensure_ascii=False)
-                yield f"data: {data}\n\n"
-            elif event["type"] == "tool_call":
-                tool_calls.append(event["content"])
-                data = json.dumps({"type": "tool_call", "content": event["content"]}, ensure_ascii=False)
-                yield f"data: {data}\n\n"
+        )) as events:
+            async for event in events:
+                if event["type"] == "text":
+                    full_greeting += event["content"]
+                    # 逐块发送文本
+                    run.publish_text(event["content"])
+                elif event["type"] == "tool_call":
+                    tool_calls.append(event["content"])
+                    run.publish({"type": "tool_call", "content": event["content"]})
+    except asyncio.CancelledError:
+        # 客户端断开且未在宽限期内重连：保存已生成的部分问候语
+        if full_greeting:
+            _save_partial_reply(session_id, full_greeting)
+        raise
     except Exception as e:
         print(f"[ChatInit Stream] AI generation failed: {e}")
         import traceback
@@ -281,7 +352,7 @@ async def generate_init_stream(request: ChatRequest):
             question_index = context.get("question_index", 1)
             full_greeting = f"哎呀 {student_name}，第 {question_index} 题掉坑里了 🙈"
         
-        yield f"data: {json.dumps({'type': 'text', 'content': full_greeting}, ensure_ascii=False)}\n\n"
+        run.publish_text(full_greeting)
     
     # 如果 AI 只返回 tool_call 没有文本，使用 instruction 作为问候语
     if not full_greeting.strip() and tool_calls:
@@ -289,13 +360,13 @@ async def generate_init_stream(request: ChatRequest):
         instruction = tc.get("arguments", {}).get("instruction", "")
         if instruction:
             full_greeting = instruction
-            yield f"data: {json.dumps({'type': 'text', 'content': full_greeting}, ensure_ascii=False)}\n\n"
+            run.publish_text(full_greeting)
     
     # 保存到历史
-    _chat_sessions[session_id]["messages"].append({
+    await session_store.append_messages(session_id, [{
         "role": "assistant",
         "content": full_greeting
-    })
+    }])
     
     # 发送完成事件
     suggested_task = None
@@ -312,22 +383,29 @@ async def generate_init_stream(request: ChatRequest):
             "target": tc.get("arguments", {}).get("target")
         }
     
-    done_data = json.dumps({
+    run.publish({
         "type": "done",
         "greeting": full_greeting,
         "suggested_task": suggested_task,
         "tool_calls": tool_calls
-    }, ensure_ascii=False)
-    yield f"data: {done_data}\n\n"
+    })
 
 
 @router.post("/chat/init-stream")
-async def init_chat_session_stream(request: ChatRequest):
+async def init_chat_session_stream(
+    request: ChatRequest,
+    http_request: Request,
+    last_event_id: Optional[str] = Header(None)
+):
     """
     流式初始化聊天会话 - 逐字输出问候语
+    
+    断线后携带 Last-Event-ID 请求头及 session 事件中的 session_id 重发即可续传；
+    无法续传时返回 409 / 410。
     """
+    resumed = _resolve_resume(request.session_id, last_event_id)
     return StreamingResponse(
-        generate_init_stream(request),
+        generate_init_stream(request, http_request, resumed),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -352,11 +430,7 @@ async def init_chat_session(request: ChatRequest):
     
     # 创建会话
     context = request.context or {}
-    _chat_sessions[session_id] = {
-        "messages": [],
-        "context": context,
-        "wrong_count": 0
-    }
+    await session_store.create(session_id, new_session(context))
     
     # 使用 AI 生成初始问候语
     system_prompt = get_system_prompt(context)
@@ -405,10 +479,10 @@ async def init_chat_session(request: ChatRequest):
             full_greeting = instruction
     
     # 保存到历史
-    _chat_sessions[session_id]["messages"].append({
+    await session_store.append_messages(session_id, [{
         "role": "assistant",
         "content": full_greeting
-    })
+    }])
     
     # 提取 suggested_task
     suggested_task = None
@@ -433,10 +507,16 @@ async def init_chat_session(request: ChatRequest):
     }
 
 
+@router.get("/chat/streams/stats")
+async def get_chat_stream_stats():
+    """SSE 续传统计：进行中的生成、订阅者数、续传与放弃次数"""
+    return chat_streams.stats()
+
+
 @router.get("/chat/history/{session_id}")
 async def get_chat_history(session_id: str):
     """获取聊天历史"""
-    session = _chat_sessions.get(session_id)
+    session = await session_store.get(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -450,6 +530,5 @@ async def get_chat_history(session_id: str):
 @router.delete("/chat/{session_id}")
 async def delete_chat_session(session_id: str):
     """删除聊天会话"""
-    if session_id in _chat_sessions:
-        del _chat_sessions[session_id]
+    await session_store.delete(session_id)
     return {"success": True}
@@ -1,14 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, or_
+from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel
 from typing import Optional, List
+import asyncio
 
-from database import get_db
+from database import get_db, AsyncSessionLocal
 from models import VocabCard
+from services.single_flight import SingleFlight
 
 router = APIRouter(prefix="/api/vocab", tags=["vocab"])
 
+# 合并同一单词的并发查词（key: 单词 + 版本）
+_vocab_lookup_flight = SingleFlight("vocab_lookup")
+
 
 class VocabLookupRequest(BaseModel):
     word: str
@@ -31,10 +37,8 @@ async def lookup_word(request: VocabLookupRequest, db: AsyncSession = Depends(ge
     """
     查询单词信息 - 增强版
     1. 先查本地 vocab_cards 表（缓存）
-    2. 如果不存在，使用 LLM 生成完整数据并保存
+    2. 如果不存在，使用 LLM 生成完整数据并保存（并发的相同查询只生成一次）
     """
-    from services.vocab_service import vocab_service
-    
     word = request.word.lower().strip()
     
     # 构建查询条件
@@ -47,86 +51,163 @@ async def lookup_word(request: VocabLookupRequest, db: AsyncSession = Depends(ge
     result = await db.execute(query)
     vocab_card = result.scalars().first()
     
-    if not vocab_card and request.version_id:
-        # 尝试查找任意版本的同名卡片，用于复用（避免 LLM 调用）
-        fallback_query = select(VocabCard).where(VocabCard.word.ilike(word)).limit(1)
-        fallback_result = await db.execute(fallback_query)
-        existing_card = fallback_result.scalars().first()
+    if vocab_card:
+        return _card_response(vocab_card, word, request.context_sentence)
+    
+    # 本版本没有该词：同一单词的并发查询合并为一次 LLM 调用和一次入库。
+    # 合并结果是词卡本身，例句按每个调用方自己的上下文生成
+    vocab_card = await _vocab_lookup_flight.do(
+        (word, request.version_id),
+        lambda: _create_vocab_card(word, request.context_sentence, request.version_id)
+    )
+    return _card_response(vocab_card, word, request.context_sentence)
+
+
+def _card_response(
+    vocab_card: VocabCard,
+    word: str,
+    context_sentence: Optional[str]
+) -> VocabLookupResponse:
+    """词卡转为响应；提供了上下文时例句取原句中包含该词的句子"""
+    from services.vocab_service import vocab_service
+    
+    example_sentence = vocab_card.context_sentence
+    if context_sentence:
+        example_sentence = vocab_service._extract_sentence_with_word(context_sentence, word)
+    
+    return VocabLookupResponse(
+        word=vocab_card.word,
+        phonetic=vocab_card.phonetic,
+        definition=vocab_card.definition,
+        syllables=vocab_card.syllables or [],
+        example=example_sentence,
+        audio_url=vocab_card.audio_url,
+        ai_memory_hint=vocab_card.ai_memory_hint,
+    )
+
+
+async def _find_card(db: AsyncSession, word: str, version_id: Optional[int]) -> Optional[VocabCard]:
+    query = select(VocabCard).where(VocabCard.word.ilike(word))
+    if version_id:
+        query = query.where(VocabCard.version_id == version_id)
+    result = await db.execute(query.limit(1))
+    return result.scalars().first()
+
+
+async def _create_vocab_card(
+    word: str,
+    context_sentence: Optional[str],
+    version_id: Optional[int]
+) -> VocabCard:
+    """
+    为当前版本创建词卡（复用其他版本的卡片或调用 LLM 生成）
+    
+    使用独立的数据库会话，发起请求的客户端断开也不影响其他合并等待者。
+    先重新查一次本版本：上一轮合并刚结束时到达的请求，入口处的查询可能早于其入库
+    """
+    from services.vocab_service import vocab_service
+    
+    async with AsyncSessionLocal() as db:
+        existing = await _find_card(db, word, version_id)
+        if existing:
+            return existing
         
-        if existing_card:
+        # 尝试查找任意版本的同名卡片，用于复用（避免 LLM 调用）
+        existing = await _find_card(db, word, None) if version_id else None
+        if existing:
             # 复用现有卡片内容，但创建新卡片关联到当前 version_id
             new_card = VocabCard(
-                version_id=request.version_id,
-                word=existing_card.word,
-                phonetic=existing_card.phonetic,
-                definition=existing_card.definition,
-                syllables=existing_card.syllables,
-                context_sentence=request.context_sentence or existing_card.context_sentence,
-                ai_memory_hint=existing_card.ai_memory_hint,
-                audio_url=existing_card.audio_url,
-                difficulty_level=existing_card.difficulty_level
-            )
-            db.add(new_card)
-            await db.commit()
-            await db.refresh(new_card)
-            vocab_card = new_card
-
-    if vocab_card:
-        # 提取包含单词的句子（如果提供了上下文）
-        example_sentence = vocab_card.context_sentence
-        if request.context_sentence:
-            example_sentence = vocab_service._extract_sentence_with_word(
-                request.context_sentence, word
+                version_id=version_id,
+                word=existing.word,
+                phonetic=existing.phonetic,
+                definition=existing.definition,
+                syllables=existing.syllables,
+                context_sentence=context_sentence or existing.context_sentence,
+                ai_memory_hint=existing.ai_memory_hint,
+                audio_url=existing.audio_url,
+                difficulty_level=existing.difficulty_level
             )
+            return await _save_card(db, new_card, word, version_id)
+        
+        # 数据库完全没有，使用快速查词先返回基础数据
+        vocab_data = await vocab_service.generate_quick_vocab(
+            word=word,
+            context_sentence=context_sentence
+        )
         
-        return VocabLookupResponse(
-            word=vocab_card.word,
-            phonetic=vocab_card.phonetic,
-            definition=vocab_card.definition,
-            syllables=vocab_card.syllables or [],
-            example=example_sentence,
-            audio_url=vocab_card.audio_url,
-            ai_memory_hint=vocab_card.ai_memory_hint,
+        # 保存基础数据到数据库
+        new_card = VocabCard(
+            version_id=version_id,
+            word=word,
+            phonetic=vocab_data.get("phonetic"),
+            definition=vocab_data.get("definition"),
+            syllables=vocab_data.get("syllables", [word]),  # 默认不拆分
+            context_sentence=vocab_data.get("example"),
+            ai_memory_hint=None,  # 后台生成
+            audio_url=None,  # 后台生成
         )
+        saved = await _save_card(db, new_card, word, version_id)
     
-    # 数据库完全没有，使用快速查词先返回基础数据
-    import asyncio
+    if saved is new_card:
+        # 启动后台任务完善数据（音节、助记、TTS）
+        asyncio.create_task(
+            vocab_service.complete_vocab_data(
+                word=word,
+                context_sentence=context_sentence,
+                vocab_card_id=new_card.id
+            )
+        )
     
-    vocab_data = await vocab_service.generate_quick_vocab(
-        word=word,
-        context_sentence=request.context_sentence
-    )
+    return saved
+
+
+async def _save_card(db: AsyncSession, card: VocabCard, word: str, version_id: Optional[int]) -> VocabCard:
+    """入库；(version_id, word) 唯一约束冲突（其他 worker 抢先写入）时返回已有卡片"""
+    db.add(card)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        existing = await _find_card(db, word, version_id)
+        if existing is None:
+            raise
+        return existing
+    await db.refresh(card)
+    return card
+
+
+@router.post("/prewarm/{version_id}")
+async def prewarm_version_vocab(version_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    预热某个版本的全部词卡
     
-    # 保存基础数据到数据库
-    new_card = VocabCard(
-        version_id=request.version_id,
-        word=word,
-        phonetic=vocab_data.get("phonetic"),
-        definition=vocab_data.get("definition"),
-        syllables=vocab_data.get("syllables", [word]),  # 默认不拆分
-        context_sentence=vocab_data.get("example"),
-        ai_memory_hint=None,  # 后台生成
-        audio_url=None,  # 后台生成
-    )
-    db.add(new_card)
-    await db.commit()
-    await db.refresh(new_card)
+    对尚未生成助记的词卡批量调用 LLM（每次调用处理多个单词），
+    在后台完成音节、助记和 TTS，接口立即返回待处理数量
+    """
+    from services.vocab_service import vocab_service
     
-    # 启动后台任务完善数据（音节、助记、TTS）
-    asyncio.create_task(
-        vocab_service.complete_vocab_data(
-            word=word,
-            context_sentence=request.context_sentence,
-            vocab_card_id=new_card.id
+    result = await db.execute(
+        select(VocabCard).where(
+            VocabCard.version_id == version_id,
+            or_(VocabCard.ai_memory_hint.is_(None), VocabCard.ai_memory_hint == "")
         )
     )
+    cards = [
+        {
+            "id": card.id,
+            "word": card.word,
+            "context_sentence": card.context_sentence,
+            "definition": card.definition,
+            "phonetic": card.phonetic,
+        }
+        for card in result.scalars().all()
+    ]
     
-    return VocabLookupResponse(
-        word=word,
-        phonetic=vocab_data.get("phonetic"),
-        definition=vocab_data.get("definition"),
-        syllables=vocab_data.get("syllables", [word]),
-        example=vocab_data.get("example"),
-        audio_url=None,  # 后台生成中
-        ai_memory_hint=None,  # 后台生成中
-    )
+    if cards:
+        asyncio.create_task(vocab_service.complete_vocab_batch(cards))
+    
+    return {
+        "version_id": version_id,
+        "scheduled": len(cards),
+        "llm_calls": -(-len(cards) // vocab_service.batch_size)
+    }
@@ -1,151 +1,554 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict, List, Any
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Query
+from typing import Dict, List, Any, Optional
+import os
 import json
+import time
 import asyncio
 
+from services.ws_connection import ClientConnection, connection_from_env
+from services.ws_codec import FORMAT_JSON, Outbound, decode_frame, negotiate
+from services.room_state import OP_SET, RoomState, VersionGap, normalize_ops, room_state_from_env
+from services.state_throttle import StateThrottle, state_throttle_from_env
+from services.ws_pubsub import RoomBus, room_bus
+from services.ws_metrics import ws_metrics
+from services.room_snapshots import room_snapshots
+from services.async_utils import spawn_background
+
 router = APIRouter(tags=["websocket"])
 
-class ConnectionManager:
-    def __init__(self):
-        # Map client_id -> WebSocket
-        self.active_connections: Dict[str, WebSocket] = {}
+DEFAULT_ROOM = "default"
+# 客户端通过 ?sync=delta 选择增量同步协议
+SYNC_DELTA = "delta"
+
+# 心跳：每隔 WS_PING_INTERVAL_SECONDS 发送 PING；回应过 PONG 的客户端超过
+# WS_IDLE_TIMEOUT_SECONDS 没有任何消息即视为半开连接并回收。不回应 PONG 的旧客户端
+# 不做应用层回收，依赖 uvicorn 的协议层 ping（--ws-ping-interval / --ws-ping-timeout）
+PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL_SECONDS", "20"))
+IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+# 1001 Going Away：客户端按正常断线重连
+CLOSE_CODE_IDLE = 1001
+# 1012 Service Restart：服务器关闭（重新部署）时断开的连接不算学生离开，不重置房间
+CLOSE_CODE_SERVICE_RESTART = 1012
+
+
+class Room:
+    """
+    一个课堂房间
+
+    连接、角色和共享状态都按房间隔离，广播只发给本房间的客户端。
+    """
+
+    def __init__(self, room_id: str, throttle: StateThrottle):
+        self.room_id = room_id
+        # Map client_id -> ClientConnection
+        self.connections: Dict[str, ClientConnection] = {}
         # Map client_id -> role
         self.client_roles: Dict[str, str] = {}
-        # Room state (in-memory for MVP, could be Redis later)
-        self.room_state: Dict[str, Any] = {}
-
-    async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
-        print(f"✅ Client connected: {client_id}")
-        
-        # Send welcome message
-        await websocket.send_json({
+        # Room state（带版本号和增量日志，见 room_state）
+        self.state: RoomState = room_state_from_env()
+        # 高频字段（滚动进度等）的最小广播间隔
+        self.throttle = throttle
+
+    def full_state(self, recent_only: bool = False) -> dict:
+        """
+        FULL_STATE 消息；recent_only 时大列表只带最近的条目（增量协议客户端，
+        其余按 partial 通过 /api/ws/rooms/{room}/history/{key} 拉取）
+        """
+        return {
+            "type": "FULL_STATE",
+            **self.state.snapshot(recent_only),
+            "timestamp": asyncio.get_event_loop().time()
+        }
+
+    def full_state_for(self, connection: ClientConnection) -> dict:
+        return self.full_state(recent_only=connection.delta_sync)
+
+    def is_empty(self) -> bool:
+        return not self.connections
+
+
+class ConnectionManager:
+    """
+    本 worker 的连接管理
+
+    状态变更和广播经由 room_bus（见 ws_pubsub）：单 worker 时进程内直接回调，
+    多 worker 时经 Redis 分发，不同 worker 上的老师和学生也能互相同步。
+    """
+
+    def __init__(self, bus: RoomBus):
+        # Map room_id -> Room
+        self.rooms: Dict[str, Room] = {}
+        # Map client_id -> room_id
+        self.client_rooms: Dict[str, str] = {}
+        self.bus = bus
+        bus.bind(self.on_commit, self.on_broadcast, self.on_unicast)
+        self._heartbeat: Optional[asyncio.Task] = None
+        # 收到退出信号后置位（见 main.py），之后的断开都按服务器重启处理
+        self.shutting_down = False
+
+    def begin_shutdown(self):
+        """服务器开始关闭：此后断开的学生不触发房间重置，变更也不再写入快照"""
+        self.shutting_down = True
+        room_snapshots.begin_shutdown()
+
+    async def get_room(self, room_id: str) -> Room:
+        if room_id not in self.rooms:
+            room = Room(room_id, state_throttle_from_env(
+                lambda ops, sender_id, sender_role: self.publish_ops(room_id, ops, sender_id, sender_role)
+            ))
+            self.rooms[room_id] = room
+            print(f"🏫 Room created: {room_id}")
+            # 先订阅再加载快照：两者之间提交的增量由版本校验发现（VersionGap 时重新加载）
+            await self.bus.open_room(room_id)
+            # 其他 worker 上可能已有该房间的状态；单 worker 时从持久化快照恢复
+            snapshot = await self.bus.load(room_id)
+            if snapshot is None and not self.bus.shared:
+                snapshot = await room_snapshots.load(room_id)
+            if snapshot is not None and room.state.version == 0:
+                room.state.load(*snapshot)
+        return self.rooms[room_id]
+
+    def room_of(self, client_id: str) -> Optional[Room]:
+        room_id = self.client_rooms.get(client_id)
+        return self.rooms.get(room_id) if room_id is not None else None
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        client_id: str,
+        room_id: str = DEFAULT_ROOM,
+        delta_sync: bool = False,
+        wire_format: str = FORMAT_JSON,
+        subprotocol: Optional[str] = None
+    ):
+        await websocket.accept(subprotocol=subprotocol)
+        room = await self.get_room(room_id)
+        connection = connection_from_env(websocket, client_id, wire_format)
+        connection.delta_sync = delta_sync
+        connection.start()
+        room.connections[client_id] = connection
+        self.client_rooms[client_id] = room_id
+        ws_metrics.connected += 1
+        await self.bus.join(room_id, client_id)
+        if self._heartbeat is None and PING_INTERVAL > 0:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        print(f"✅ Client connected: {client_id} (room: {room_id}, format: {wire_format})")
+
+        # Send welcome message（connectedClients 为本 worker 上的连接数）
+        connection.enqueue({
             "type": "WELCOME",
             "clientId": client_id,
-            "connectedClients": len(self.active_connections),
+            "roomId": room_id,
+            "connectedClients": len(room.connections),
+            "stateVersion": room.state.version,
             "timestamp": asyncio.get_event_loop().time()
         })
-        
+
         # Sync full state if exists
-        if self.room_state:
-            await websocket.send_json({
-                "type": "FULL_STATE",
-                "payload": self.room_state,
-                "timestamp": asyncio.get_event_loop().time()
-            })
+        if room.state.data:
+            connection.enqueue(room.full_state_for(connection))
+
+    async def disconnect(self, client_id: str, code: int = 1000):
+        room = self.room_of(client_id)
+        self.client_rooms.pop(client_id, None)
+        if room is None:
+            return
 
-    async def disconnect(self, client_id: str):
         # 检查断开连接的是否是学生
-        role = self.client_roles.get(client_id)
+        role = room.client_roles.get(client_id)
         is_student = role == 'student'
-        
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-        if client_id in self.client_roles:
-            del self.client_roles[client_id]
-        print(f"❌ Client disconnected: {client_id} (role: {role})")
-        
-        # 如果学生退出，清空房间状态并通知其他客户端
-        if is_student:
-            print(f"🧹 Student left - clearing room state")
-            self.room_state = {}
-            await self.broadcast({
-                "type": "ROOM_RESET",
-                "senderId": client_id,
-                "senderRole": "student",
-                "reason": "student_left",
-                "timestamp": asyncio.get_event_loop().time()
-            })
 
-    async def broadcast(self, message: dict, sender_id: str = None):
-        for client_id, connection in self.active_connections.items():
+        connection = room.connections.pop(client_id, None)
+        if connection is not None:
+            connection.stop()
+            ws_metrics.disconnected += 1
+        room.client_roles.pop(client_id, None)
+        await self.bus.leave(room.room_id, client_id)
+        print(f"❌ Client disconnected: {client_id} (role: {role}, room: {room.room_id})")
+
+        # 如果学生退出，清空房间状态并通知其他客户端（服务器关闭 / 重启导致的断开除外）
+        if is_student and code != CLOSE_CODE_SERVICE_RESTART and not self.shutting_down:
+            print(f"🧹 Student left - clearing room state ({room.room_id})")
+            await self.reset_room(room.room_id, client_id, "student", reason="student_left")
+
+        # 本 worker 上房间已空：回收本地副本（状态保留在快照 / 其他 worker 中）
+        if room.is_empty():
+            room.throttle.clear()
+            del self.rooms[room.room_id]
+            await self.bus.close_room(room.room_id)
+            print(f"🏚️ Room closed: {room.room_id}")
+
+    async def _heartbeat_loop(self):
+        """本 worker 的心跳：一个任务轮询所有连接，而不是每个连接一个定时器"""
+        try:
+            while self.rooms:
+                await asyncio.sleep(PING_INTERVAL)
+                await self.sweep()
+        finally:
+            self._heartbeat = None
+
+    async def sweep(self):
+        """发送 PING 并回收空闲超时或写任务已放弃的连接"""
+        now = time.monotonic()
+        ping = Outbound({"type": "PING", "ts": now})
+        stale = []
+        for room in self.rooms.values():
+            for client_id, connection in room.connections.items():
+                if connection.closed or (connection.heartbeat and connection.idle_for(now) > IDLE_TIMEOUT):
+                    stale.append((client_id, connection))
+                else:
+                    connection.enqueue(ping, key="PING")
+        for client_id, connection in stale:
+            print(f"💤 Reaping unresponsive client: {client_id} (idle {connection.idle_for(now):.0f}s)")
+            ws_metrics.reaped += 1
+            await self.disconnect(client_id)
+            # 半开连接上关闭握手可能迟迟不结束，放到后台
+            spawn_background(connection.close_socket(CLOSE_CODE_IDLE))
+
+    async def reset_room(self, room_id: str, sender_id: str, sender_role: Optional[str], **extra: Any):
+        room = self.rooms.get(room_id)
+        if room is not None:
+            room.throttle.clear()
+        await self.bus.commit(room_id, {
+            "type": "ROOM_RESET",
+            "senderId": sender_id,
+            "senderRole": sender_role,
+            **extra,
+            "timestamp": asyncio.get_event_loop().time()
+        })
+
+    async def broadcast(self, room: Room, message: dict, sender_id: str = None, key: str = None):
+        """
+        发给房间内所有 worker 上的客户端：本 worker 直接放入发送队列，其他 worker 经 room_bus
+        """
+        self.deliver(room, message, sender_id, key)
+        await self.bus.broadcast(room.room_id, message, sender_id, key)
+
+    def deliver(self, room: Room, message: dict, sender_id: str = None, key: str = None):
+        """
+        放入本 worker 上每个客户端的发送队列后立即返回，不等待网络发送
+
+        key 相同的消息在队列积压时按 latest-wins 合并（见 ws_connection）。
+        消息只包装一次，每种编码格式只序列化一次。
+        """
+        outbound = Outbound(message)
+        for client_id, connection in room.connections.items():
             if client_id != sender_id:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    print(f"Error broadcasting to {client_id}: {e}")
+                connection.enqueue(outbound, key)
+
+    def deliver_delta(self, room: Room, delta: dict):
+        """
+        增量协议的客户端（包括发送者本人，用于推进其版本号）收 STATE_DELTA；
+        旧客户端收涉及字段的整体值（STATE_UPDATE），同一组字段积压时 latest-wins
+        """
+        sender_id = delta.get("senderId")
+        key = "STATE_UPDATE:" + ",".join(sorted(op["key"] for op in delta["ops"]))
+        outbound = Outbound(delta)
+        legacy = None
+        for client_id, connection in room.connections.items():
+            if connection.delta_sync:
+                # 增量不可合并：丢失的增量由客户端按缺口补拉
+                connection.enqueue(outbound)
+            elif client_id != sender_id:
+                if legacy is None:
+                    legacy = Outbound({
+                        "type": "STATE_UPDATE",
+                        "payload": room.state.touched(delta),
+                        "senderId": sender_id,
+                        "senderRole": delta.get("senderRole"),
+                        "version": delta["version"],
+                        "timestamp": delta.get("timestamp")
+                    })
+                connection.enqueue(legacy, key)
+
+    async def publish_ops(
+        self,
+        room_id: str,
+        ops: List[dict],
+        sender_id: str,
+        sender_role: Optional[str],
+        log: bool = False
+    ):
+        """提交增量；节流字段的合并更新不打印日志"""
+        ops = normalize_ops(ops)
+        if not ops:
+            return
+        if log:
+            print(f"📤 {sender_id} broadcast: {[op['key'] for op in ops]}")
+        await self.bus.commit(room_id, {
+            "type": "STATE_DELTA",
+            "ops": ops,
+            "senderId": sender_id,
+            "senderRole": sender_role,
+            "timestamp": asyncio.get_event_loop().time()
+        })
+
+    async def on_commit(self, room_id: str, message: dict):
+        """room_bus 按全局顺序送回的增量：更新本地副本并发给本 worker 的客户端"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        try:
+            committed = room.state.commit(message)
+        except VersionGap as e:
+            # 错过了部分增量（如 Redis 订阅断线）：重新加载快照并下发完整状态
+            print(f"⚠️ Room {room_id} replica out of sync ({e}), reloading")
+            await self.resync(room)
+            return
+        if committed is None:
+            return
+        if not self.bus.shared:
+            # Redis 总线时状态本身已持久化在 Redis 中
+            room_snapshots.record(room_id, committed, room.state)
+        if committed["type"] == "ROOM_RESET":
+            room.throttle.clear()
+            self.deliver(room, committed)
+        else:
+            self.deliver_delta(room, committed)
+
+    async def on_broadcast(self, room_id: str, message: dict, sender_id: Optional[str], key: Optional[str]):
+        """其他 worker 发出的普通广播"""
+        room = self.rooms.get(room_id)
+        if room is not None:
+            self.deliver(room, message, sender_id, key)
+
+    async def send_to(self, room: Room, target_id: str, message: dict) -> bool:
+        """定向发送给房间内的某个客户端（本 worker 直接入队，否则转给目标所在 worker）"""
+        connection = room.connections.get(target_id)
+        if connection is not None:
+            connection.enqueue(message)
+            return True
+        return await self.bus.send_to(room.room_id, target_id, message)
+
+    async def on_unicast(self, room_id: str, target_id: str, message: dict) -> bool:
+        """其他 worker 转来的定向消息"""
+        room = self.rooms.get(room_id)
+        connection = room.connections.get(target_id) if room is not None else None
+        if connection is None:
+            return False
+        connection.enqueue(message)
+        return True
+
+    async def resync(self, room: Room):
+        snapshot = await self.bus.load(room.room_id)
+        if snapshot is None:
+            return
+        room.state.load(*snapshot)
+        # 增量协议客户端和旧客户端各编码一次
+        outbounds = {}
+        for connection in room.connections.values():
+            if connection.delta_sync not in outbounds:
+                outbounds[connection.delta_sync] = Outbound(room.full_state_for(connection))
+            connection.enqueue(outbounds[connection.delta_sync])
 
     async def handle_message(self, client_id: str, data: dict):
+        room = self.room_of(client_id)
+        if room is None:
+            return
+
         msg_type = data.get("type")
         payload = data.get("payload", {})
         role = data.get("role")
 
+        connection = room.connections.get(client_id)
+        if connection is not None:
+            connection.touch()
+        ws_metrics.on_receive()
+
+        if msg_type == "PONG":
+            if connection is not None:
+                connection.on_pong(data.get("ts"))
+            return
+
         # Update role whenever provided (not just first time)
         if role:
-            if self.client_roles.get(client_id) != role:
-                self.client_roles[client_id] = role
+            if room.client_roles.get(client_id) != role:
+                room.client_roles[client_id] = role
                 print(f"🎭 {client_id} role set: {role}")
 
         if msg_type == "JOIN":
             # Client announcing their presence
-            print(f"👋 {client_id} joined as {role}")
+            print(f"👋 {client_id} joined {room.room_id} as {role}")
             # Role already set above
             return
 
 
-        if msg_type == "STATE_UPDATE":
-            # Update room state
-            self.room_state.update(payload)
-            print(f"📤 {client_id} broadcast: {list(payload.keys())}")
-            
-            # Broadcast to others
-            await self.broadcast({
-                "type": "STATE_UPDATE",
-                "payload": payload,
-                "senderId": client_id,
-                "senderRole": role,
-                "timestamp": asyncio.get_event_loop().time()
-            }, sender_id=client_id)
+        if msg_type in ("STATE_UPDATE", "STATE_PATCH"):
+            # STATE_UPDATE（旧协议）带字段整体值，先转换为增量；STATE_PATCH 直接带增量操作
+            if msg_type == "STATE_UPDATE":
+                if not isinstance(payload, dict):
+                    ops = []
+                elif self.bus.shared:
+                    # 共享总线时本地副本要等回显才更新，连续两条更新会按同一旧长度算出重复的追加：整体替换
+                    ops = [{"op": OP_SET, "key": key, "value": value} for key, value in payload.items()]
+                else:
+                    ops = room.state.diff(payload)
+            else:
+                ops = data.get("ops") or []
+            # 节流字段在最小间隔内只保留最新值，到期后由 throttle 回调 publish_ops
+            ops = room.throttle.split(ops, client_id, role)
+            if ops:
+                await self.publish_ops(room.room_id, ops, client_id, role, log=True)
 
-        elif msg_type == "REQUEST_FULL_STATE":
-            if client_id in self.active_connections:
-                await self.active_connections[client_id].send_json({
-                    "type": "FULL_STATE",
-                    "payload": self.room_state,
+        elif msg_type == "REQUEST_DELTAS":
+            # 客户端发现版本缺口：补发缺失的增量，日志已不完整时发送完整状态
+            since = data.get("since")
+            if connection is None:
+                return
+            deltas = room.state.deltas_since(since) if isinstance(since, int) else None
+            if deltas is None:
+                connection.enqueue(room.full_state_for(connection))
+            else:
+                connection.enqueue({
+                    "type": "STATE_DELTAS",
+                    "deltas": deltas,
+                    "version": room.state.version,
                     "timestamp": asyncio.get_event_loop().time()
                 })
 
+        elif msg_type == "REQUEST_FULL_STATE":
+            if client_id in room.connections:
+                connection = room.connections[client_id]
+                connection.enqueue(room.full_state_for(connection))
+
         elif msg_type == "RESET_ROOM":
-            print(f"🔄 {client_id} requested room reset")
-            self.room_state = {}
-            await self.broadcast({
-                "type": "ROOM_RESET",
-                "senderId": client_id,
-                "senderRole": role,
-                "timestamp": asyncio.get_event_loop().time()
-            })
+            print(f"🔄 {client_id} requested room reset ({room.room_id})")
+            await self.reset_room(room.room_id, client_id, role)
 
         elif msg_type == "WEBRTC_SIGNAL":
-            # Forward WebRTC signaling messages (offer, answer, candidate) to other clients
+            # Forward WebRTC signaling messages (offer, answer, candidate)
+            # 带 targetId 的只发给目标客户端；不带的（在场通知等）广播给其他客户端
             # Use stored role to ensure senderRole is always set
-            stored_role = self.client_roles.get(client_id, role)
-            print(f"📡 {client_id} signal: {payload.get('type')} (role: {stored_role})")
-            await self.broadcast({
+            stored_role = room.client_roles.get(client_id, role)
+            target_id = data.get("targetId")
+            print(f"📡 {client_id} signal: {payload.get('type')} (role: {stored_role}, to: {target_id or 'all'})")
+            message = {
                 "type": "WEBRTC_SIGNAL",
                 "payload": payload,
                 "senderId": client_id,
                 "senderRole": stored_role,
                 "timestamp": asyncio.get_event_loop().time()
-            }, sender_id=client_id)
+            }
+            if not target_id:
+                await self.broadcast(room, message, sender_id=client_id)
+            elif not await self.send_to(room, target_id, {**message, "targetId": target_id}):
+                # 目标已离开：通知发送方，由其关闭对应的 PeerConnection
+                if connection is not None:
+                    connection.enqueue({
+                        "type": "SIGNAL_ERROR",
+                        "reason": "target_not_found",
+                        "targetId": target_id,
+                        "signalType": payload.get("type"),
+                        "timestamp": asyncio.get_event_loop().time()
+                    })
+
+    async def history_page(self, room_id: str, key: str, before: Optional[int], limit: int) -> Optional[dict]:
+        """
+        分页读取房间列表字段的早期条目；房间不在本 worker 上时从共享总线加载一份临时副本
+        """
+        room = self.rooms.get(room_id)
+        if room is not None:
+            state = room.state
+        else:
+            snapshot = await self.bus.load(room_id) if self.bus.shared else None
+            if snapshot is None:
+                return None
+            state = room_state_from_env()
+            state.load(*snapshot)
+        return state.history_page(key, before, limit)
+
+    def stats(self) -> dict:
+        return {
+            room_id: {
+                "connections": len(room.connections),
+                "roles": self._count_roles(room),
+                "version": room.state.version,
+                "throttle": room.throttle.stats(),
+                "clients": {
+                    client_id: {"role": room.client_roles.get(client_id), **connection.stats()}
+                    for client_id, connection in room.connections.items()
+                },
+            }
+            for room_id, room in self.rooms.items()
+        }
+
+    def _count_roles(self, room: Room) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for client_id in room.connections:
+            role = room.client_roles.get(client_id) or "unknown"
+            counts[role] = counts.get(role, 0) + 1
+        return counts
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(room_bus)
+
+
+@router.get("/api/ws/stats")
+async def get_ws_stats():
+    """
+    本 worker 的 WebSocket 指标：各房间按角色的连接数、每个客户端的发送队列和心跳状态，
+    收发速率及广播延迟百分位
+    """
+    return {
+        "active_connections": sum(len(room.connections) for room in manager.rooms.values()),
+        "metrics": ws_metrics.summary(),
+        "bus": room_bus.stats(),
+        "snapshots": room_snapshots.stats(),
+        "rooms": manager.stats(),
+    }
+
+
+@router.get("/api/ws/rooms/{room_id}/history/{key}")
+async def get_room_history(
+    room_id: str,
+    key: str,
+    before: Optional[int] = Query(None, ge=0),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    房间列表字段（messages / lookups / highlights 等）的分页历史
+
+    返回下标 [start, before) 的条目，before 省略时从末尾开始；
+    客户端用 FULL_STATE.partial 中的 start 作为第一页的 before，逐页向前读取。
+    """
+    page = await manager.history_page(room_id, key, before, limit)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Room or key not found")
+    return page
+
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    room: str = Query(DEFAULT_ROOM),
+    sync: Optional[str] = Query(None),
+    wire: Optional[str] = Query(None, alias="format")
+):
     # Generate a temporary client ID (in prod, maybe from query param or auth)
     import uuid
     client_id = str(uuid.uuid4())[:8]
-    
-    await manager.connect(websocket, client_id)
-    
+
+    # 编码格式：子协议优先，其次 ?format=，默认 JSON
+    wire_format, subprotocol = negotiate(websocket.scope.get("subprotocols", []), wire)
+    await manager.connect(
+        websocket,
+        client_id,
+        room or DEFAULT_ROOM,
+        delta_sync=sync == SYNC_DELTA,
+        wire_format=wire_format,
+        subprotocol=subprotocol
+    )
+
     try:
         while True:
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            # 文本帧为 JSON，二进制帧为 MessagePack
+            data = decode_frame(message)
             await manager.handle_message(client_id, data)
-    except WebSocketDisconnect:
-        await manager.disconnect(client_id)
+    except WebSocketDisconnect as e:
+        await manager.disconnect(client_id, e.code)
     except Exception as e:
         print(f"WebSocket error: {e}")
         await manager.disconnect(client_id)
@@ -405,7 +405,8 @@ class CoachingAgent(BaseAgent):
 """
         
         try:
-            script = await ai_service.generate_text(prompt=prompt)
+            # 开场白只依赖学生名字/选项/题号，相同输入可直接复用
+            script = await ai_service.generate_text(prompt=prompt, cache=is_opening)
             return script.strip().strip('"')
         except Exception as e:
             print(f"[CoachingAgent] Script generation failed: {e}")
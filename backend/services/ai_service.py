@@ -1,84 +1,201 @@
 import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from zhipuai import ZhipuAI
 from google import genai
 from google.genai import types
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Iterable
 from dotenv import load_dotenv
 
+from services.http_clients import http_clients
+from services.llm_cache import llm_cache
+from services.single_flight import SingleFlight
+from services.llm_router import llm_router, candidates_from_env
+from services.llm_limiter import llm_limiter, estimate_tokens
+from services.llm_metrics import llm_metrics
+
 load_dotenv()
 
-class AIService:
-    def __init__(self):
-        self.default_model = os.getenv("DEFAULT_AI_MODEL", "gemini")
-        self.zhipu_api_key = os.getenv("ZHIPU_API_KEY")
-        self.gemini_api_key = os.getenv("GEMINI_API_KEY")
-        
-        self.zhipu_client = None
-        if self.zhipu_api_key:
-            self.zhipu_client = ZhipuAI(api_key=self.zhipu_api_key)
-            
-        self.gemini_client = None
-        if self.gemini_api_key:
-            self.gemini_client = genai.Client(api_key=self.gemini_api_key)
 
-    async def generate_text(self, prompt: str, model: Optional[str] = None, system_prompt: Optional[str] = None) -> str:
-        """
-        Generate text using the specified or default AI model.
-        """
-        target_model = model or self.default_model
-        
-        if target_model == "zhipu":
-            return self._generate_zhipu(prompt, system_prompt)
-        elif target_model == "gemini":
-            return self._generate_gemini(prompt, system_prompt)
-        elif target_model == "doubao":
-            return await self._generate_doubao(prompt, system_prompt)
-        else:
-            raise ValueError(f"Unsupported AI model: {target_model}")
+# ============================================================================
+# 阻塞调用隔离：没有原生 async API 的 SDK 统一放到有界线程池执行
+# ============================================================================
+
+# 线程池大小决定了同一 worker 内可同时进行的阻塞 SDK 调用数量
+_blocking_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AI_BLOCKING_MAX_WORKERS", "16")),
+    thread_name_prefix="ai-blocking"
+)
+
+_STREAM_END = object()
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """在专用线程池中执行同步 SDK 调用，避免阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, lambda: func(*args, **kwargs))
+
+
+async def iterate_blocking(
+    make_iterator: Callable[[], Iterable],
+    queue_size: int = 64,
+    close: Optional[Callable[[Any], None]] = None
+) -> AsyncIterator[Any]:
+    """
+    将同步迭代器（如 SDK 的流式响应）桥接为异步迭代器
+
+    生产者线程逐块读取并放入有界 asyncio.Queue；队列满时线程阻塞等待，
+    消费者取消迭代时线程在下一个分块处停止。传入 close 时，消费者提前结束
+    会调用 close(iterator) 关闭底层连接，使阻塞在读取上的线程立即返回。
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+    source: List[Any] = []
 
-    def _generate_zhipu(self, prompt: str, system_prompt: Optional[str] = None) -> str:
-        if not self.zhipu_client:
+    def _put(item) -> bool:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while not stopped.is_set():
+            try:
+                future.result(timeout=0.5)
+                return True
+            except FutureTimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    def _produce():
+        try:
+            iterator = make_iterator()
+            source.append(iterator)
+            for item in iterator:
+                if stopped.is_set() or not _put(item):
+                    return
+            _put(_STREAM_END)
+        except BaseException as e:  # 把异常交给消费者抛出
+            _put(e)
+
+    producer = loop.run_in_executor(_blocking_executor, _produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        if close is not None and source and not stopped.is_set() and not producer.done():
+            try:
+                close(source[0])
+            except Exception as e:
+                print(f"[AIService] Closing blocking stream failed: {e}")
+        stopped.set()
+        # 让出队列空间，确保生产者线程不会卡在 put 上
+        while not queue.empty():
+            queue.get_nowait()
+        if producer.done():
+            producer.exception()
+
+
+# ============================================================================
+# Provider 抽象：每个模型厂商一个实现，对外只暴露 async 接口
+# ============================================================================
+
+class LLMProvider:
+    """LLM 提供商基类"""
+
+    name: str = "base"
+
+    def is_configured(self) -> bool:
+        raise NotImplementedError
+
+    def model_name(self, streaming: bool = False) -> str:
+        """当前配置下实际调用的模型名（用于遥测）"""
+        raise NotImplementedError
+
+    async def generate(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+
+class ZhipuProvider(LLMProvider):
+    """智谱 GLM（SDK 无 asyncio 接口，走有界线程池）"""
+
+    name = "zhipu"
+
+    def __init__(self, api_key: Optional[str]):
+        self.client = ZhipuAI(api_key=api_key) if api_key else None
+
+    def is_configured(self) -> bool:
+        return self.client is not None
+
+    def model_name(self, streaming: bool = False) -> str:
+        return os.getenv("ZHIPU_MODEL", "glm-4-flash")
+
+    async def generate(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        if not self.client:
             raise ValueError("Zhipu API key not configured")
-            
+
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": prompt})
-        
-        response = self.zhipu_client.chat.completions.create(
-            model="glm-4-flash", 
+
+        response = await run_blocking(
+            self.client.chat.completions.create,
+            model=self.model_name(),
             messages=messages,
         )
         return response.choices[0].message.content
 
-    def _generate_gemini(self, prompt: str, system_prompt: Optional[str] = None) -> str:
-        if not self.gemini_client:
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini（使用 google-genai 的 client.aio 原生异步接口）"""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str]):
+        self.client = genai.Client(api_key=api_key) if api_key else None
+
+    def is_configured(self) -> bool:
+        return self.client is not None
+
+    def model_name(self, streaming: bool = False) -> str:
+        if os.getenv("GEMINI_THINKING_LEVEL", "off").lower() in ["low", "high"]:
+            return "gemini-3-pro-preview"
+        if streaming:
+            return os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+        return "gemini-2.0-flash"
+
+    async def generate(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        if not self.client:
             raise ValueError("Gemini API key not configured")
-            
+
         full_prompt = prompt
         if system_prompt:
             full_prompt = f"System Instruction: {system_prompt}\n\nUser Request: {prompt}"
-        
+
         # 思考级别配置
         # GEMINI_THINKING_LEVEL=off  → Gemini 2.0 Flash (最快, ~0.5-1.5s)
         # GEMINI_THINKING_LEVEL=low  → Gemini 3 + thinking_level="low" (较快, ~2-3s)
         # GEMINI_THINKING_LEVEL=high → Gemini 3 + thinking_level="high" (深度, ~3-5s)
         thinking_level = os.getenv("GEMINI_THINKING_LEVEL", "off").lower()
-        
+
         try:
             if thinking_level in ["low", "high"]:
                 # 使用 Gemini 3 思考模式
                 config = types.GenerateContentConfig(
                     thinking_config=types.ThinkingConfig(thinking_level=thinking_level)
                 )
-                response = self.gemini_client.models.generate_content(
+                response = await self.client.aio.models.generate_content(
                     model="gemini-3-pro-preview",
                     contents=full_prompt,
                     config=config
                 )
             else:
                 # 默认使用 Gemini 2.0 Flash（最快响应）
-                response = self.gemini_client.models.generate_content(
+                response = await self.client.aio.models.generate_content(
                     model="gemini-2.0-flash",
                     contents=full_prompt
                 )
@@ -88,7 +205,7 @@ class AIService:
             if thinking_level in ["low", "high"]:
                 print(f"Gemini 3 ({thinking_level}) failed: {e}, falling back to gemini-2.0-flash")
                 try:
-                    response = self.gemini_client.models.generate_content(
+                    response = await self.client.aio.models.generate_content(
                         model="gemini-2.0-flash",
                         contents=full_prompt
                     )
@@ -97,46 +214,148 @@ class AIService:
                     raise ValueError(f"Gemini generation failed: {e2}")
             raise ValueError(f"Gemini generation failed: {e}")
 
-    async def _generate_doubao(self, prompt: str, system_prompt: Optional[str] = None) -> str:
-        """使用豆包生成文本（同步调用，非流式）"""
-        import httpx
-        import json
-        
+
+class DoubaoProvider(LLMProvider):
+    """豆包 / 火山方舟（OpenAI 兼容 HTTP 接口，httpx 异步）"""
+
+    name = "doubao"
+
+    def is_configured(self) -> bool:
+        return bool(os.getenv("ARK_API_KEY"))
+
+    def model_name(self, streaming: bool = False) -> str:
+        return os.getenv("ARK_MODEL", "doubao-seed-1-8-251215")
+
+    async def generate(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        """使用豆包生成文本（非流式）"""
         api_key = os.getenv("ARK_API_KEY")
         model = os.getenv("ARK_MODEL", "doubao-seed-1-8-251215")
         base_url = os.getenv("ARK_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
-        
+
         if not api_key:
             raise ValueError("ARK_API_KEY not configured")
-        
+
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": prompt})
-        
+
         request_body = {
             "model": model,
             "messages": messages,
             "stream": False
         }
-        
+
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {api_key}"
         }
-        
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{base_url}/chat/completions",
-                json=request_body,
-                headers=headers
+
+        client = http_clients.get("doubao")
+        response = await client.post(
+            f"{base_url}/chat/completions",
+            json=request_body,
+            headers=headers
+        )
+
+        if response.status_code != 200:
+            raise ValueError(f"Doubao API error: {response.status_code} - {response.text}")
+
+        data = response.json()
+        return data["choices"][0]["message"]["content"]
+
+
+class AIService:
+    def __init__(self):
+        self.default_model = os.getenv("DEFAULT_AI_MODEL", "gemini")
+        self.zhipu_api_key = os.getenv("ZHIPU_API_KEY")
+        self.gemini_api_key = os.getenv("GEMINI_API_KEY")
+
+        self.providers: Dict[str, LLMProvider] = {
+            "zhipu": ZhipuProvider(self.zhipu_api_key),
+            "gemini": GeminiProvider(self.gemini_api_key),
+            "doubao": DoubaoProvider(),
+        }
+
+        # 保留原有属性，供流式接口等直接访问 SDK 客户端
+        self.zhipu_client = self.providers["zhipu"].client
+        self.gemini_client = self.providers["gemini"].client
+
+        self.generate_flight = SingleFlight("generate_text")
+
+    def text_candidates(self) -> List[str]:
+        """
+        未指定模型时参与路由的提供商
+
+        LLM_PROVIDERS 未配置时只使用 DEFAULT_AI_MODEL（与原行为一致）
+        """
+        names = candidates_from_env("LLM_PROVIDERS", self.default_model)
+        configured = [n for n in names if n in self.providers and self.providers[n].is_configured()]
+        return configured or [self.default_model]
+
+    def get_provider(self, name: str) -> LLMProvider:
+        provider = self.providers.get(name)
+        if provider is None:
+            raise ValueError(f"Unsupported AI model: {name}")
+        return provider
+
+    async def generate_text(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        cache: bool = False
+    ) -> str:
+        """
+        Generate text using the specified or default AI model.
+
+        未指定 model 时由 llm_router 在 LLM_PROVIDERS 中选择最快的健康提供商。
+        cache=True 时先查 LLM 响应缓存，命中则不调用模型；默认不走缓存。
+        并发中的相同请求会合并为一次上游调用。
+        """
+        if model:
+            self.get_provider(model)
+            candidates = [model]
+        else:
+            candidates = self.text_candidates()
+
+        use_cache = cache and llm_cache.enabled
+        cache_key = llm_cache.make_key(model or "auto", system_prompt, prompt)
+        if use_cache:
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        # 相同请求正在进行中时直接等待其结果，不重复调用模型
+        text = await self.generate_flight.do(
+            cache_key,
+            lambda: llm_router.call(
+                candidates,
+                lambda name: self._generate_admitted(name, prompt, system_prompt)
             )
-            
-            if response.status_code != 200:
-                raise ValueError(f"Doubao API error: {response.status_code} - {response.text}")
-            
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
+        )
+
+        if use_cache:
+            llm_cache.set(cache_key, text)
+        return text
+
+    async def _generate_admitted(self, name: str, prompt: str, system_prompt: Optional[str]) -> str:
+        """经提供商准入控制（限速 + 优先级排队）后调用模型，并记录遥测"""
+        provider = self.get_provider(name)
+        async with llm_limiter.admit(name, estimate_tokens(prompt, system_prompt)):
+            timer = llm_metrics.start(name, provider.model_name(), "text", len(prompt) + len(system_prompt or ""))
+            try:
+                text = await provider.generate(prompt, system_prompt)
+            except asyncio.CancelledError:
+                timer.finish(cancelled=True)
+                raise
+            except Exception as e:
+                timer.finish(error=e)
+                raise
+            timer.on_complete(text)
+            timer.finish()
+            return text
+
 
 # Singleton instance
 ai_service = AIService()
@@ -173,6 +392,7 @@ async def generate_stream_with_tools(
         contents.insert(0, {"role": "user", "parts": [{"text": f"[System Instruction]\n{system_prompt}"}]})
         contents.insert(1, {"role": "model", "parts": [{"text": "understood, I will follow these instructions."}]})
     
+    response_stream = None
     try:
         # 从环境变量获取模型和思考级别配置
         # GEMINI_MODEL: gemini-2.0-flash (默认), gemini-3-pro-preview, gemini-2.5-flash
@@ -219,8 +439,8 @@ async def generate_stream_with_tools(
             )
             print(f"[AIService] ⚡ Using {gemini_model} (no thinking mode)")
         
-        # 调用流式 API
-        response_stream = ai_service.gemini_client.models.generate_content_stream(
+        # 调用流式 API（client.aio 原生异步流，不占用事件循环）
+        response_stream = await ai_service.gemini_client.aio.models.generate_content_stream(
             model=gemini_model,
             contents=contents,
             config=config
@@ -229,7 +449,7 @@ async def generate_stream_with_tools(
         full_text = ""
         thinking_ended = False
         
-        for chunk in response_stream:
+        async for chunk in response_stream:
             # 检查是否是思考内容（Gemini 的 thinking 部分）
             if hasattr(chunk, 'candidates') and chunk.candidates:
                 for candidate in chunk.candidates:
@@ -274,7 +494,11 @@ async def generate_stream_with_tools(
         print(f"[AIService] Stream generation failed: {e}")
         import traceback
         traceback.print_exc()
-        yield {"type": "error", "content": str(e)}
+        yield {"type": "error", "content": str(e), "error_class": type(e).__name__}
+    finally:
+        # 提前结束（客户端断开、被对冲取消）时立即关闭上游 HTTP 流
+        if response_stream is not None and hasattr(response_stream, "aclose"):
+            await response_stream.aclose()
 
 
 def convert_tools_to_openai_format(tools: list) -> list:
@@ -305,7 +529,6 @@ async def generate_stream_with_tools_doubao(
     
     使用 OpenAI 兼容 API 格式
     """
-    import httpx
     import json
     
     api_key = os.getenv("ARK_API_KEY")
@@ -356,77 +579,77 @@ async def generate_stream_with_tools_doubao(
     yielded_tool_calls = set() # 记录已发送的工具调用索引
     
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            async with client.stream(
-                "POST",
-                f"{base_url}/chat/completions",
-                json=request_body,
-                headers=headers
-            ) as response:
-                if response.status_code != 200:
-                    error_text = await response.aread()
-                    print(f"[Doubao] API error: {response.status_code} - {error_text.decode()}")
-                    yield {"type": "error", "content": f"Doubao API error: {response.status_code}"}
-                    return
+        client = http_clients.get("doubao")
+        async with client.stream(
+            "POST",
+            f"{base_url}/chat/completions",
+            json=request_body,
+            headers=headers
+        ) as response:
+            if response.status_code != 200:
+                error_text = await response.aread()
+                print(f"[Doubao] API error: {response.status_code} - {error_text.decode()}")
+                yield {"type": "error", "content": f"Doubao API error: {response.status_code}"}
+                return
+            
+            async for line in response.aiter_lines():
+                if not line or line == "data: [DONE]":
+                    continue
                 
-                async for line in response.aiter_lines():
-                    if not line or line == "data: [DONE]":
-                        continue
-                    
-                    if line.startswith("data: "):
-                        data_str = line[6:]
-                        try:
-                            data = json.loads(data_str)
-                            choices = data.get("choices", [])
+                if line.startswith("data: "):
+                    data_str = line[6:]
+                    try:
+                        data = json.loads(data_str)
+                        choices = data.get("choices", [])
+                        
+                        for choice in choices:
+                            delta = choice.get("delta", {})
                             
-                            for choice in choices:
-                                delta = choice.get("delta", {})
-                                
-                                # 处理文本内容
-                                content = delta.get("content")
-                                if content:
-                                    full_text += content
-                                    yield {"type": "text", "content": content}
+                            # 处理文本内容
+                            content = delta.get("content")
+                            if content:
+                                full_text += content
+                                yield {"type": "text", "content": content}
+                            
+                            # 处理工具调用
+                            tool_calls = delta.get("tool_calls", [])
+                            for tc in tool_calls:
+                                idx = tc.get("index", 0)
+                                if idx not in tool_calls_buffer:
+                                    tool_calls_buffer[idx] = {
+                                        "name": "",
+                                        "arguments": ""
+                                    }
                                 
-                                # 处理工具调用
-                                tool_calls = delta.get("tool_calls", [])
-                                for tc in tool_calls:
-                                    idx = tc.get("index", 0)
-                                    if idx not in tool_calls_buffer:
-                                        tool_calls_buffer[idx] = {
-                                            "name": "",
-                                            "arguments": ""
-                                        }
-                                    
-                                    if tc.get("function", {}).get("name"):
-                                        tool_calls_buffer[idx]["name"] = tc["function"]["name"]
-                                    
-                                    if tc.get("function", {}).get("arguments"):
-                                        tool_calls_buffer[idx]["arguments"] += tc["function"]["arguments"]
+                                if tc.get("function", {}).get("name"):
+                                    tool_calls_buffer[idx]["name"] = tc["function"]["name"]
                                 
-                                # 检查是否完成
-                                finish_reason = choice.get("finish_reason")
-                                if finish_reason == "tool_calls":
-                                    # 输出收集到的工具调用
-                                    for idx, tc_data in tool_calls_buffer.items():
-                                        if idx not in yielded_tool_calls:
-                                            try:
-                                                args = json.loads(tc_data["arguments"]) if tc_data["arguments"] else {}
-                                            except json.JSONDecodeError:
-                                                args = {}
-                                            
-                                            print(f"[Doubao] 🔧 Tool call (finish_reason): {tc_data['name']}")
-                                            yield {
-                                                "type": "tool_call",
-                                                "content": {
-                                                    "name": tc_data["name"],
-                                                    "arguments": args
-                                                }
+                                if tc.get("function", {}).get("arguments"):
+                                    tool_calls_buffer[idx]["arguments"] += tc["function"]["arguments"]
+                            
+                            # 检查是否完成
+                            finish_reason = choice.get("finish_reason")
+                            if finish_reason == "tool_calls":
+                                # 输出收集到的工具调用
+                                for idx, tc_data in tool_calls_buffer.items():
+                                    if idx not in yielded_tool_calls:
+                                        try:
+                                            args = json.loads(tc_data["arguments"]) if tc_data["arguments"] else {}
+                                        except json.JSONDecodeError:
+                                            args = {}
+                                        
+                                        print(f"[Doubao] 🔧 Tool call (finish_reason): {tc_data['name']}")
+                                        yield {
+                                            "type": "tool_call",
+                                            "content": {
+                                                "name": tc_data["name"],
+                                                "arguments": args
                                             }
-                                            yielded_tool_calls.add(idx)
-                                
-                        except json.JSONDecodeError:
-                            continue
+                                        }
+                                        yielded_tool_calls.add(idx)
+                            
+                    except json.JSONDecodeError:
+                        continue
         
         # 兜底：如果流结束了但 buffer 里还有工具调用没输出
         if tool_calls_buffer:
@@ -462,7 +685,93 @@ async def generate_stream_with_tools_doubao(
         print(f"[Doubao] Stream generation failed: {e}")
         import traceback
         traceback.print_exc()
-        yield {"type": "error", "content": str(e)}
+        yield {"type": "error", "content": str(e), "error_class": type(e).__name__}
+
+
+async def generate_stream_with_tools_zhipu(
+    messages: list,
+    tools: list = None,
+    system_prompt: str = None
+):
+    """
+    使用智谱 GLM 流式生成对话响应，支持 Function Calling
+
+    智谱 SDK 只有同步流式接口，通过 iterate_blocking 在线程池中读取，
+    分块经有界队列交回事件循环。
+    """
+    import json
+
+    client = ai_service.zhipu_client
+    if not client:
+        yield {"type": "error", "content": "Zhipu API key not configured"}
+        return
+
+    model = os.getenv("ZHIPU_MODEL", "glm-4-flash")
+    print(f"[AIService] 🟦 Using Zhipu model: {model}")
+
+    openai_messages = []
+    if system_prompt:
+        openai_messages.append({"role": "system", "content": system_prompt})
+    for msg in messages:
+        role = msg.get("role", "user")
+        if role == "model":
+            role = "assistant"
+        openai_messages.append({"role": role, "content": msg.get("content", "")})
+
+    request_kwargs = {"model": model, "messages": openai_messages, "stream": True}
+    if tools:
+        request_kwargs["tools"] = convert_tools_to_openai_format(tools)
+
+    full_text = ""
+    tool_calls_buffer: Dict[int, Dict[str, str]] = {}
+
+    try:
+        async for chunk in iterate_blocking(
+            lambda: client.chat.completions.create(**request_kwargs),
+            close=lambda stream: stream.response.close()
+        ):
+            for choice in chunk.choices or []:
+                delta = choice.delta
+                if delta is None:
+                    continue
+
+                if delta.content:
+                    full_text += delta.content
+                    yield {"type": "text", "content": delta.content}
+
+                for tc in delta.tool_calls or []:
+                    idx = getattr(tc, "index", None) or 0
+                    buf = tool_calls_buffer.setdefault(idx, {"name": "", "arguments": ""})
+                    if tc.function and tc.function.name:
+                        buf["name"] = tc.function.name
+                    if tc.function and tc.function.arguments:
+                        buf["arguments"] += tc.function.arguments
+
+        for tc_data in tool_calls_buffer.values():
+            if not tc_data["name"]:
+                continue
+            try:
+                args = json.loads(tc_data["arguments"]) if tc_data["arguments"] else {}
+            except json.JSONDecodeError:
+                args = {}
+            print(f"[Zhipu] 🔧 Tool call: {tc_data['name']}")
+            yield {"type": "tool_call", "content": {"name": tc_data["name"], "arguments": args}}
+
+        print(f"[Zhipu] Stream complete. Full text length: {len(full_text)}")
+        yield {"type": "done", "content": full_text}
+
+    except Exception as e:
+        print(f"[Zhipu] Stream generation failed: {e}")
+        import traceback
+        traceback.print_exc()
+        yield {"type": "error", "content": str(e), "error_class": type(e).__name__}
+
+
+COACHING_STREAM_GENERATORS = {
+    "gemini": generate_stream_with_tools,
+    "doubao": generate_stream_with_tools_doubao,
+    "zhipu": generate_stream_with_tools_zhipu,
+}
 
 
 async def get_coaching_ai_generator(messages: list, tools: list, system_prompt: str):
@@ -472,14 +781,43 @@ async def get_coaching_ai_generator(messages: list, tools: list, system_prompt:
     COACHING_AI_PROVIDER 环境变量:
     - gemini (默认): 使用 Gemini 3 Pro
     - doubao: 使用豆包
+    - zhipu: 使用智谱 GLM
+
+    COACHING_AI_PROVIDERS=doubao,gemini 配置多个提供商时，由 llm_router
+    按首 token 延迟与健康度选择，并可对冲到第二个提供商（LLM_HEDGE_ENABLED）。
     """
-    provider = os.getenv("COACHING_AI_PROVIDER", "gemini").lower()
-    
-    if provider == "doubao":
-        print("[AIService] 🔥 Using Doubao for coaching")
-        async for event in generate_stream_with_tools_doubao(messages, tools, system_prompt):
-            yield event
-    else:
-        print("[AIService] 💎 Using Gemini for coaching")
-        async for event in generate_stream_with_tools(messages, tools, system_prompt):
-            yield event
+    default = os.getenv("COACHING_AI_PROVIDER", "gemini").lower()
+    candidates = [
+        name for name in candidates_from_env("COACHING_AI_PROVIDERS", default)
+        if name in COACHING_STREAM_GENERATORS
+    ] or ["gemini"]
+    print(f"[AIService] 🧭 Coaching providers: {candidates}")
+
+    tokens = estimate_tokens(system_prompt, *[m.get("content") for m in messages])
+    prompt_chars = len(system_prompt or "") + sum(len(m.get("content") or "") for m in messages)
+
+    async def factory(name: str):
+        # 准入许可一直持有到流结束，流式请求同样计入并发上限
+        async with llm_limiter.admit(name, tokens):
+            timer = llm_metrics.start(
+                name, ai_service.get_provider(name).model_name(streaming=True), "stream", prompt_chars
+            )
+            try:
+                async for event in COACHING_STREAM_GENERATORS[name](messages, tools, system_prompt):
+                    if event["type"] == "text":
+                        timer.on_output(event["content"])
+                    elif event["type"] == "tool_call":
+                        timer.on_tool_call()
+                    elif event["type"] == "error":
+                        timer.finish(error_class=event.get("error_class", "ProviderError"))
+                    yield event
+            except (asyncio.CancelledError, GeneratorExit):
+                timer.finish(cancelled=True)
+                raise
+            except Exception as e:
+                timer.finish(error=e)
+                raise
+            timer.finish()
+
+    async for event in llm_router.stream(candidates, factory):
+        yield event
@@ -0,0 +1,21 @@
+"""
+asyncio 工具
+"""
+import asyncio
+from typing import Set
+
+# 持有后台任务的引用，避免被提前回收
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def spawn_background(coro) -> asyncio.Task:
+    """
+    启动不受当前任务取消影响的后台任务
+
+    流被取消时，当前任务内的 await 可能再次被取消，收尾写入（如保存部分回复）
+    需要放到独立任务中完成。
+    """
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
@@ -0,0 +1,154 @@
+"""
+Chat History Manager - 对话历史压缩
+
+流式对话每轮都会重发完整历史，提示词长度和首 token 时间随对话线性增长。
+这里按模块类型控制历史预算：
+- 最近 K 条消息原样保留
+- 更早的消息折叠进一段滚动摘要（后台异步生成，不阻塞当前回复）
+- 发送给模型的历史始终不超过该模块的 token 预算
+
+会话字典中额外保存:
+    summary: 已折叠消息的摘要
+    summarized_upto: 摘要覆盖到的消息下标（不含）
+"""
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from services.llm_limiter import estimate_tokens, llm_priority, Priority
+from services.session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HistoryBudget:
+    """单个模块的历史预算"""
+    keep_recent: int       # 原样保留的最近消息数
+    max_tokens: int        # 发送历史（摘要 + 原文）的 token 上限
+
+
+DEFAULT_BUDGETS = {
+    "coaching": HistoryBudget(keep_recent=8, max_tokens=3000),
+    "surgery": HistoryBudget(keep_recent=6, max_tokens=2500),
+}
+
+
+def _budget_from_env(module_type: str, default: HistoryBudget) -> HistoryBudget:
+    prefix = f"CHAT_HISTORY_{module_type.upper()}_"
+    return HistoryBudget(
+        keep_recent=int(os.getenv(prefix + "KEEP", str(default.keep_recent))),
+        max_tokens=int(os.getenv(prefix + "BUDGET", str(default.max_tokens))),
+    )
+
+
+def _message_tokens(message: Dict) -> int:
+    return estimate_tokens(message.get("content"), completion=0) + 4
+
+
+SUMMARY_PROMPT = """你在为一段英语阅读辅导对话写滚动摘要，供 AI 助教继续教学时参考。
+
+已有摘要：
+{previous}
+
+需要并入摘要的新对话：
+{transcript}
+
+请输出更新后的摘要（中文，200 字以内），保留：学生已给出的回答和理由、已完成的教学步骤、
+学生暴露出的误区、已经发布过的任务。不要复述寒暄，不要编造内容。只输出摘要正文。"""
+
+
+class ChatHistoryManager:
+    """按模块预算裁剪历史，并在后台维护滚动摘要"""
+
+    def __init__(self):
+        self.budgets = {name: _budget_from_env(name, b) for name, b in DEFAULT_BUDGETS.items()}
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def budget_for(self, module_type: str) -> HistoryBudget:
+        if module_type not in self.budgets:
+            self.budgets[module_type] = _budget_from_env(module_type, DEFAULT_BUDGETS["coaching"])
+        return self.budgets[module_type]
+
+    def build_context(self, session: Dict, module_type: str) -> Tuple[List[Dict], Optional[str]]:
+        """
+        构建本轮发送给模型的历史
+
+        Returns:
+            (messages, summary)：summary 为空表示无需附加摘要
+        """
+        budget = self.budget_for(module_type)
+        messages = session["messages"]
+        summary = session.get("summary") or None
+        summarized_upto = session.get("summarized_upto", 0)
+
+        # 摘要未覆盖的消息按从新到旧加入，直到用完预算；
+        # 摘要尚在后台生成时，超出预算的旧消息本轮暂不发送
+        window = messages[summarized_upto:]
+
+        used = estimate_tokens(summary, completion=0) if summary else 0
+        kept: List[Dict] = []
+        for message in reversed(window):
+            cost = _message_tokens(message)
+            # 至少保留最新一条（通常是学生刚发的消息）
+            if kept and used + cost > budget.max_tokens:
+                break
+            kept.append(message)
+            used += cost
+        kept.reverse()
+        return kept, summary
+
+    def maybe_compact(self, session_id: str, session: Dict, module_type: str):
+        """
+        本轮结束后调用：若摘要之外的消息超过 keep_recent，后台折叠更早的消息，
+        完成后写回 session_store
+        """
+        budget = self.budget_for(module_type)
+        summarized_upto = session.get("summarized_upto", 0)
+        fold_upto = len(session["messages"]) - budget.keep_recent
+        if fold_upto <= summarized_upto:
+            return
+        if session_id in self._pending and not self._pending[session_id].done():
+            return
+
+        task = asyncio.create_task(self._compact(session_id, session, summarized_upto, fold_upto))
+        self._pending[session_id] = task
+        task.add_done_callback(lambda _t: self._pending.pop(session_id, None))
+
+    async def _compact(self, session_id: str, session: Dict, start: int, end: int):
+        from services.ai_service import ai_service
+
+        to_fold = session["messages"][start:end]
+        transcript = "\n".join(
+            f"{'学生' if m['role'] == 'user' else 'Jarvis'}: {m['content']}" for m in to_fold
+        )
+        prompt = SUMMARY_PROMPT.format(previous=session.get("summary") or "（无）", transcript=transcript)
+
+        try:
+            with llm_priority(Priority.BACKGROUND):
+                summary = await ai_service.generate_text(prompt=prompt)
+        except Exception as e:
+            logger.warning(f"[ChatHistory] Summary generation failed: {e}")
+            return
+
+        # 比较和写入在存储内原子完成：期间其他 worker 已推进摘要或会话被重建时放弃
+        summary = summary.strip()
+        if not await session_store.commit_summary(session_id, summary, start, end):
+            logger.info(f"[ChatHistory] Session {session_id} changed during compaction, summary discarded")
+            return
+        session["summary"] = summary
+        session["summarized_upto"] = end
+        logger.info(f"[ChatHistory] Folded messages [{start}:{end}) into summary ({len(summary)} chars)")
+
+
+def append_summary_to_prompt(system_prompt: str, summary: Optional[str]) -> str:
+    """把滚动摘要附加到系统提示词末尾"""
+    if not summary:
+        return system_prompt
+    return f"{system_prompt}\n\n## 之前的对话摘要\n{summary}"
+
+
+# 单例实例
+chat_history = ChatHistoryManager()
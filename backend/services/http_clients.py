@@ -0,0 +1,130 @@
+"""
+HTTP Client Registry - 出站 HTTP 连接池
+
+所有对外 HTTP 调用（豆包、Groq、讯飞、词典 API）共享按上游划分的
+httpx.AsyncClient，复用 DNS 解析、TCP 连接和 TLS 会话。
+
+生命周期由 main.py 的 FastAPI lifespan 管理：启动时预建连接池，
+关闭时统一释放。脚本等非应用场景下首次使用会按需创建。
+"""
+import os
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    """HTTP/2 依赖 h2 包，未安装时自动退回 HTTP/1.1"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+@dataclass
+class ClientProfile:
+    """单个上游的连接池配置"""
+    timeout: float = 30.0
+    max_connections: int = 50
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    http2: bool = False
+
+
+class HTTPClientRegistry:
+    """按上游名称管理共享的 httpx.AsyncClient"""
+
+    def __init__(self):
+        self._profiles: Dict[str, ClientProfile] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self.http2_enabled = os.getenv("HTTP2_ENABLED", "true").lower() == "true" and _http2_available()
+
+    def register(self, name: str, profile: ClientProfile):
+        """注册（或覆盖）一个上游配置；已创建的客户端在下次关闭前保持不变"""
+        self._profiles[name] = profile
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """获取指定上游的共享客户端，不存在则按配置创建"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create(name)
+            self._clients[name] = client
+        return client
+
+    def _create(self, name: str) -> httpx.AsyncClient:
+        profile = self._profiles.get(name) or ClientProfile()
+        http2 = profile.http2 and self.http2_enabled
+        logger.info(
+            f"[HTTPClients] Creating client '{name}' "
+            f"(max_connections={profile.max_connections}, http2={http2})"
+        )
+        return httpx.AsyncClient(
+            timeout=profile.timeout,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=profile.max_connections,
+                max_keepalive_connections=profile.max_keepalive_connections,
+                keepalive_expiry=profile.keepalive_expiry,
+            ),
+        )
+
+    def startup(self):
+        """应用启动时预建所有已注册的客户端"""
+        for name in self._profiles:
+            self.get(name)
+
+    async def aclose(self):
+        """关闭所有客户端并释放连接"""
+        for name, client in list(self._clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"[HTTPClients] Failed to close client '{name}': {e}")
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, Dict[str, Optional[int]]]:
+        """当前已创建的客户端概况"""
+        return {
+            name: {
+                "max_connections": self._profiles.get(name, ClientProfile()).max_connections,
+                "closed": client.is_closed,
+            }
+            for name, client in self._clients.items()
+        }
+
+
+def _int_env(key: str, default: int) -> int:
+    return int(os.getenv(key, str(default)))
+
+
+# 单例实例
+http_clients = HTTPClientRegistry()
+
+http_clients.register("doubao", ClientProfile(
+    timeout=60.0,
+    max_connections=_int_env("HTTP_DOUBAO_MAX_CONNECTIONS", 100),
+    max_keepalive_connections=_int_env("HTTP_DOUBAO_MAX_KEEPALIVE", 40),
+    http2=True,
+))
+http_clients.register("groq", ClientProfile(
+    timeout=30.0,
+    max_connections=_int_env("HTTP_GROQ_MAX_CONNECTIONS", 20),
+    http2=True,
+))
+http_clients.register("xunfei", ClientProfile(
+    timeout=30.0,
+    max_connections=_int_env("HTTP_XUNFEI_MAX_CONNECTIONS", 20),
+))
+http_clients.register("dictionary", ClientProfile(
+    timeout=10.0,
+    max_connections=_int_env("HTTP_DICTIONARY_MAX_CONNECTIONS", 20),
+))
+http_clients.register("tts", ClientProfile(
+    timeout=15.0,
+    max_connections=_int_env("HTTP_TTS_MAX_CONNECTIONS", 20),
+))
@@ -0,0 +1,26 @@
+"""
+JSON 编解码 - SSE 事件和 WebSocket 消息共用
+
+优先使用 orjson（更快，直接输出 UTF-8 字节），未安装时退回标准库。
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # 未安装时退回标准库
+    orjson = None
+
+
+def encode_json(payload: Any) -> bytes:
+    """快速 JSON 序列化（UTF-8 字节，不转义中文）"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:
+            pass  # orjson 不支持的类型（如 SDK 对象）交给标准库处理
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def decode_json(data: Union[str, bytes]) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
@@ -0,0 +1,76 @@
+"""
+LLM Response Cache - 文本生成结果缓存
+
+以 (provider, system_prompt, prompt) 的规范化哈希为键缓存 generate_text 的结果。
+容量有上限（LRU 淘汰），条目超过 TTL 自动过期，并统计命中/未命中次数。
+
+只有调用方显式传 cache=True 时才会读写缓存，适用于输入完全相同、
+输出可复用的场景（例如同一单词同一语境的快速释义）。
+"""
+import os
+import re
+import hashlib
+from typing import Optional
+
+from cachetools import TTLCache
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(text: Optional[str]) -> str:
+    """合并连续空白并去掉首尾空白，避免排版差异导致缓存未命中"""
+    if not text:
+        return ""
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class LLMResponseCache:
+    """带 TTL 的 LRU 缓存"""
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 3600.0, enabled: bool = True):
+        self.enabled = enabled
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, system_prompt: Optional[str], prompt: str) -> str:
+        raw = "\x1f".join([model, _normalize(system_prompt), _normalize(prompt)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._cache.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        if value:
+            self._cache[key] = value
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._cache),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# 单例实例
+llm_cache = LLMResponseCache(
+    maxsize=int(os.getenv("LLM_CACHE_MAXSIZE", "2048")),
+    ttl=float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600")),
+    enabled=os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true",
+)
@@ -0,0 +1,271 @@
+"""
+LLM Limiter - 按提供商的准入控制
+
+每个提供商一个 AdmissionController：
+- 令牌桶限制每秒请求数（RPS）和每分钟 token 数（TPM）
+- 限制同时进行中的请求数（流式请求占用到结束）
+- 等待者按优先级排队：交互请求（学生实时对话、查词）总是先于后台请求，
+  且后台请求不能用掉为交互请求预留的那部分额度
+
+优先级通过 ContextVar 传递，后台任务用 `with llm_priority(Priority.BACKGROUND):`
+包裹即可，无需逐层传参。SingleFlight 合并的调用由 leader 任务代为请求，
+其优先级是 FlightPriority：合并进更高优先级的调用方时提升，排队中的请求随之重新排队。
+"""
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """数值越小优先级越高"""
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class FlightPriority:
+    """
+    可提升的优先级：SingleFlight 的 leader 任务代表所有合并的调用方请求，
+    取其中最高的优先级
+    """
+
+    def __init__(self, priority: Priority):
+        self.priority = priority
+        self._listeners: Set[Callable[[], None]] = set()
+
+    def raise_to(self, priority: Priority):
+        if priority < self.priority:
+            self.priority = priority
+            for listener in list(self._listeners):
+                listener()
+
+    def bind(self):
+        """在当前上下文中使用该优先级（在 leader 任务的上下文中调用）"""
+        _current_priority.set(self)
+
+
+_current_priority: ContextVar[Union[Priority, FlightPriority]] = ContextVar("llm_priority", default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def llm_priority(priority: Priority):
+    """在当前上下文内设置 LLM 请求优先级"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> Priority:
+    priority = _current_priority.get()
+    return priority.priority if isinstance(priority, FlightPriority) else priority
+
+
+def estimate_tokens(*texts: Optional[str], completion: int = 512) -> int:
+    """粗略估算 token 数：中英混合文本按约 2 字符/token，另加预期输出"""
+    chars = sum(len(t) for t in texts if t)
+    return chars // 2 + completion
+
+
+class TokenBucket:
+    """令牌桶：capacity 为突发上限，rate 为每秒补充量"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, reserve: float = 0.0) -> float:
+        """取出 amount 后余量不低于 reserve 还需等待的秒数（0 表示可立即取出）"""
+        self._refill()
+        # 单次需求超过桶容量时，按满桶处理，避免永远无法满足
+        amount = min(amount, self.capacity - reserve)
+        missing = amount + reserve - self.tokens
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class AdmissionController:
+    """单个提供商的准入控制器"""
+
+    def __init__(
+        self,
+        name: str,
+        rps: float,
+        tpm: float,
+        max_concurrency: int,
+        background_reserve: float = 0.2
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.background_reserve = background_reserve
+        self.request_bucket = TokenBucket(rate=rps, capacity=max(1.0, rps))
+        self.token_bucket = TokenBucket(rate=tpm / 60.0, capacity=tpm)
+        self.inflight = 0
+
+        self._cond = asyncio.Condition()
+        self._heap: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        # 优先级提升后唤醒排队者的任务（持有引用，避免被提前回收）
+        self._wakeups: Set[asyncio.Task] = set()
+
+        self.admitted: Dict[str, int] = {p.name: 0 for p in Priority}
+        self.waiting: Dict[str, int] = {p.name: 0 for p in Priority}
+        self.wait_samples: Dict[str, Deque[float]] = {p.name: deque(maxlen=500) for p in Priority}
+
+    def _wait_needed(self, priority: Priority, tokens: int) -> Optional[float]:
+        """队首请求还需等待的秒数；None 表示等待并发名额释放"""
+        if self.inflight >= self.max_concurrency:
+            return None
+        if priority == Priority.BACKGROUND:
+            request_reserve = self.request_bucket.capacity * self.background_reserve
+            token_reserve = self.token_bucket.capacity * self.background_reserve
+        else:
+            request_reserve = token_reserve = 0.0
+        return max(
+            self.request_bucket.wait_time(1, request_reserve),
+            self.token_bucket.wait_time(tokens, token_reserve),
+        )
+
+    async def acquire(self, priority: Union[Priority, FlightPriority], tokens: int):
+        flight = priority if isinstance(priority, FlightPriority) else None
+        if flight is not None:
+            priority = flight.priority
+            flight._listeners.add(self._wake_soon)
+        seq = next(self._seq)
+        ticket = (int(priority), seq)
+        started = time.monotonic()
+        async with self._cond:
+            heapq.heappush(self._heap, ticket)
+            self.waiting[priority.name] += 1
+            try:
+                while True:
+                    if flight is not None and flight.priority < priority:
+                        # 合并进了更高优先级的调用方：按新优先级重新排队（保留原序号）
+                        self.waiting[priority.name] -= 1
+                        self._heap.remove(ticket)
+                        priority = flight.priority
+                        ticket = (int(priority), seq)
+                        self._heap.append(ticket)
+                        heapq.heapify(self._heap)
+                        self.waiting[priority.name] += 1
+                        self._cond.notify_all()
+                    timeout = None
+                    if self._heap[0] == ticket:
+                        timeout = self._wait_needed(priority, tokens)
+                        if timeout == 0.0:
+                            break
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                if flight is not None:
+                    flight._listeners.discard(self._wake_soon)
+                self.waiting[priority.name] -= 1
+                self._heap.remove(ticket)
+                heapq.heapify(self._heap)
+                self._cond.notify_all()
+
+            self.request_bucket.take(1)
+            self.token_bucket.take(tokens)
+            self.inflight += 1
+
+        waited = time.monotonic() - started
+        self.admitted[priority.name] += 1
+        self.wait_samples[priority.name].append(waited)
+        if waited > 1.0:
+            logger.info(f"[LLMLimiter] {self.name} {priority.name} request waited {waited:.2f}s")
+
+    async def release(self):
+        async with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    def _wake_soon(self):
+        """FlightPriority 提升时同步回调：唤醒排队者重新检查（notify 需要持有锁）"""
+        task = asyncio.get_running_loop().create_task(self._notify())
+        self._wakeups.add(task)
+        task.add_done_callback(self._wakeups.discard)
+
+    async def _notify(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        def pct(samples, q):
+            if not samples:
+                return None
+            ordered = sorted(samples)
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+        return {
+            "inflight": self.inflight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": dict(self.waiting),
+            "admitted": dict(self.admitted),
+            "wait_p50": {p: pct(s, 0.5) for p, s in self.wait_samples.items()},
+            "wait_p95": {p: pct(s, 0.95) for p, s in self.wait_samples.items()},
+            "request_tokens_available": round(self.request_bucket.tokens, 2),
+            "tpm_tokens_available": int(self.token_bucket.tokens),
+        }
+
+
+class LLMLimiter:
+    """按提供商名称管理 AdmissionController"""
+
+    def __init__(self):
+        self._controllers: Dict[str, AdmissionController] = {}
+        self.enabled = os.getenv("LLM_LIMITER_ENABLED", "true").lower() == "true"
+
+    def controller(self, provider: str) -> AdmissionController:
+        if provider not in self._controllers:
+            prefix = f"LLM_LIMIT_{provider.upper()}_"
+            self._controllers[provider] = AdmissionController(
+                name=provider,
+                rps=float(os.getenv(prefix + "RPS", os.getenv("LLM_LIMIT_RPS", "10"))),
+                tpm=float(os.getenv(prefix + "TPM", os.getenv("LLM_LIMIT_TPM", "400000"))),
+                max_concurrency=int(os.getenv(prefix + "CONCURRENCY", os.getenv("LLM_LIMIT_CONCURRENCY", "64"))),
+                background_reserve=float(os.getenv("LLM_LIMIT_BACKGROUND_RESERVE", "0.2")),
+            )
+        return self._controllers[provider]
+
+    @asynccontextmanager
+    async def admit(self, provider: str, tokens: int, priority: Optional[Priority] = None):
+        """获取准入许可，退出时释放并发名额"""
+        if not self.enabled:
+            yield
+            return
+        controller = self.controller(provider)
+        await controller.acquire(priority if priority is not None else _current_priority.get(), tokens)
+        try:
+            yield
+        finally:
+            # 流被取消时收尾的 await 可能再次被取消，shield 保证并发名额一定归还
+            await asyncio.shield(controller.release())
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: c.stats() for name, c in self._controllers.items()}
+
+
+# 单例实例
+llm_limiter = LLMLimiter()
@@ -0,0 +1,202 @@
+"""
+LLM Metrics - 单次调用遥测
+
+每次提供商调用（文本生成或流式对话）记录一条结构化指标：
+提供商、模型、提示词长度、首 token 时间、总耗时、输出速度、工具调用数、错误类型。
+
+- 最近的记录保存在进程内环形缓冲区
+- 按提供商聚合为固定分桶直方图
+- 配置 LLM_METRICS_LEDGER_PATH 后同时追加写入 JSONL 台账，便于离线分析
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 直方图分桶上界（秒），最后一个桶为 +Inf
+LATENCY_BUCKETS = [0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 21.0, 34.0, 60.0]
+
+
+@dataclass
+class LLMCallRecord:
+    """一次提供商调用的指标"""
+    provider: str
+    model: str
+    kind: str                           # text | stream
+    prompt_chars: int
+    prompt_tokens_est: int
+    priority: str = "INTERACTIVE"
+    started_at: float = field(default_factory=time.time)
+    ttft: Optional[float] = None
+    duration: Optional[float] = None
+    output_chars: int = 0
+    output_tokens_per_sec: Optional[float] = None
+    tool_calls: int = 0
+    error_class: Optional[str] = None
+    cancelled: bool = False
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class Histogram:
+    """固定分桶直方图"""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value: float):
+        self.n += 1
+        self.total += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def to_dict(self) -> dict:
+        labels = [f"le_{b}" for b in self.buckets] + ["le_inf"]
+        return {
+            "count": self.n,
+            "mean": round(self.total / self.n, 4) if self.n else None,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class CallTimer:
+    """
+    记录一次调用的上下文对象
+
+    用法:
+        timer = llm_metrics.start(provider, model, "stream", prompt_chars)
+        timer.on_output(text)      # 每个文本分块
+        timer.on_complete(text)    # 非流式调用：只记录输出长度，不记首 token 时间
+        timer.on_tool_call()
+        timer.finish(error=exc)    # 结束时调用一次
+    """
+
+    def __init__(self, registry: "LLMMetrics", record: LLMCallRecord):
+        self._registry = registry
+        self._started = time.monotonic()
+        self._finished = False
+        self.record = record
+
+    def on_output(self, text: str):
+        if self.record.ttft is None:
+            self.record.ttft = time.monotonic() - self._started
+        self.record.output_chars += len(text or "")
+
+    def on_complete(self, text: str):
+        self.record.output_chars += len(text or "")
+
+    def on_tool_call(self):
+        if self.record.ttft is None:
+            self.record.ttft = time.monotonic() - self._started
+        self.record.tool_calls += 1
+
+    def finish(self, error: Optional[BaseException] = None, error_class: Optional[str] = None, cancelled: bool = False):
+        if self._finished:
+            return
+        self._finished = True
+        rec = self.record
+        rec.duration = time.monotonic() - self._started
+        rec.cancelled = cancelled
+        if error is not None:
+            rec.error_class = type(error).__name__
+        elif error_class:
+            rec.error_class = error_class
+        # 输出速度按首 token 之后的生成时间计算；非流式调用没有首 token 时间，按总耗时计算
+        generation_time = rec.duration - rec.ttft if rec.ttft is not None else rec.duration
+        if rec.output_chars and generation_time > 0:
+            rec.output_tokens_per_sec = round((rec.output_chars / 2) / generation_time, 2)
+        self._registry.add(rec)
+
+
+class LLMMetrics:
+    """进程内指标注册表"""
+
+    def __init__(self, capacity: int = 1000, ledger_path: Optional[str] = None):
+        self.records: Deque[LLMCallRecord] = deque(maxlen=capacity)
+        self.ledger_path = ledger_path
+        self.ttft_hist: Dict[str, Histogram] = {}
+        self.duration_hist: Dict[str, Histogram] = {}
+        self.calls: Dict[str, int] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.cancelled: Dict[str, int] = {}
+
+    def start(self, provider: str, model: str, kind: str, prompt_chars: int) -> CallTimer:
+        from services.llm_limiter import current_priority
+
+        record = LLMCallRecord(
+            provider=provider,
+            model=model,
+            kind=kind,
+            prompt_chars=prompt_chars,
+            prompt_tokens_est=prompt_chars // 2,
+            priority=current_priority().name,
+        )
+        return CallTimer(self, record)
+
+    def add(self, record: LLMCallRecord):
+        self.records.append(record)
+        key = f"{record.provider}:{record.kind}"
+        self.calls[key] = self.calls.get(key, 0) + 1
+        if record.ttft is not None:
+            self.ttft_hist.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(record.ttft)
+        if record.duration is not None:
+            self.duration_hist.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(record.duration)
+        if record.cancelled:
+            self.cancelled[key] = self.cancelled.get(key, 0) + 1
+        elif record.error_class:
+            errors = self.errors.setdefault(key, {})
+            errors[record.error_class] = errors.get(record.error_class, 0) + 1
+        if self.ledger_path:
+            self._append_ledger(record)
+
+    def _append_ledger(self, record: LLMCallRecord):
+        line = json.dumps(record.to_dict(), ensure_ascii=False) + "\n"
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            loop.run_in_executor(None, self._write_line, line)
+        else:
+            self._write_line(line)
+
+    def _write_line(self, line: str):
+        try:
+            with open(self.ledger_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"[LLMMetrics] Failed to write ledger: {e}")
+
+    def recent(self, limit: int = 50) -> List[dict]:
+        if limit <= 0:
+            return []
+        return [r.to_dict() for r in list(self.records)[-limit:]]
+
+    def summary(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "errors": {k: dict(v) for k, v in self.errors.items()},
+            "cancelled": dict(self.cancelled),
+            "ttft": {k: h.to_dict() for k, h in self.ttft_hist.items()},
+            "duration": {k: h.to_dict() for k, h in self.duration_hist.items()},
+        }
+
+
+# 单例实例
+llm_metrics = LLMMetrics(
+    capacity=int(os.getenv("LLM_METRICS_BUFFER_SIZE", "1000")),
+    ledger_path=os.getenv("LLM_METRICS_LEDGER_PATH") or None,
+)
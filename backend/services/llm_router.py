@@ -0,0 +1,343 @@
+"""
+LLM Router - 基于延迟的多提供商路由
+
+为每个提供商维护 EWMA 延迟、首 token 时间（TTFT）和错误率：
+- 新请求优先路由到最快的健康提供商
+- 连续失败达到阈值后熔断一段时间，冷却后放行一次试探请求（半开）
+- 可选对冲：首选提供商在 p95 截止时间内仍未产出 token 时，
+  并行向第二个提供商发起请求，谁先出 token 用谁，另一个立即取消
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 视为"已产出 token"的流式事件类型（thinking_start 等状态事件不算）
+TOKEN_EVENT_TYPES = {"text", "tool_call", "done"}
+
+_STREAM_END = object()
+
+
+@dataclass
+class ProviderHealth:
+    """单个提供商的健康与延迟统计"""
+    name: str
+    ewma_latency: Optional[float] = None
+    ewma_ttft: Optional[float] = None
+    error_rate: float = 0.0
+    consecutive_failures: int = 0
+    circuit_open_until: float = 0.0
+    half_open_trial: bool = False
+    requests: int = 0
+    failures: int = 0
+    latency_samples: Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+    ttft_samples: Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+
+    def to_dict(self) -> dict:
+        return {
+            "ewma_latency": self.ewma_latency,
+            "ewma_ttft": self.ewma_ttft,
+            "error_rate": round(self.error_rate, 4),
+            "consecutive_failures": self.consecutive_failures,
+            "circuit_open": self.circuit_open_until > time.monotonic(),
+            "requests": self.requests,
+            "failures": self.failures,
+            "p95_latency": _percentile(self.latency_samples, 0.95),
+            "p95_ttft": _percentile(self.ttft_samples, 0.95),
+        }
+
+
+def _percentile(samples, q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _ewma(current: Optional[float], sample: float, alpha: float) -> float:
+    return sample if current is None else alpha * sample + (1 - alpha) * current
+
+
+class LLMRouter:
+    """提供商选择、熔断与对冲"""
+
+    def __init__(
+        self,
+        alpha: float = 0.3,
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 30.0,
+        hedge_enabled: bool = False,
+        hedge_default_delay: float = 2.5,
+        hedge_min_samples: int = 5
+    ):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.hedge_enabled = hedge_enabled
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_samples = hedge_min_samples
+        self._health: Dict[str, ProviderHealth] = {}
+
+    # ------------------------------------------------------------------
+    # 统计与熔断
+    # ------------------------------------------------------------------
+
+    def health(self, name: str) -> ProviderHealth:
+        if name not in self._health:
+            self._health[name] = ProviderHealth(name=name)
+        return self._health[name]
+
+    def record_success(self, name: str, latency: float, ttft: Optional[float] = None):
+        h = self.health(name)
+        h.requests += 1
+        h.ewma_latency = _ewma(h.ewma_latency, latency, self.alpha)
+        h.latency_samples.append(latency)
+        if ttft is not None:
+            h.ewma_ttft = _ewma(h.ewma_ttft, ttft, self.alpha)
+            h.ttft_samples.append(ttft)
+        h.error_rate = _ewma(h.error_rate, 0.0, self.alpha)
+        h.consecutive_failures = 0
+        h.circuit_open_until = 0.0
+        h.half_open_trial = False
+
+    def record_failure(self, name: str):
+        h = self.health(name)
+        h.requests += 1
+        h.failures += 1
+        h.error_rate = _ewma(h.error_rate, 1.0, self.alpha)
+        h.consecutive_failures += 1
+        h.half_open_trial = False
+        if h.consecutive_failures >= self.failure_threshold:
+            h.circuit_open_until = time.monotonic() + self.cooldown_seconds
+            logger.warning(
+                f"[LLMRouter] Circuit opened for '{name}' "
+                f"({h.consecutive_failures} consecutive failures, cooldown {self.cooldown_seconds}s)"
+            )
+
+    def is_available(self, name: str) -> bool:
+        """熔断关闭，或冷却结束后尚未放行试探请求"""
+        h = self.health(name)
+        if h.circuit_open_until == 0.0:
+            return True
+        if time.monotonic() < h.circuit_open_until:
+            return False
+        return not h.half_open_trial
+
+    def _acquire(self, name: str):
+        """半开状态下占用唯一的试探名额"""
+        h = self.health(name)
+        if h.circuit_open_until and time.monotonic() >= h.circuit_open_until:
+            h.half_open_trial = True
+
+    def rank(self, candidates: List[str], streaming: bool = False) -> List[str]:
+        """
+        按健康度与延迟排序
+
+        有统计数据的健康提供商按 EWMA（流式用 TTFT）升序排在前面，
+        没有数据的保持配置顺序，熔断中的放在最后作为兜底。
+        """
+        def score(item):
+            index, name = item
+            h = self.health(name)
+            metric = h.ewma_ttft if streaming and h.ewma_ttft is not None else h.ewma_latency
+            if not self.is_available(name):
+                return (2, index, 0.0)
+            if metric is None:
+                return (1, index, 0.0)
+            # 错误率作为惩罚项，避免频繁失败但偶尔很快的提供商排在前面
+            return (0, 0, metric * (1 + h.error_rate))
+
+        return [name for _, name in sorted(enumerate(candidates), key=score)]
+
+    def hedge_delay(self, name: str, streaming: bool = False) -> float:
+        """对冲截止时间：样本足够时用 p95，否则用默认值"""
+        h = self.health(name)
+        samples = h.ttft_samples if streaming else h.latency_samples
+        if len(samples) >= self.hedge_min_samples:
+            return _percentile(samples, 0.95)
+        return self.hedge_default_delay
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: h.to_dict() for name, h in self._health.items()}
+
+    # ------------------------------------------------------------------
+    # 非流式调用：排序 + 对冲 + 故障转移
+    # ------------------------------------------------------------------
+
+    async def call(self, candidates: List[str], func: Callable[[str], Awaitable[Any]]) -> Any:
+        """依次（可对冲）调用候选提供商，返回第一个成功结果"""
+        ranked = self.rank(candidates)
+        pending: Dict[asyncio.Task, str] = {}
+        started: Dict[str, float] = {}
+        last_error: Optional[BaseException] = None
+
+        def launch(name: str):
+            self._acquire(name)
+            started[name] = time.monotonic()
+            pending[asyncio.ensure_future(func(name))] = name
+
+        queue = list(ranked)
+        launch(queue.pop(0))
+        try:
+            while pending:
+                timeout = None
+                if self.hedge_enabled and queue and len(pending) == 1:
+                    only = next(iter(pending.values()))
+                    timeout = max(0.0, started[only] + self.hedge_delay(only) - time.monotonic())
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    hedge = queue.pop(0)
+                    logger.info(f"[LLMRouter] Hedging request to '{hedge}'")
+                    launch(hedge)
+                    continue
+
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        self.record_success(name, time.monotonic() - started[name])
+                        return task.result()
+                    last_error = task.exception()
+                    self.record_failure(name)
+                    logger.warning(f"[LLMRouter] Provider '{name}' failed: {last_error}")
+
+                if not pending and queue:
+                    launch(queue.pop(0))
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise last_error
+
+    # ------------------------------------------------------------------
+    # 流式调用：首 token 竞速
+    # ------------------------------------------------------------------
+
+    async def stream(
+        self,
+        candidates: List[str],
+        factory: Callable[[str], AsyncIterator[dict]]
+    ) -> AsyncIterator[dict]:
+        """
+        路由流式生成
+
+        每个已启动的提供商都在独立任务中读取到队列。第一个产出 token 事件的
+        提供商胜出，其缓冲事件先输出，其余立即取消。提供商在产出 token 前报错
+        时自动切换到下一个候选。
+        """
+        ranked = self.rank(candidates, streaming=True)
+        queue_names = list(ranked)
+        events: asyncio.Queue = asyncio.Queue()
+        runners: Dict[str, asyncio.Task] = {}
+        buffers: Dict[str, List[dict]] = {}
+        started: Dict[str, float] = {}
+        winner: Optional[str] = None
+        ttft: Optional[float] = None
+        last_error: Optional[dict] = None
+
+        async def pump(name: str):
+            try:
+                async for event in factory(name):
+                    await events.put((name, event))
+            except Exception as e:
+                await events.put((name, {"type": "error", "content": str(e)}))
+            finally:
+                await events.put((name, _STREAM_END))
+
+        def launch(name: str):
+            self._acquire(name)
+            started[name] = time.monotonic()
+            buffers[name] = []
+            runners[name] = asyncio.ensure_future(pump(name))
+
+        def cancel_others(keep: str):
+            for other, task in list(runners.items()):
+                if other != keep:
+                    task.cancel()
+                    runners.pop(other)
+
+        launch(queue_names.pop(0))
+        try:
+            while runners:
+                timeout = None
+                if winner is None and self.hedge_enabled and queue_names and len(runners) == 1:
+                    only = next(iter(runners))
+                    timeout = max(0.0, started[only] + self.hedge_delay(only, streaming=True) - time.monotonic())
+
+                try:
+                    name, event = await asyncio.wait_for(events.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    hedge = queue_names.pop(0)
+                    logger.info(f"[LLMRouter] No token yet, hedging stream to '{hedge}'")
+                    launch(hedge)
+                    continue
+
+                if name not in runners:
+                    continue  # 已取消提供商的残留事件
+
+                if event is _STREAM_END:
+                    runners.pop(name)
+                    if winner == name:
+                        break
+                    if winner is None and not runners and queue_names:
+                        launch(queue_names.pop(0))
+                    continue
+
+                if winner is None:
+                    if event.get("type") == "error":
+                        # 出 token 前失败：记录并切换
+                        last_error = event
+                        self.record_failure(name)
+                        logger.warning(f"[LLMRouter] Stream provider '{name}' failed before first token: {event.get('content')}")
+                        runners.pop(name).cancel()
+                        if not runners and queue_names:
+                            launch(queue_names.pop(0))
+                        continue
+
+                    buffers[name].append(event)
+                    if event.get("type") not in TOKEN_EVENT_TYPES:
+                        continue
+
+                    winner = name
+                    ttft = time.monotonic() - started[name]
+                    cancel_others(name)
+                    for buffered in buffers.pop(name):
+                        yield buffered
+                    if event.get("type") == "done":
+                        self.record_success(name, time.monotonic() - started[name], ttft)
+                    continue
+
+                if event.get("type") == "error":
+                    self.record_failure(name)
+                elif event.get("type") == "done":
+                    self.record_success(name, time.monotonic() - started[name], ttft)
+                yield event
+        finally:
+            for task in runners.values():
+                task.cancel()
+
+        if winner is None and last_error is not None:
+            yield last_error
+
+
+def candidates_from_env(key: str, default: str) -> List[str]:
+    """解析逗号分隔的提供商列表，如 LLM_PROVIDERS=doubao,gemini"""
+    raw = os.getenv(key) or default
+    return [name.strip().lower() for name in raw.split(",") if name.strip()]
+
+
+# 单例实例
+llm_router = LLMRouter(
+    alpha=float(os.getenv("LLM_ROUTER_EWMA_ALPHA", "0.3")),
+    failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURES", "3")),
+    cooldown_seconds=float(os.getenv("LLM_CIRCUIT_COOLDOWN_SECONDS", "30")),
+    hedge_enabled=os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true",
+    hedge_default_delay=float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECONDS", "2.5")),
+)
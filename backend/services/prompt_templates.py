@@ -0,0 +1,82 @@
+"""
+Prompt Templates - 预编译的提示词模板
+
+prompts/ 下的 Markdown 模板只在首次使用或文件修改时间变化时读取，
+读取后预先拆分为文本片段和 {{placeholder}} 占位符，渲染时一次拼接完成，
+不再对整段文本做多次 str.replace。
+
+上下文中的 JSON 数据用 compact_json 紧凑序列化，减少提示词 token。
+"""
+import os
+import re
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "prompts")
+
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
+def compact_json(value: Any) -> str:
+    """紧凑 JSON（无缩进、无多余空格，保留中文）"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class PromptTemplate:
+    """拆分为片段后的模板"""
+
+    def __init__(self, text: str):
+        self.text = text
+        # 偶数下标为原文片段，奇数下标为占位符名
+        self.parts: List[str] = _PLACEHOLDER_RE.split(text)
+        self.placeholders = set(self.parts[1::2])
+
+    def render(self, values: Optional[Dict[str, Any]] = None) -> str:
+        """单次渲染；values 中没有的占位符保持原样"""
+        if not values:
+            return self.text
+        out = []
+        for i, part in enumerate(self.parts):
+            if i % 2 == 0:
+                out.append(part)
+            elif part in values:
+                out.append(str(values[part]))
+            else:
+                out.append("{{" + part + "}}")
+        return "".join(out)
+
+
+class PromptTemplateRegistry:
+    """按文件名缓存模板，文件 mtime 变化时自动重新加载"""
+
+    def __init__(self, base_dir: str = PROMPTS_DIR):
+        self.base_dir = base_dir
+        self._cache: Dict[str, Tuple[float, PromptTemplate]] = {}
+
+    def get(self, filename: str) -> PromptTemplate:
+        path = os.path.join(self.base_dir, filename)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            logger.warning(f"[PromptTemplates] Prompt file not found: {filename}")
+            return PromptTemplate("")
+
+        cached = self._cache.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, "r", encoding="utf-8") as f:
+            template = PromptTemplate(f.read())
+        self._cache[filename] = (mtime, template)
+        logger.info(f"[PromptTemplates] Loaded {filename} ({len(template.placeholders)} placeholders)")
+        return template
+
+    def render(self, filename: str, values: Optional[Dict[str, Any]] = None) -> str:
+        return self.get(filename).render(values)
+
+
+# 单例实例
+prompt_templates = PromptTemplateRegistry()
@@ -0,0 +1,372 @@
+"""
+Room Snapshots - 房间状态持久化
+
+后端重新部署或崩溃后，房间状态不再丢失:
+- 每条已提交的增量（STATE_DELTA / ROOM_RESET）追加写入该房间的增量日志
+- 房间状态有变更后防抖写入快照（静默 snapshot_delay 秒，最长 max_delay 秒，
+  或累计 max_deltas 条增量），写完快照即清空日志
+- 启动时（接受连接之前）读取快照并重放其后的日志，在内存中重建所有房间
+
+所有写入由一个写任务按提交顺序执行，不阻塞事件循环。
+
+后端:
+- file: 每个房间 {dir}/{room}.snapshot.json + {dir}/{room}.log.jsonl（默认）
+- redis: ws:snapshot:{room}:state + ws:snapshot:{room}:log（List）
+- none: 不持久化
+
+使用 Redis 房间总线（WS_ROOM_BUS=redis）时房间状态本身已在 Redis 中，不再重复记录。
+
+配置:
+    ROOM_SNAPSHOT_STORE=file|redis|none
+    ROOM_SNAPSHOT_DIR             file 后端目录
+    ROOM_SNAPSHOT_DELAY_SECONDS   静默多久后写快照
+    ROOM_SNAPSHOT_MAX_DELAY_SECONDS / ROOM_SNAPSHOT_MAX_DELTAS
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from pathlib import Path
+from urllib.parse import quote, unquote
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.json_codec import encode_json
+from services.room_state import RoomState, VersionGap
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_DIR = Path(__file__).parent.parent / "data" / "room_snapshots"
+
+Snapshot = Tuple[int, Dict[str, Any]]
+
+
+def rebuild(snapshot: Optional[bytes], log_lines: List[bytes]) -> Snapshot:
+    """由快照和其后的增量日志重建 (version, data)；日志末尾写了一半的行被忽略"""
+    state = RoomState(log_size=0)
+    if snapshot:
+        saved = json.loads(snapshot)
+        state.load(saved["version"], saved["data"])
+    for line in log_lines:
+        try:
+            state.commit(json.loads(line))
+        except (ValueError, KeyError, VersionGap) as e:
+            logger.warning(f"[RoomSnapshots] Stopped replay at v{state.version}: {e}")
+            break
+    return state.version, state.data
+
+
+class RoomSnapshotStore:
+    """快照存储接口；backend=none 时所有操作为空"""
+
+    backend = "none"
+
+    def __init__(
+        self,
+        snapshot_delay: float = 2.0,
+        max_delay: float = 30.0,
+        max_deltas: int = 500,
+        log_flush_delay: float = 0.05
+    ):
+        self.snapshot_delay = snapshot_delay
+        self.max_delay = max_delay
+        self.max_deltas = max_deltas
+        self.log_flush_delay = log_flush_delay
+        # 启动时恢复的房间，首次进入房间时取用
+        self._restored: Dict[str, Snapshot] = {}
+        self._pending_lines: Dict[str, List[bytes]] = {}
+        # room_id -> [state, 增量数, 首次变更时间, 定时器]
+        self._dirty: Dict[str, List[Any]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._jobs: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self.snapshots = 0
+        self.logged = 0
+        # 服务器关闭中：连接断开引起的变更（如 student_left 重置）不再记录
+        self.shutting_down = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend != "none"
+
+    # ---- 提交路径（事件循环内，只记账不做 IO） ----
+
+    def record(self, room_id: str, message: Dict[str, Any], state: RoomState):
+        """记录一条已提交的增量"""
+        if not self.enabled or self._jobs is None or self.shutting_down:
+            return
+        self._pending_lines.setdefault(room_id, []).append(encode_json(message) + b"\n")
+        loop = asyncio.get_running_loop()
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.log_flush_delay, self._flush_logs)
+
+        now = time.monotonic()
+        dirty = self._dirty.get(room_id)
+        if dirty is None:
+            dirty = self._dirty[room_id] = [state, 0, now, None]
+        dirty[0] = state
+        dirty[1] += 1
+        if dirty[3] is not None:
+            dirty[3].cancel()
+        if dirty[1] >= self.max_deltas or now - dirty[2] >= self.max_delay:
+            self._snapshot(room_id)
+        else:
+            dirty[3] = loop.call_later(self.snapshot_delay, self._snapshot, room_id)
+
+    def _flush_logs(self):
+        self._flush_handle = None
+        for room_id, lines in self._pending_lines.items():
+            self.logged += len(lines)
+            self._jobs.put_nowait(("append", room_id, lines))
+        self._pending_lines = {}
+
+    def _snapshot(self, room_id: str):
+        dirty = self._dirty.pop(room_id, None)
+        if dirty is None:
+            return
+        if dirty[3] is not None:
+            dirty[3].cancel()
+        state: RoomState = dirty[0]
+        # 字段值只替换不原地修改（见 room_state），浅拷贝即可在写任务中安全序列化；
+        # 持久化完整列表（包括已移入历史的条目），恢复时按 cap 重新拆分
+        data = state.full_data()
+        # 尚未写出的日志已包含在快照里，快照写完后日志会被清空
+        self._pending_lines.pop(room_id, None)
+        if not data and self.shutting_down:
+            # 空状态会删除快照文件；关闭过程中清空的房间保留原快照，重启后恢复
+            return
+        self.snapshots += 1
+        self._jobs.put_nowait(("snapshot", room_id, state.version, data))
+
+    async def _write_loop(self):
+        while True:
+            job = await self._jobs.get()
+            try:
+                if job is None:
+                    return
+                if job[0] == "append":
+                    await self._append(job[1], job[2])
+                elif job[0] == "snapshot":
+                    await self._write_snapshot(job[1], job[2], job[3])
+                else:
+                    job[2].set_result(await self._read(job[1]))
+            except Exception as e:
+                logger.error(f"[RoomSnapshots] {job[0]} for {job[1]} failed: {e}")
+                if job[0] == "load":
+                    job[2].set_result(None)
+            finally:
+                self._jobs.task_done()
+
+    # ---- 读取 ----
+
+    async def load(self, room_id: str) -> Optional[Snapshot]:
+        """读取房间的持久化状态（排在已提交的写入之后）"""
+        if not self.enabled:
+            return None
+        restored = self._restored.pop(room_id, None)
+        if restored is not None or self._jobs is None:
+            return restored
+        future = asyncio.get_running_loop().create_future()
+        self._jobs.put_nowait(("load", room_id, future))
+        raw = await future
+        return rebuild(*raw) if raw is not None else None
+
+    async def startup(self):
+        """恢复所有房间后启动写任务"""
+        if not self.enabled:
+            return
+        started = time.monotonic()
+        for room_id in await self._room_ids():
+            raw = await self._read(room_id)
+            if raw is None:
+                continue
+            version, data = rebuild(*raw)
+            if data:
+                self._restored[room_id] = (version, data)
+        self._jobs = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+        # 恢复结果立即重写为快照并清空日志，避免新增量追加在写了一半的行之后
+        for room_id, (version, data) in self._restored.items():
+            self._jobs.put_nowait(("snapshot", room_id, version, dict(data)))
+        logger.info(
+            f"[RoomSnapshots] Restored {len(self._restored)} rooms from {self.backend} "
+            f"in {(time.monotonic() - started) * 1000:.1f}ms"
+        )
+
+    def begin_shutdown(self):
+        self.shutting_down = True
+
+    async def aclose(self):
+        """关闭前写出所有未落盘的快照"""
+        self.begin_shutdown()
+        if self._writer is None:
+            return
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for room_id in list(self._dirty):
+            self._snapshot(room_id)
+        self._jobs.put_nowait(None)
+        await self._writer
+        self._writer = None
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "snapshots": self.snapshots,
+            "logged_deltas": self.logged,
+            "dirty_rooms": len(self._dirty),
+            "restored_pending": len(self._restored),
+        }
+
+    # ---- 后端实现 ----
+
+    async def _append(self, room_id: str, lines: List[bytes]):
+        raise NotImplementedError
+
+    async def _write_snapshot(self, room_id: str, version: int, data: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def _read(self, room_id: str) -> Optional[Tuple[Optional[bytes], List[bytes]]]:
+        """返回 (快照, 日志行)；房间没有任何记录时返回 None"""
+        return None
+
+    async def _room_ids(self) -> List[str]:
+        return []
+
+
+class FileRoomSnapshotStore(RoomSnapshotStore):
+    """本地文件：快照先写临时文件再原子替换"""
+
+    backend = "file"
+
+    def __init__(self, directory: Path, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.directory = Path(directory)
+
+    def _paths(self, room_id: str) -> Tuple[Path, Path]:
+        name = quote(room_id, safe="")
+        return self.directory / f"{name}.snapshot.json", self.directory / f"{name}.log.jsonl"
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def _append(self, room_id: str, lines: List[bytes]):
+        await self._run(self._append_sync, room_id, lines)
+
+    def _append_sync(self, room_id: str, lines: List[bytes]):
+        with open(self._paths(room_id)[1], "ab") as f:
+            f.write(b"".join(lines))
+
+    async def _write_snapshot(self, room_id: str, version: int, data: Dict[str, Any]):
+        await self._run(self._write_snapshot_sync, room_id, version, data)
+
+    def _write_snapshot_sync(self, room_id: str, version: int, data: Dict[str, Any]):
+        snapshot_path, log_path = self._paths(room_id)
+        if not data:
+            # 房间已清空（如学生离开后重置），不再需要恢复
+            snapshot_path.unlink(missing_ok=True)
+            log_path.unlink(missing_ok=True)
+            return
+        tmp_path = snapshot_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(encode_json({"version": version, "data": data}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+        # 快照已包含日志中的全部增量
+        open(log_path, "wb").close()
+
+    async def _read(self, room_id: str) -> Optional[Tuple[Optional[bytes], List[bytes]]]:
+        return await self._run(self._read_sync, room_id)
+
+    def _read_sync(self, room_id: str) -> Optional[Tuple[Optional[bytes], List[bytes]]]:
+        snapshot_path, log_path = self._paths(room_id)
+        snapshot = snapshot_path.read_bytes() if snapshot_path.exists() else None
+        lines = log_path.read_bytes().splitlines() if log_path.exists() else []
+        if snapshot is None and not lines:
+            return None
+        return snapshot, lines
+
+    async def _room_ids(self) -> List[str]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        names = set()
+        for path in self.directory.iterdir():
+            for suffix in (".snapshot.json", ".log.jsonl"):
+                if path.name.endswith(suffix):
+                    names.add(unquote(path.name[:-len(suffix)]))
+        return sorted(names)
+
+
+class RedisRoomSnapshotStore(RoomSnapshotStore):
+    """Redis：快照为字符串，日志为 List"""
+
+    backend = "redis"
+
+    def __init__(self, url: str, prefix: str = "ws:snapshot", **kwargs: Any):
+        import redis.asyncio as redis
+
+        super().__init__(**kwargs)
+        self.url = url
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    def _state_key(self, room_id: str) -> str:
+        return f"{self.prefix}:{room_id}:state"
+
+    def _log_key(self, room_id: str) -> str:
+        return f"{self.prefix}:{room_id}:log"
+
+    async def _append(self, room_id: str, lines: List[bytes]):
+        await self._redis.rpush(self._log_key(room_id), *[line.rstrip(b"\n") for line in lines])
+
+    async def _write_snapshot(self, room_id: str, version: int, data: Dict[str, Any]):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            if data:
+                pipe.set(self._state_key(room_id), encode_json({"version": version, "data": data}))
+            else:
+                pipe.delete(self._state_key(room_id))
+            pipe.delete(self._log_key(room_id))
+            await pipe.execute()
+
+    async def _read(self, room_id: str) -> Optional[Tuple[Optional[bytes], List[bytes]]]:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.get(self._state_key(room_id))
+            pipe.lrange(self._log_key(room_id), 0, -1)
+            snapshot, lines = await pipe.execute()
+        if snapshot is None and not lines:
+            return None
+        return snapshot, lines
+
+    async def _room_ids(self) -> List[str]:
+        names = set()
+        start = len(self.prefix) + 1
+        async for key in self._redis.scan_iter(match=f"{self.prefix}:*"):
+            key = key.decode()
+            for suffix in (":state", ":log"):
+                if key.endswith(suffix):
+                    names.add(key[start:-len(suffix)])
+        return sorted(names)
+
+    async def aclose(self):
+        await super().aclose()
+        await self._redis.aclose()
+
+
+def create_room_snapshot_store() -> RoomSnapshotStore:
+    """按环境变量选择后端"""
+    backend = os.getenv("ROOM_SNAPSHOT_STORE", "file").lower()
+    options = {
+        "snapshot_delay": float(os.getenv("ROOM_SNAPSHOT_DELAY_SECONDS", "2")),
+        "max_delay": float(os.getenv("ROOM_SNAPSHOT_MAX_DELAY_SECONDS", "30")),
+        "max_deltas": int(os.getenv("ROOM_SNAPSHOT_MAX_DELTAS", "500")),
+    }
+    if backend == "redis":
+        return RedisRoomSnapshotStore(os.getenv("REDIS_URL", "redis://localhost:6379"), **options)
+    if backend == "file":
+        return FileRoomSnapshotStore(Path(os.getenv("ROOM_SNAPSHOT_DIR") or DEFAULT_SNAPSHOT_DIR), **options)
+    return RoomSnapshotStore(**options)
+
+
+# 单例实例
+room_snapshots = create_room_snapshot_store()
@@ -0,0 +1,243 @@
+"""
+Room State - 带版本号的房间共享状态
+
+每次变更生成一条带版本号的增量（STATE_DELTA），只包含变化的字段:
+- {"op": "set", "key": k, "value": v}        整体替换
+- {"op": "append", "key": k, "items": [...]}  列表追加（messages / highlights 等只增长的列表）
+
+增量消息带 version / baseVersion，客户端据此发现缺口（baseVersion 与本地版本不一致），
+只请求缺失的增量（REQUEST_DELTAS），不必重新拉取完整状态。
+最近的增量保留在有界日志中；请求的版本已不在日志里时退回发送 FULL_STATE。
+房间重置也作为一条增量（ROOM_RESET）记入日志，保证重放顺序正确。
+
+版本号可以在本地分配（单进程），也可以由共享存储分配（多 worker，见 ws_pubsub）：
+后者各 worker 的 RoomState 是副本，按版本顺序应用收到的增量。
+
+只增长的大列表（聊天记录、查词、高亮）按字段限制大小（ROOM_STATE_LIST_LIMITS）:
+- cap: 状态中最多保留的条数，更早的条目移入该房间的历史，按页读取（history_page）
+- recent: 增量协议客户端的 FULL_STATE 中只带最近的条数，并在 partial 中注明
+  总条数和起始下标，更早的条目由客户端按需拉取
+共享存储（Redis）同样按 cap 截断并记录每个字段已丢弃的条数（trimmed），
+从中加载的副本据此保持与其他 worker 一致的下标，只是更早的历史不可再读取。
+"""
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+OP_SET = "set"
+OP_APPEND = "append"
+
+# 字段 -> (cap, recent)
+ListLimits = Dict[str, Tuple[int, int]]
+DEFAULT_LIST_LIMITS = "messages:200:50,lookups:500:100,highlights:500:100"
+
+
+class VersionGap(Exception):
+    """副本收到的增量与本地版本不连续，需要重新加载快照"""
+
+
+def normalize_ops(ops: Any) -> List[Dict[str, Any]]:
+    """过滤客户端发来的增量操作，只保留格式正确的 set / append"""
+    normalized = []
+    for op in ops if isinstance(ops, list) else []:
+        if not isinstance(op, dict) or not isinstance(op.get("key"), str):
+            continue
+        if op.get("op") == OP_SET:
+            normalized.append({"op": OP_SET, "key": op["key"], "value": op.get("value")})
+        elif op.get("op") == OP_APPEND and isinstance(op.get("items"), list):
+            normalized.append({"op": OP_APPEND, "key": op["key"], "items": op["items"]})
+    return normalized
+
+
+class RoomState:
+    """一个房间的共享状态及最近的增量日志"""
+
+    def __init__(self, log_size: int = 256, limits: Optional[ListLimits] = None):
+        self.data: Dict[str, Any] = {}
+        self.version = 0
+        # 已广播的增量消息（STATE_DELTA / ROOM_RESET），按版本递增
+        self._log: Deque[Dict[str, Any]] = deque(maxlen=log_size)
+        self.limits: ListLimits = limits or {}
+        # 超出 cap 移出状态的早期条目（按字段，保持原顺序）
+        self.history: Dict[str, List[Any]] = {}
+        # 加载快照前已被共享存储丢弃的条目数（按字段），排在 history 之前
+        self.trimmed: Dict[str, int] = {}
+
+    def diff(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        把旧协议的 STATE_UPDATE（字段整体值）转换为增量操作
+
+        新值以当前列表为前缀时只追加新增部分，其余字段整体替换。
+        """
+        ops = []
+        for key, value in payload.items():
+            current = self.data.get(key)
+            # 旧客户端发来的是完整列表，跳过已移入历史的部分再比较
+            offset = len(self.history.get(key, ()))
+            end = offset + len(current) if isinstance(current, list) else 0
+            if (
+                isinstance(value, list)
+                and isinstance(current, list)
+                and len(value) > end
+                and value[offset:end] == current
+            ):
+                ops.append({"op": OP_APPEND, "key": key, "items": value[end:]})
+            else:
+                ops.append({"op": OP_SET, "key": key, "value": value})
+        return ops
+
+    def commit(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        应用一条 STATE_DELTA（ops 已经 normalize_ops 过滤）或 ROOM_RESET，返回记入日志的消息
+
+        不带 version 的消息在本地分配版本号；带 version 的消息已由共享存储定序，
+        重复的返回 None，不连续的抛出 VersionGap。
+        """
+        sequenced = "version" in message
+        if sequenced:
+            if message["version"] <= self.version:
+                return None
+            if message.get("baseVersion") != self.version:
+                raise VersionGap(f"expected base {self.version}, got {message.get('baseVersion')}")
+        elif message["type"] == "STATE_DELTA" and not message.get("ops"):
+            return None
+
+        if message["type"] == "ROOM_RESET":
+            self.data = {}
+            self.history = {}
+            self.trimmed = {}
+        else:
+            self._apply_ops(message["ops"])
+
+        if sequenced:
+            self.version = message["version"]
+        else:
+            message["baseVersion"] = self.version
+            self.version += 1
+            message["version"] = self.version
+        self._log.append(message)
+        return message
+
+    def _apply_ops(self, ops: List[Dict[str, Any]]):
+        # 字段值只替换不原地修改：已排队待发送的快照和日志中的值不会被之后的变更改动
+        for op in ops:
+            key = op["key"]
+            if op["op"] == OP_SET:
+                self.history.pop(key, None)
+                self.trimmed.pop(key, None)
+                self.data[key] = op["value"]
+            else:
+                current = self.data.get(key)
+                self.data[key] = (current if isinstance(current, list) else []) + op["items"]
+            self._enforce_cap(key)
+
+    def _enforce_cap(self, key: str):
+        limit = self.limits.get(key)
+        value = self.data.get(key)
+        if limit is None or not isinstance(value, list) or len(value) <= limit[0]:
+            return
+        overflow = len(value) - limit[0]
+        # 历史只以拷贝形式对外（history_page / full_data），可以原地追加
+        self.history.setdefault(key, []).extend(value[:overflow])
+        self.data[key] = value[overflow:]
+
+    def load(self, version: int, data: Dict[str, Any], trimmed: Optional[Dict[str, int]] = None):
+        """用共享存储中的快照（完整列表）替换副本；旧的增量日志随之作废"""
+        self.data = dict(data)
+        self.history = {}
+        self.trimmed = dict(trimmed or {})
+        for key in self.limits:
+            self._enforce_cap(key)
+        self.version = version
+        self._log.clear()
+
+    def value(self, key: str) -> Any:
+        """字段的完整值（包括已移入历史的条目）"""
+        history = self.history.get(key)
+        return history + self.data[key] if history else self.data.get(key)
+
+    def full_data(self) -> Dict[str, Any]:
+        """完整状态（用于持久化和旧客户端）"""
+        data = dict(self.data)
+        for key in self.history:
+            data[key] = self.value(key)
+        return data
+
+    def touched(self, delta: Dict[str, Any]) -> Dict[str, Any]:
+        """增量涉及字段的当前整体值（发给只支持 STATE_UPDATE 的旧客户端）"""
+        return {op["key"]: self.value(op["key"]) for op in delta["ops"]}
+
+    def deltas_since(self, version: int) -> Optional[List[Dict[str, Any]]]:
+        """version 之后的全部增量；日志已不完整时返回 None（应改发完整状态）"""
+        if version == self.version:
+            return []
+        if version > self.version or not self._log or self._log[0]["baseVersion"] > version:
+            return None
+        return [message for message in self._log if message["version"] > version]
+
+    def snapshot(self, recent_only: bool = False) -> Dict[str, Any]:
+        """
+        完整状态快照
+
+        recent_only 时受限字段只带最近 recent 条，partial 记录 {字段: {"total", "start"}}，
+        start 为快照中第一条的下标，更早的条目通过 history_page 读取。
+        """
+        if not recent_only:
+            return {"version": self.version, "payload": self.full_data()}
+        payload = dict(self.data)
+        partial = {}
+        for key, (_, recent) in self.limits.items():
+            value = payload.get(key)
+            if not isinstance(value, list):
+                continue
+            total = self.trimmed.get(key, 0) + len(self.history.get(key, ())) + len(value)
+            if total > recent:
+                payload[key] = value[len(value) - recent:] if recent else []
+                partial[key] = {"total": total, "start": total - recent}
+        snapshot = {"version": self.version, "payload": payload}
+        if partial:
+            snapshot["partial"] = partial
+        return snapshot
+
+    def history_page(self, key: str, before: Optional[int] = None, limit: int = 50) -> Optional[Dict[str, Any]]:
+        """
+        按下标分页读取列表字段的早期条目：返回 [start, before) 区间，before 默认为末尾
+
+        字段不存在或不是列表时返回 None。已被共享存储丢弃的条目不再返回，
+        此时 start 停在第一条可读条目的下标。
+        """
+        current = self.data.get(key)
+        if not isinstance(current, list):
+            return None
+        history = self.history.get(key, [])
+        base = self.trimmed.get(key, 0)
+        total = base + len(history) + len(current)
+        end = total if before is None else max(base, min(before, total))
+        start = max(base, end - limit)
+        # 换算为 history + current 中的下标
+        first, last = start - base, end - base
+        if last <= len(history):
+            items = history[first:last]
+        else:
+            items = history[first:] + current[max(0, first - len(history)):last - len(history)]
+        return {"key": key, "items": items, "start": start, "total": total, "version": self.version}
+
+
+def parse_list_limits(spec: str) -> ListLimits:
+    """解析 "messages:200:50,lookups:500" 形式的配置；省略 recent 时等于 cap"""
+    limits: ListLimits = {}
+    for item in spec.split(","):
+        parts = [part.strip() for part in item.split(":")]
+        if not parts[0] or len(parts) < 2:
+            continue
+        cap = int(parts[1])
+        recent = int(parts[2]) if len(parts) > 2 else cap
+        limits[parts[0]] = (cap, min(recent, cap))
+    return limits
+
+
+def room_state_from_env() -> RoomState:
+    return RoomState(
+        log_size=int(os.getenv("ROOM_DELTA_LOG_SIZE", "256")),
+        limits=parse_list_limits(os.getenv("ROOM_STATE_LIST_LIMITS", DEFAULT_LIST_LIMITS))
+    )
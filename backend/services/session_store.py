@@ -0,0 +1,273 @@
+"""
+Chat Session Store - 对话会话存储
+
+流式对话的会话（消息历史、上下文、滚动摘要）统一经由 SessionStore 读写：
+- memory: 进程内 LRU + TTL（cachetools.TTLCache），单 worker 开发环境使用
+- redis: 多 worker / 多实例共享，消息存为 Redis List（每轮只 RPUSH 新消息，
+  不重写整段历史），元数据存为 Hash，读写时顺延过期时间
+
+会话结构:
+    {
+        "messages": [{"role": ..., "content": ...}, ...],
+        "context": {...},
+        "wrong_count": 0,
+        "summary": "...",          # 可选，见 chat_history
+        "summarized_upto": 0,      # 可选
+    }
+
+配置:
+    CHAT_SESSION_STORE=memory|redis
+    CHAT_SESSION_TTL_SECONDS      闲置多久后过期
+    CHAT_SESSION_MAXSIZE          memory 后端最多保留的会话数
+    REDIS_URL                     redis 后端连接地址
+"""
+import os
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# 存在 Hash 中的会话字段（messages 单独存为 List）
+META_FIELDS = ("context", "wrong_count", "summary", "summarized_upto")
+
+
+def new_session(context: Optional[Dict] = None) -> Dict:
+    return {
+        "messages": [],
+        "context": context or {},
+        "wrong_count": 0,
+    }
+
+
+class SessionStore:
+    """会话存储接口"""
+
+    backend = "base"
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        """读取会话；返回的是副本，修改它不会影响存储"""
+        raise NotImplementedError
+
+    async def create(self, session_id: str, session: Dict):
+        """创建（或覆盖）会话"""
+        raise NotImplementedError
+
+    async def append_messages(self, session_id: str, messages: List[Dict]):
+        """向会话追加消息"""
+        raise NotImplementedError
+
+    async def update(self, session_id: str, **fields: Any):
+        """更新会话元数据字段（context / wrong_count / summary / summarized_upto）"""
+        raise NotImplementedError
+
+    async def commit_summary(self, session_id: str, summary: str, start: int, end: int) -> bool:
+        """
+        写回滚动摘要（比较并设置）
+
+        仅当存储中的 summarized_upto 仍为 start、且消息数不少于 end 时写入；
+        期间其他 worker 已推进摘要或会话被重建时返回 False，不覆盖。
+        """
+        raise NotImplementedError
+
+    async def delete(self, session_id: str):
+        raise NotImplementedError
+
+    async def startup(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.backend}
+
+
+class InMemorySessionStore(SessionStore):
+    """进程内 LRU + TTL 存储"""
+
+    backend = "memory"
+
+    def __init__(self, maxsize: int = 2000, ttl: int = 7200):
+        self._sessions: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        # 重新写入以顺延过期时间
+        self._sessions[session_id] = session
+        return {**session, "messages": list(session["messages"]), "context": dict(session["context"])}
+
+    async def create(self, session_id: str, session: Dict):
+        self._sessions[session_id] = {
+            **session,
+            "messages": list(session.get("messages", [])),
+            "context": dict(session.get("context") or {}),
+        }
+
+    async def append_messages(self, session_id: str, messages: List[Dict]):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = new_session()
+        session["messages"].extend(messages)
+        self._sessions[session_id] = session
+
+    async def update(self, session_id: str, **fields: Any):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return
+        session.update({k: v for k, v in fields.items() if k in META_FIELDS})
+        self._sessions[session_id] = session
+
+    async def commit_summary(self, session_id: str, summary: str, start: int, end: int) -> bool:
+        session = self._sessions.get(session_id)
+        if session is None or session.get("summarized_upto", 0) != start or len(session["messages"]) < end:
+            return False
+        session["summary"] = summary
+        session["summarized_upto"] = end
+        self._sessions[session_id] = session
+        return True
+
+    async def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "size": len(self._sessions),
+            "maxsize": self._sessions.maxsize,
+            "ttl": self._sessions.ttl,
+        }
+
+
+# KEYS[1] meta Hash，KEYS[2] messages List
+# ARGV[1] 期望的 summarized_upto，ARGV[2] 新的 summarized_upto，ARGV[3] 摘要 JSON，ARGV[4] TTL
+COMMIT_SUMMARY_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local current = tonumber(redis.call('HGET', KEYS[1], 'summarized_upto') or '0')
+if current ~= tonumber(ARGV[1]) or redis.call('LLEN', KEYS[2]) < tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'summary', ARGV[3], 'summarized_upto', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return 1
+"""
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis 存储
+
+    键:
+        {prefix}:{session_id}:meta      Hash，字段值为 JSON
+        {prefix}:{session_id}:messages  List，每个元素是一条消息的 JSON
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, ttl: int = 7200, prefix: str = "chat:session"):
+        import redis.asyncio as redis
+
+        self.url = url
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._commit_summary_script = self._redis.register_script(COMMIT_SUMMARY_SCRIPT)
+
+    def _meta_key(self, session_id: str) -> str:
+        return f"{self.prefix}:{session_id}:meta"
+
+    def _messages_key(self, session_id: str) -> str:
+        return f"{self.prefix}:{session_id}:messages"
+
+    def _expire(self, pipe, session_id: str):
+        pipe.expire(self._meta_key(session_id), self.ttl)
+        pipe.expire(self._messages_key(session_id), self.ttl)
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._meta_key(session_id))
+            pipe.lrange(self._messages_key(session_id), 0, -1)
+            self._expire(pipe, session_id)
+            meta, raw_messages, *_ = await pipe.execute()
+
+        if not meta:
+            return None
+        session = new_session()
+        for field, value in meta.items():
+            session[field] = json.loads(value)
+        session["messages"] = [json.loads(m) for m in raw_messages]
+        return session
+
+    async def create(self, session_id: str, session: Dict):
+        meta = {f: json.dumps(session[f], ensure_ascii=False) for f in META_FIELDS if f in session}
+        meta.setdefault("context", json.dumps({}, ensure_ascii=False))
+        messages = [json.dumps(m, ensure_ascii=False) for m in session.get("messages", [])]
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._meta_key(session_id), self._messages_key(session_id))
+            pipe.hset(self._meta_key(session_id), mapping=meta)
+            if messages:
+                pipe.rpush(self._messages_key(session_id), *messages)
+            self._expire(pipe, session_id)
+            await pipe.execute()
+
+    async def append_messages(self, session_id: str, messages: List[Dict]):
+        if not messages:
+            return
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(self._messages_key(session_id), *[json.dumps(m, ensure_ascii=False) for m in messages])
+            self._expire(pipe, session_id)
+            await pipe.execute()
+
+    async def update(self, session_id: str, **fields: Any):
+        meta = {k: json.dumps(v, ensure_ascii=False) for k, v in fields.items() if k in META_FIELDS}
+        if not meta:
+            return
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._meta_key(session_id), mapping=meta)
+            self._expire(pipe, session_id)
+            await pipe.execute()
+
+    async def commit_summary(self, session_id: str, summary: str, start: int, end: int) -> bool:
+        committed = await self._commit_summary_script(
+            keys=[self._meta_key(session_id), self._messages_key(session_id)],
+            args=[start, end, json.dumps(summary, ensure_ascii=False), self.ttl]
+        )
+        return bool(committed)
+
+    async def delete(self, session_id: str):
+        await self._redis.delete(self._meta_key(session_id), self._messages_key(session_id))
+
+    async def startup(self):
+        await self._redis.ping()
+        logger.info(f"[SessionStore] Connected to Redis at {self.url}")
+
+    async def aclose(self):
+        await self._redis.aclose()
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "ttl": self.ttl, "prefix": self.prefix}
+
+
+def create_session_store() -> SessionStore:
+    """按环境变量选择后端"""
+    backend = os.getenv("CHAT_SESSION_STORE", "memory").lower()
+    ttl = int(os.getenv("CHAT_SESSION_TTL_SECONDS", "7200"))
+    if backend == "redis":
+        url = os.getenv("REDIS_URL", "redis://localhost:6379")
+        return RedisSessionStore(url, ttl=ttl)
+    return InMemorySessionStore(
+        maxsize=int(os.getenv("CHAT_SESSION_MAXSIZE", "2000")),
+        ttl=ttl,
+    )
+
+
+# 单例实例
+session_store = create_session_store()
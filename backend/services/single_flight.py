@@ -0,0 +1,67 @@
+"""
+Single Flight - 相同请求合并
+
+同一个 key 在执行期间再次被调用时，不会重复发起上游请求，
+而是等待第一次调用（leader）的结果。典型场景：老师推送词汇环节后，
+几十个学生在同一秒点击同一个单词。
+
+leader 以独立 Task 运行并用 asyncio.shield 保护，
+某个调用方断开（被取消）不会影响其他等待者拿到结果。
+
+leader 代表所有合并的调用方请求 LLM：优先级取其中最高的（见 llm_limiter.FlightPriority），
+后台预热发起的 leader 合并进学生的实时查词后，不再按后台优先级排队。
+"""
+import asyncio
+import logging
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from services.llm_limiter import FlightPriority, current_priority
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """按 key 合并并发中的相同调用"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._priorities: Dict[Hashable, FlightPriority] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 func；若相同 key 正在执行，则等待其结果"""
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            self._priorities[key].raise_to(current_priority())
+            logger.debug(f"[SingleFlight:{self.name}] Coalesced call for {key!r}")
+        else:
+            # leader 在复制的上下文中运行，优先级显式设为可提升的 FlightPriority
+            priority = FlightPriority(current_priority())
+            context = contextvars.copy_context()
+            context.run(priority.bind)
+            task = asyncio.get_running_loop().create_task(func(), context=context)
+            self._inflight[key] = task
+            self._priorities[key] = priority
+            task.add_done_callback(lambda _t, k=key: self._forget(k, _t))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._priorities[key]
+        # 所有等待者都已取消时也要消费掉异常，避免 "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "inflight": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
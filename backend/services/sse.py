@@ -0,0 +1,303 @@
+"""
+SSE 工具 - 流式响应的公共部分
+
+ClientDisconnectWatcher 检测客户端断开（学生关闭页面、前端 abort fetch）：
+订阅者在等待上游事件的间隙检查，断开后自行结束；无人重连时由 StreamRegistry
+取消生成，使上游 httpx 流 / Gemini 迭代器随之关闭，不再继续消耗提供商配额。
+
+StreamRegistry 支持断线续传：每个事件带 `id:`，按会话保留有界回放缓冲区；
+教室 Wi-Fi 断开后客户端携带 Last-Event-ID 重连，从缓冲区补发并接上仍在进行
+的生成，而不是重新调用一次 LLM。
+
+文本增量在 StreamRun 内按时间/大小窗口合并后才成帧（默认 30ms 或 64 字节），
+tool_call / done / error 等事件立即发出；事件用 orjson 序列化一次，所有订阅者共享。
+"""
+import os
+import time
+import uuid
+import asyncio
+import itertools
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from starlette.requests import Request
+
+from services.json_codec import encode_json
+
+logger = logging.getLogger(__name__)
+
+class ClientDisconnectWatcher:
+    """
+    用法:
+        watcher = ClientDisconnectWatcher(http_request)
+        async for seq, data in run.subscribe(after_seq, watcher):
+            yield ...
+
+    不另起 receive() 消费者，也不从外部取消响应任务（任务可能正挂起在 Starlette 的
+    send 中）：生成器在等待上游事件时每 poll_interval 秒调用一次 check()，
+    客户端断开后由生成器自己正常结束。
+    """
+
+    def __init__(self, http_request: Optional[Request], poll_interval: float = 1.0):
+        self.http_request = http_request
+        self.poll_interval = poll_interval
+        self.disconnected = False
+
+    async def check(self) -> bool:
+        """客户端是否已断开"""
+        if self.http_request is None or self.disconnected:
+            return self.disconnected
+        if await self.http_request.is_disconnected():
+            self.disconnected = True
+            logger.info(f"[SSE] Client disconnected: {self.http_request.url.path}")
+        return self.disconnected
+
+
+def format_sse(data: bytes, event_id: Optional[str] = None) -> bytes:
+    """编码一个 SSE 帧；data 为已序列化的 JSON"""
+    if event_id is None:
+        return b"data: " + data + b"\n\n"
+    return b"id: " + event_id.encode() + b"\ndata: " + data + b"\n\n"
+
+
+class StreamRun:
+    """
+    一次流式生成
+
+    生成在独立任务中进行，事件按自增序号写入有界回放缓冲区；HTTP 响应只是订阅者。
+    事件 ID 形如 "{run_id}-{seq}"，断线重连时通过 Last-Event-ID 找回续传位置。
+
+    文本增量通过 publish_text 写入：第一段立即发出（不增加首 token 延迟），之后的
+    增量攒到 coalesce_bytes 字节或等待 coalesce_delay 秒后合并为一帧。
+    """
+
+    def __init__(self, key: str, buffer_size: int, coalesce_delay: float = 0.03, coalesce_bytes: int = 64):
+        self.key = key
+        self.run_id = uuid.uuid4().hex[:8]
+        self.events: Deque[Tuple[int, bytes]] = deque(maxlen=buffer_size)
+        self.seq = 0
+        self.coalesce_delay = coalesce_delay
+        self.coalesce_bytes = coalesce_bytes
+        self.text_deltas = 0
+        self._pending_text: List[str] = []
+        self._pending_bytes = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._grace_handle: Optional[asyncio.TimerHandle] = None
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.run_id}-{seq}"
+
+    def publish(self, payload: Dict[str, Any]):
+        """追加事件并立即发出（只序列化一次，所有订阅者共享）"""
+        self.flush_text()
+        self._append(payload)
+
+    def publish_text(self, content: str):
+        """追加文本增量，按时间/大小窗口合并"""
+        if not content:
+            return
+        self.text_deltas += 1
+        if self.text_deltas == 1 or self.coalesce_delay <= 0:
+            self._append({"type": "text", "content": content})
+            return
+
+        self._pending_text.append(content)
+        self._pending_bytes += len(content.encode("utf-8"))
+        if self._pending_bytes >= self.coalesce_bytes:
+            self.flush_text()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.coalesce_delay, self.flush_text)
+
+    def flush_text(self):
+        """把待合并的文本作为一帧发出"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending_text:
+            return
+        content = "".join(self._pending_text)
+        self._pending_text.clear()
+        self._pending_bytes = 0
+        self._append({"type": "text", "content": content})
+
+    def _append(self, payload: Dict[str, Any]):
+        self.seq += 1
+        self.events.append((self.seq, encode_json(payload)))
+        self._notify()
+
+    def finish(self):
+        self.flush_text()
+        self.finished = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def can_resume(self, after_seq: int) -> bool:
+        """after_seq 之后的事件是否仍全部在缓冲区中"""
+        if after_seq > self.seq:
+            return False
+        first = self.events[0][0] if self.events else self.seq + 1
+        return after_seq >= first - 1
+
+    async def subscribe(
+        self,
+        after_seq: int = 0,
+        watcher: Optional[ClientDisconnectWatcher] = None
+    ) -> AsyncIterator[Tuple[int, bytes]]:
+        """输出 after_seq 之后的事件，然后持续跟随直到生成结束或客户端断开"""
+        cursor = after_seq
+        while True:
+            changed = self._changed
+            if self.events:
+                first = self.events[0][0]
+                if cursor < first - 1:
+                    # 订阅者落后太多，缓冲区已覆盖未读事件
+                    logger.warning(f"[SSE] Subscriber of {self.key} fell behind the replay buffer")
+                    return
+                for seq, data in itertools.islice(self.events, cursor - first + 1, None):
+                    cursor = seq
+                    yield seq, data
+            if self.finished and cursor >= self.seq:
+                return
+            if watcher is None:
+                await changed.wait()
+                continue
+            try:
+                await asyncio.wait_for(changed.wait(), watcher.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            if await watcher.check():
+                return
+
+
+class StreamRegistry:
+    """
+    按会话管理 StreamRun
+
+    - 生成结束后 StreamRun 再保留 retention 秒，供晚到的重连回放
+    - 最后一个订阅者断开后默认立即取消生成、关闭上游连接，不再消耗 LLM 配额；
+      grace > 0 时生成继续 grace 秒等待重连，期间无人重连才取消（按需开启）
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = 512,
+        retention: float = 120.0,
+        grace: float = 0.0,
+        coalesce_delay: float = 0.03,
+        coalesce_bytes: int = 64
+    ):
+        self.buffer_size = buffer_size
+        self.retention = retention
+        self.grace = grace
+        self.coalesce_delay = coalesce_delay
+        self.coalesce_bytes = coalesce_bytes
+        self._runs: Dict[str, StreamRun] = {}
+        self.resumed = 0
+        self.abandoned = 0
+
+    def start(self, key: str, producer: Callable[[StreamRun], Awaitable[None]]) -> StreamRun:
+        self._prune()
+        run = StreamRun(key, self.buffer_size, self.coalesce_delay, self.coalesce_bytes)
+        run.task = asyncio.create_task(self._drive(run, producer))
+        self._runs[key] = run
+        return run
+
+    async def _drive(self, run: StreamRun, producer: Callable[[StreamRun], Awaitable[None]]):
+        try:
+            await producer(run)
+        except asyncio.CancelledError:
+            logger.info(f"[SSE] Stream {run.key} cancelled (no subscriber reconnected)")
+        except Exception as e:
+            logger.error(f"[SSE] Stream {run.key} failed: {e}")
+            run.publish({"type": "error", "content": str(e)})
+        finally:
+            run.finish()
+
+    def resume(self, key: str, last_event_id: Optional[str]) -> Optional[Tuple[StreamRun, int]]:
+        """解析 Last-Event-ID；可续传时返回 (run, 已收到的序号)"""
+        if not last_event_id or not key:
+            return None
+        run_id, _, seq = last_event_id.partition("-")
+        run = self._runs.get(key)
+        if run is None or run.run_id != run_id or not seq.isdigit():
+            return None
+        if not run.can_resume(int(seq)):
+            return None
+        self.resumed += 1
+        return run, int(seq)
+
+    def is_running(self, key: str) -> bool:
+        """该会话是否有仍在进行的生成"""
+        run = self._runs.get(key)
+        return run is not None and not run.finished
+
+    async def attach(
+        self,
+        run: StreamRun,
+        after_seq: int = 0,
+        http_request: Optional[Request] = None
+    ) -> AsyncIterator[bytes]:
+        """作为订阅者输出 SSE 帧；客户端断开时只退订，不直接取消生成"""
+        run.subscribers += 1
+        if run._grace_handle is not None:
+            run._grace_handle.cancel()
+            run._grace_handle = None
+        try:
+            async for seq, data in run.subscribe(after_seq, ClientDisconnectWatcher(http_request)):
+                yield format_sse(data, run.event_id(seq))
+        finally:
+            run.subscribers -= 1
+            if run.subscribers == 0 and not run.finished:
+                if self.grace > 0:
+                    run._grace_handle = asyncio.get_running_loop().call_later(self.grace, self._abandon, run)
+                else:
+                    self._abandon(run)
+
+    def _abandon(self, run: StreamRun):
+        run._grace_handle = None
+        if run.subscribers == 0 and not run.finished and run.task is not None:
+            self.abandoned += 1
+            run.task.cancel()
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [
+            key for key, run in self._runs.items()
+            if run.finished and now - run.finished_at > self.retention
+        ]
+        for key in expired:
+            del self._runs[key]
+
+    def stats(self) -> dict:
+        running = sum(1 for run in self._runs.values() if not run.finished)
+        deltas = sum(run.text_deltas for run in self._runs.values())
+        frames = sum(run.seq for run in self._runs.values())
+        return {
+            "runs": len(self._runs),
+            "running": running,
+            "text_deltas": deltas,
+            "frames": frames,
+            "subscribers": sum(run.subscribers for run in self._runs.values()),
+            "resumed": self.resumed,
+            "abandoned": self.abandoned,
+        }
+
+
+# 单例实例：聊天 SSE 流
+chat_streams = StreamRegistry(
+    buffer_size=int(os.getenv("SSE_REPLAY_BUFFER_SIZE", "512")),
+    retention=float(os.getenv("SSE_REPLAY_RETENTION_SECONDS", "120")),
+    grace=float(os.getenv("SSE_RESUME_GRACE_SECONDS", "0")),
+    coalesce_delay=int(os.getenv("SSE_COALESCE_MS", "30")) / 1000,
+    coalesce_bytes=int(os.getenv("SSE_COALESCE_BYTES", "64")),
+)
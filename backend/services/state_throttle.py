@@ -0,0 +1,105 @@
+"""
+State Throttle - 高频同步字段的节流
+
+阅读阶段 scrollProgress / focusParagraphIndex / isRecording 随前端每次变化上报，
+每次都会更新房间状态并广播一次。对这类字段按 key 设最小广播间隔:
+- 距上次广播已超过间隔：立即放行（单次变化不增加延迟）
+- 间隔内的后续更新只保留最新值（latest-wins），到期后合并为一次广播
+
+只节流整体替换（set）操作；未配置的字段（如测验答案）照常立即广播。
+
+配置:
+    WS_THROTTLE_KEYS="scrollProgress:100,focusParagraphIndex:100,isRecording:100"  （毫秒）
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THROTTLE_KEYS = "scrollProgress:100,focusParagraphIndex:100,isRecording:100"
+
+# flush(ops, sender_id, sender_role)
+FlushCallback = Callable[[List[Dict[str, Any]], str, Optional[str]], Awaitable[None]]
+
+
+class StateThrottle:
+    """一个房间内按 key 的最小广播间隔"""
+
+    def __init__(self, intervals: Dict[str, float], flush: FlushCallback):
+        self.intervals = intervals
+        self.flush = flush
+        self._last_sent: Dict[str, float] = {}
+        # key -> (op, sender_id, sender_role)，只保留最新一条
+        self._pending: Dict[str, Tuple[Dict[str, Any], str, Optional[str]]] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self.passed = 0
+        self.collapsed = 0
+
+    def split(self, ops: List[Dict[str, Any]], sender_id: str, sender_role: Optional[str]) -> List[Dict[str, Any]]:
+        """返回需要立即应用的操作；间隔内的节流字段暂存，到期后经 flush 发出"""
+        if not self.intervals:
+            return ops
+        now = time.monotonic()
+        immediate = []
+        for op in ops:
+            key = op.get("key") if isinstance(op, dict) else None
+            interval = self.intervals.get(key)
+            if interval is None or op.get("op") != "set":
+                immediate.append(op)
+                continue
+            due = self._last_sent.get(key, 0.0) + interval
+            if now >= due and key not in self._pending:
+                self._last_sent[key] = now
+                self.passed += 1
+                immediate.append(op)
+                continue
+            if key in self._pending:
+                self.collapsed += 1
+            self._pending[key] = (op, sender_id, sender_role)
+            if key not in self._timers:
+                self._timers[key] = asyncio.create_task(self._flush_later(key, max(due - now, 0.0)))
+        return immediate
+
+    async def _flush_later(self, key: str, delay: float):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            if self._timers.get(key) is asyncio.current_task():
+                del self._timers[key]
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        op, sender_id, sender_role = pending
+        self._last_sent[key] = time.monotonic()
+        self.passed += 1
+        try:
+            await self.flush([op], sender_id, sender_role)
+        except Exception as e:
+            logger.error(f"[WS] Throttled flush of {key} failed: {e}")
+
+    def clear(self):
+        """房间重置或关闭：丢弃未发出的更新"""
+        for task in self._timers.values():
+            task.cancel()
+        self._timers.clear()
+        self._pending.clear()
+
+    def stats(self) -> dict:
+        return {"passed": self.passed, "collapsed": self.collapsed, "pending": len(self._pending)}
+
+
+def parse_throttle_keys(spec: str) -> Dict[str, float]:
+    """解析 "key:毫秒,key:毫秒" 为 {key: 秒}"""
+    intervals = {}
+    for item in spec.split(","):
+        key, _, ms = item.strip().partition(":")
+        if key and ms.strip().isdigit() and int(ms) > 0:
+            intervals[key] = int(ms) / 1000
+    return intervals
+
+
+def state_throttle_from_env(flush: FlushCallback) -> StateThrottle:
+    return StateThrottle(parse_throttle_keys(os.getenv("WS_THROTTLE_KEYS", DEFAULT_THROTTLE_KEYS)), flush)
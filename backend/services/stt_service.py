@@ -3,10 +3,11 @@ STT Service - Speech to Text
 语音转文字服务 - 支持讯飞（中文）和 Groq Whisper（英文）
 """
 import os
-import httpx
 from typing import Optional
 import logging
 
+from services.http_clients import http_clients
+
 logger = logging.getLogger(__name__)
 
 
@@ -113,35 +114,36 @@ class STTService:
             
             logger.info(f"[STT] Groq: filename={filename}, mime_type={mime_type}, size={len(audio_data)} bytes")
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                files = {
-                    "file": (filename, audio_data, mime_type),
-                }
-                data = {
-                    "model": "whisper-large-v3",  # 使用完整版模型
-                    "language": language,
-                    "response_format": "text",
-                }
-                
-                response = await client.post(
-                    self.groq_base_url,
-                    headers={"Authorization": f"Bearer {self.groq_api_key}"},
-                    files=files,
-                    data=data
-                )
+            client = http_clients.get("groq")
+            files = {
+                "file": (filename, audio_data, mime_type),
+            }
+            data = {
+                "model": "whisper-large-v3",  # 使用完整版模型
+                "language": language,
+                "response_format": "text",
+            }
+            
+            response = await client.post(
+                self.groq_base_url,
+                headers={"Authorization": f"Bearer {self.groq_api_key}"},
+                files=files,
+                data=data,
+                timeout=30.0
+            )
+            
+            if response.status_code == 200:
+                transcript = response.text.strip()
+                logger.info(f"[STT] Groq success: {transcript[:50]}...")
+                return transcript
+            else:
+                logger.error(f"[STT] Groq error: {response.status_code} - {response.text}")
+                # Groq 失败时尝试回退到讯飞
+                if self.xunfei_available:
+                    logger.warning("[STT] Groq failed, falling back to Xunfei")
+                    return await self._transcribe_xunfei_direct(audio_data, filename, language)
+                return None
                 
-                if response.status_code == 200:
-                    transcript = response.text.strip()
-                    logger.info(f"[STT] Groq success: {transcript[:50]}...")
-                    return transcript
-                else:
-                    logger.error(f"[STT] Groq error: {response.status_code} - {response.text}")
-                    # Groq 失败时尝试回退到讯飞
-                    if self.xunfei_available:
-                        logger.warning("[STT] Groq failed, falling back to Xunfei")
-                        return await self._transcribe_xunfei_direct(audio_data, filename, language)
-                    return None
-                    
         except Exception as e:
             logger.error(f"[STT] Groq failed: {e}")
             # Groq 异常时尝试回退到讯飞
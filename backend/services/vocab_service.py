@@ -5,11 +5,14 @@ Vocab Service - 增强版查词服务
 import os
 import re
 import json
-import httpx
+import asyncio
 from typing import Optional, List, Dict, Any
 from pathlib import Path
 import logging
 
+from services.http_clients import http_clients
+from services.llm_limiter import llm_priority, Priority
+
 logger = logging.getLogger(__name__)
 
 # TTS 音频存储目录
@@ -22,6 +25,10 @@ class VocabService:
     
     def __init__(self):
         self.free_dict_url = "https://api.dictionaryapi.dev/api/v2/entries/en"
+        # 配置后改用 HTTP TTS 服务（GET ?text=&voice= 返回 mp3），如自建服务或压测桩（见 loadtest）
+        self.tts_url = os.getenv("VOCAB_TTS_URL")
+        # 批量生成时每次 LLM 调用包含的单词数（至少为 1）
+        self.batch_size = max(1, int(os.getenv("VOCAB_LLM_BATCH_SIZE", "10")))
     
     async def generate_quick_vocab(
         self, 
@@ -75,7 +82,7 @@ class VocabService:
 {{"phonetic": "/音标/", "definition": "中文释义"}}"""
         
         try:
-            response = await ai_service.generate_text(prompt=prompt)
+            response = await ai_service.generate_text(prompt=prompt, cache=True)
             logger.info(f"[VocabService] LLM raw response for '{word}': {response[:200]}")
             
             response = response.strip()
@@ -103,21 +110,21 @@ class VocabService:
     async def _fallback_definition(self, word: str) -> Dict[str, Any]:
         """备用：使用免费字典 API 获取释义"""
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{self.free_dict_url}/{word}")
-                if response.status_code == 200:
-                    data = response.json()
-                    if data and len(data) > 0:
-                        entry = data[0]
-                        phonetic = entry.get("phonetic", "")
-                        # 获取第一个释义
-                        meanings = entry.get("meanings", [])
-                        if meanings:
-                            definitions = meanings[0].get("definitions", [])
-                            if definitions:
-                                eng_def = definitions[0].get("definition", "")
-                                # 返回英文释义（稍后可以翻译）
-                                return {"phonetic": phonetic, "definition": eng_def, "is_english": True}
+            client = http_clients.get("dictionary")
+            response = await client.get(f"{self.free_dict_url}/{word}", timeout=5.0)
+            if response.status_code == 200:
+                data = response.json()
+                if data and len(data) > 0:
+                    entry = data[0]
+                    phonetic = entry.get("phonetic", "")
+                    # 获取第一个释义
+                    meanings = entry.get("meanings", [])
+                    if meanings:
+                        definitions = meanings[0].get("definitions", [])
+                        if definitions:
+                            eng_def = definitions[0].get("definition", "")
+                            # 返回英文释义（稍后可以翻译）
+                            return {"phonetic": phonetic, "definition": eng_def, "is_english": True}
         except Exception as e:
             logger.warning(f"[VocabService] Fallback API failed for '{word}': {e}")
         
@@ -138,8 +145,9 @@ class VocabService:
         try:
             logger.info(f"[VocabService] Starting background completion for '{word}'")
             
-            # 1. 生成音节和助记
-            llm_result = await self._generate_with_llm(word, context_sentence)
+            # 1. 生成音节和助记（后台优先级，不与学生的实时请求抢配额）
+            with llm_priority(Priority.BACKGROUND):
+                llm_result = await self._generate_with_llm(word, context_sentence)
             
             # 2. 生成 TTS 音频
             audio_url = await self._generate_tts(word)
@@ -214,19 +222,19 @@ class VocabService:
     async def _get_phonetic(self, word: str) -> Optional[str]:
         """从 Free Dictionary API 获取音标"""
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(f"{self.free_dict_url}/{word}")
-                if response.status_code == 200:
-                    data = response.json()
-                    if data and len(data) > 0:
-                        # 尝试获取第一个 phonetic
-                        entry = data[0]
-                        if entry.get("phonetic"):
-                            return entry["phonetic"]
-                        # 或者从 phonetics 数组获取
-                        for ph in entry.get("phonetics", []):
-                            if ph.get("text"):
-                                return ph["text"]
+            client = http_clients.get("dictionary")
+            response = await client.get(f"{self.free_dict_url}/{word}", timeout=10.0)
+            if response.status_code == 200:
+                data = response.json()
+                if data and len(data) > 0:
+                    # 尝试获取第一个 phonetic
+                    entry = data[0]
+                    if entry.get("phonetic"):
+                        return entry["phonetic"]
+                    # 或者从 phonetics 数组获取
+                    for ph in entry.get("phonetics", []):
+                        if ph.get("text"):
+                            return ph["text"]
         except Exception as e:
             logger.warning(f"[VocabService] Failed to get phonetic for '{word}': {e}")
         return None
@@ -291,6 +299,153 @@ class VocabService:
                 "mnemonic": ""
             }
     
+    async def generate_with_llm_batch(
+        self,
+        items: List[Dict[str, Optional[str]]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        批量生成多个单词的音标、释义、音节和助记
+        
+        Args:
+            items: [{"word": "...", "context_sentence": "..."}]
+            
+        Returns:
+            {单词小写: 与 _generate_with_llm 相同结构的结果}
+        """
+        batches = [
+            items[i:i + self.batch_size]
+            for i in range(0, len(items), self.batch_size)
+        ]
+        results: Dict[str, Dict[str, Any]] = {}
+        for batch_result in await asyncio.gather(*[self._generate_batch(b) for b in batches]):
+            results.update(batch_result)
+        return results
+    
+    async def _generate_batch(
+        self,
+        items: List[Dict[str, Optional[str]]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """一次 LLM 调用生成一批单词；解析失败或无效的条目单独回退"""
+        from services.ai_service import ai_service
+        
+        lines = []
+        for idx, item in enumerate(items, 1):
+            context = item.get("context_sentence")
+            context_hint = f" | 原句: {context[:200]}" if context else ""
+            lines.append(f"{idx}. {item['word']}{context_hint}")
+        word_list = "\n".join(lines)
+        
+        prompt = f"""你是一个英语词汇助教。请分析以下 {len(items)} 个单词，返回 JSON 数组，每个单词一个对象，顺序与输入一致。
+
+单词列表:
+{word_list}
+
+每个对象格式（只返回 JSON 数组，不要其他内容）:
+{{
+    "word": "原单词",
+    "phonetic": "国际音标，如 /əbˈsest/",
+    "definition": "中文释义，必须是实际意思如 'adj. 着迷的'，不要写'XX的释义'这种描述",
+    "syllables": ["音节1", "音节2"],
+    "mnemonic": "💡 趣味记忆法（50字以内）"
+}}
+
+注意：definition 必须是单词的实际中文翻译！有原句时请结合语境。"""
+        
+        parsed: Dict[str, Dict[str, Any]] = {}
+        try:
+            response = await ai_service.generate_text(prompt=prompt)
+            data = json.loads(self._strip_code_fence(response))
+            if not isinstance(data, list):
+                raise ValueError("batch response is not a JSON array")
+            for entry in data:
+                if isinstance(entry, dict) and isinstance(entry.get("word"), str):
+                    parsed[entry["word"].lower().strip()] = entry
+        except Exception as e:
+            logger.error(f"[VocabService] Batch generation failed for {len(items)} words: {e}")
+        
+        results: Dict[str, Dict[str, Any]] = {}
+        fallbacks = []
+        for item in items:
+            key = item["word"].lower().strip()
+            entry = parsed.get(key)
+            if entry and self._is_valid_llm_entry(entry):
+                results[key] = entry
+            else:
+                fallbacks.append(item)
+        
+        if fallbacks:
+            logger.warning(f"[VocabService] Batch fallback for {[i['word'] for i in fallbacks]}")
+            singles = await asyncio.gather(*[
+                self._generate_with_llm(i["word"], i.get("context_sentence")) for i in fallbacks
+            ])
+            for item, single in zip(fallbacks, singles):
+                results[item["word"].lower().strip()] = single
+        
+        logger.info(f"[VocabService] Batch generated {len(items)} words ({len(fallbacks)} fallback)")
+        return results
+    
+    def _is_valid_llm_entry(self, entry: Dict[str, Any]) -> bool:
+        """校验批量结果中的单个条目"""
+        definition = entry.get("definition")
+        syllables = entry.get("syllables")
+        if not isinstance(definition, str) or not definition or "释义" in definition:
+            return False
+        if not isinstance(syllables, list) or not syllables or not all(isinstance(x, str) for x in syllables):
+            return False
+        return True
+    
+    def _strip_code_fence(self, response: str) -> str:
+        """去掉 LLM 返回中的 markdown 代码块标记"""
+        response = response.strip()
+        if response.startswith("```"):
+            response = re.sub(r'^```\w*\n?', '', response)
+            response = re.sub(r'\n?```$', '', response)
+        return response
+    
+    async def complete_vocab_batch(self, cards: List[Dict[str, Any]]):
+        """
+        批量完善词汇数据（后台任务，如预热整个版本的词卡）
+        
+        Args:
+            cards: [{"id": 词卡ID, "word": "...", "context_sentence": "..."}]
+        """
+        if not cards:
+            return
+        
+        try:
+            logger.info(f"[VocabService] Starting batch completion for {len(cards)} cards")
+            
+            with llm_priority(Priority.BACKGROUND):
+                llm_results = await self.generate_with_llm_batch(cards)
+            audio_urls = await asyncio.gather(*[self._generate_tts(c["word"]) for c in cards])
+            
+            from database import AsyncSessionLocal
+            from sqlalchemy import update
+            from models import VocabCard
+            
+            async with AsyncSessionLocal() as db:
+                for card, audio_url in zip(cards, audio_urls):
+                    llm_result = llm_results.get(card["word"].lower().strip(), {})
+                    values = {
+                        "syllables": llm_result.get("syllables", [card["word"]]),
+                        "ai_memory_hint": llm_result.get("mnemonic", ""),
+                        "audio_url": audio_url,
+                    }
+                    # 快速查词已有的音标和释义不覆盖
+                    if not card.get("definition") and llm_result.get("definition"):
+                        values["definition"] = llm_result["definition"]
+                    if not card.get("phonetic") and llm_result.get("phonetic"):
+                        values["phonetic"] = llm_result["phonetic"]
+                    await db.execute(update(VocabCard).where(VocabCard.id == card["id"]).values(**values))
+                await db.commit()
+            
+            logger.info(f"[VocabService] Batch completion for {len(cards)} cards finished")
+        
+        except Exception as e:
+            logger.error(f"[VocabService] Batch completion failed: {e}")
+            import traceback
+            traceback.print_exc()
+    
     def _simple_syllable_split(self, word: str) -> List[str]:
         """简单的音节拆分备选方案"""
         # 按元音拆分的简单规则
@@ -347,9 +502,6 @@ class VocabService:
     async def _generate_tts(self, word: str) -> Optional[str]:
         """生成 TTS 音频并保存到文件"""
         try:
-            # 使用 Edge TTS (免费且质量好)
-            import edge_tts
-            
             # 文件名使用单词
             filename = f"{word.lower().replace(' ', '_')}.mp3"
             filepath = AUDIO_DIR / filename
@@ -358,6 +510,17 @@ class VocabService:
             if filepath.exists():
                 return f"/static/audio/{filename}"
             
+            if self.tts_url:
+                client = http_clients.get("tts")
+                response = await client.get(self.tts_url, params={"text": word, "voice": "en-US-AriaNeural"})
+                response.raise_for_status()
+                await asyncio.to_thread(filepath.write_bytes, response.content)
+                logger.info(f"[VocabService] Generated TTS for '{word}' via {self.tts_url}")
+                return f"/static/audio/{filename}"
+            
+            # 使用 Edge TTS (免费且质量好)
+            import edge_tts
+            
             # 生成音频
             communicate = edge_tts.Communicate(word, "en-US-AriaNeural")
             await communicate.save(str(filepath))
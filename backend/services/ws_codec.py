@@ -0,0 +1,82 @@
+"""
+WebSocket Codec - /ws 的消息编码
+
+默认 JSON（文本帧）；客户端可选择 MessagePack（二进制帧），体积更小、编解码更快，
+适合大的 FULL_STATE 快照和 WebRTC SDP 信令。
+
+协商（按优先级）:
+1. 子协议：new WebSocket(url, ["msgpack"])，服务器以同名子协议应答
+2. 查询参数：/ws?format=msgpack
+
+广播时消息包装为 Outbound，每种格式只编码一次，同格式的接收者共享编码结果。
+未安装 msgpack 时一律使用 JSON。
+"""
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from services.json_codec import decode_json, encode_json
+
+try:
+    import msgpack
+except ImportError:  # 未安装时只支持 JSON
+    msgpack = None
+
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+
+# 子协议名 -> 编码格式
+SUBPROTOCOLS = {"json": FORMAT_JSON, "msgpack": FORMAT_MSGPACK}
+
+Frame = Union[str, bytes]
+
+
+def supported_formats() -> Tuple[str, ...]:
+    return (FORMAT_JSON, FORMAT_MSGPACK) if msgpack is not None else (FORMAT_JSON,)
+
+
+def negotiate(offered: Iterable[str], requested: Optional[str]) -> Tuple[str, Optional[str]]:
+    """
+    选择编码格式，返回 (format, 应答的子协议)
+
+    offered 为客户端提出的子协议（按客户端偏好排序），requested 为查询参数 format。
+    """
+    formats = supported_formats()
+    for subprotocol in offered:
+        fmt = SUBPROTOCOLS.get(subprotocol)
+        if fmt in formats:
+            return fmt, subprotocol
+    if requested in formats:
+        return requested, None
+    return FORMAT_JSON, None
+
+
+def encode_frame(message: Any, fmt: str) -> Frame:
+    if fmt == FORMAT_MSGPACK:
+        return msgpack.packb(message, default=str)
+    return encode_json(message).decode("utf-8")
+
+
+def decode_frame(message: Dict[str, Any]) -> Any:
+    """解码一条 websocket.receive 消息：文本帧为 JSON，二进制帧为 MessagePack"""
+    text = message.get("text")
+    if text is not None:
+        return decode_json(text)
+    data = message.get("bytes") or b""
+    if msgpack is not None:
+        return msgpack.unpackb(data)
+    return decode_json(data)
+
+
+class Outbound:
+    """一条待发送的消息；每种格式最多编码一次，所有接收者共享"""
+
+    __slots__ = ("message", "_frames")
+
+    def __init__(self, message: Any):
+        self.message = message
+        self._frames: Dict[str, Frame] = {}
+
+    def frame(self, fmt: str) -> Frame:
+        frame = self._frames.get(fmt)
+        if frame is None:
+            frame = self._frames[fmt] = encode_frame(self.message, fmt)
+        return frame
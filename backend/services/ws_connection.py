@@ -0,0 +1,224 @@
+"""
+WebSocket Connection - 单个客户端的发送队列
+
+广播只把消息放入每个连接自己的有界队列，由该连接的写任务逐条发送。
+网络差的平板只会让自己的队列变长，不会拖慢同房间的其他客户端，
+也不会阻塞发送方的接收循环。
+
+消费者跟不上（队列已满）时的策略:
+- drop_oldest: 丢弃最早的消息
+- latest_wins: 同一 key 的消息只保留最新一条（旧消息作废，新消息排到队尾，
+  保证与其他消息的先后顺序）；没有可合并的再丢弃最早的
+- disconnect: 直接断开该客户端，由其重连后重新拉取完整状态
+
+队列中的消息为 Outbound（见 ws_codec），写任务按本连接协商的格式取编码结果，
+同一条广播对每种格式只编码一次。
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from fastapi import WebSocket
+
+from services.ws_codec import FORMAT_JSON, Outbound
+from services.ws_metrics import ws_metrics
+from services.async_utils import spawn_background
+
+logger = logging.getLogger(__name__)
+
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_LATEST_WINS = "latest_wins"
+POLICY_DISCONNECT = "disconnect"
+POLICIES = (POLICY_DROP_OLDEST, POLICY_LATEST_WINS, POLICY_DISCONNECT)
+
+# 1013 Try Again Later：客户端重连即可
+CLOSE_CODE_BACKPRESSURE = 1013
+
+
+class ClientConnection:
+    """一个 WebSocket 客户端及其发送队列"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        client_id: str,
+        max_queue: int = 256,
+        policy: str = POLICY_LATEST_WINS,
+        wire_format: str = FORMAT_JSON
+    ):
+        if max_queue < 1:
+            raise ValueError(f"max_queue must be >= 1, got {max_queue}")
+        self.websocket = websocket
+        self.client_id = client_id
+        self.max_queue = max_queue
+        self.policy = policy if policy in POLICIES else POLICY_LATEST_WINS
+        self.wire_format = wire_format
+        # 客户端是否使用增量同步协议（STATE_DELTA），否则按旧协议收 STATE_UPDATE
+        self.delta_sync = False
+
+        # 队列元素为 [key, message, alive, 入队时间]；被合并的旧消息只标记作废，写任务跳过
+        self._queue: Deque[List[Any]] = deque()
+        self._keyed: Dict[str, List[Any]] = {}
+        self._live = 0
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+        # 心跳：最近一次收到客户端消息的时间；回应过 PONG 的客户端才按空闲超时回收
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.heartbeat = False
+        self.rtt: Optional[float] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    @property
+    def depth(self) -> int:
+        return self._live
+
+    def enqueue(self, message: Any, key: Optional[str] = None) -> bool:
+        """
+        放入发送队列（不阻塞）；返回 False 表示消息被丢弃或连接已关闭
+
+        message 可以是 dict 或已包装的 Outbound（广播时多个连接共享）。
+        """
+        if self.closed:
+            return False
+        if not isinstance(message, Outbound):
+            message = Outbound(message)
+
+        if key is not None and self.policy == POLICY_LATEST_WINS:
+            pending = self._keyed.get(key)
+            if pending is not None:
+                self._discard(pending)
+                self.coalesced += 1
+
+        if self._live >= self.max_queue:
+            if self.policy == POLICY_DISCONNECT:
+                logger.warning(f"[WS] {self.client_id} send queue full ({self.max_queue}), disconnecting")
+                self.dropped += 1
+                self.closed = True
+                self._ready.set()
+                spawn_background(self.close_socket(CLOSE_CODE_BACKPRESSURE))
+                return False
+            oldest = self._oldest_live()
+            if oldest is not None:
+                self._discard(oldest)
+                self.dropped += 1
+
+        # 写任务卡住时作废条目会堆积，超过上限后压缩一次
+        if len(self._queue) >= 2 * self.max_queue:
+            self._queue = deque(entry for entry in self._queue if entry[2])
+
+        entry = [key, message, True, time.monotonic()]
+        self._queue.append(entry)
+        self._live += 1
+        if key is not None:
+            self._keyed[key] = entry
+        self.max_depth = max(self.max_depth, self._live)
+        self._ready.set()
+        return True
+
+    def _oldest_live(self) -> Optional[List[Any]]:
+        return next((entry for entry in self._queue if entry[2]), None)
+
+    def _discard(self, entry: List[Any]):
+        if not entry[2]:
+            return
+        entry[2] = False
+        self._live -= 1
+        if entry[0] is not None and self._keyed.get(entry[0]) is entry:
+            del self._keyed[entry[0]]
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                if not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                entry = self._queue.popleft()
+                if not entry[2]:
+                    continue
+                self._discard(entry)
+                frame = entry[1].frame(self.wire_format)
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                self.sent += 1
+                ws_metrics.on_send(time.monotonic() - entry[3])
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # 发送失败说明连接已不可用；关闭后由接收循环完成清理
+            logger.info(f"[WS] Send to {self.client_id} failed: {e}")
+            await self.close()
+
+    async def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        self._ready.set()
+        await self.close_socket(code)
+
+    async def close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception as e:
+            # 连接通常已被对端关闭
+            logger.debug(f"[WS] Closing {self.client_id} with {code} failed: {e}")
+
+    def touch(self):
+        """收到客户端消息"""
+        self.last_seen = time.monotonic()
+
+    def on_pong(self, sent_at: Optional[float]):
+        self.heartbeat = True
+        if isinstance(sent_at, (int, float)):
+            self.rtt = time.monotonic() - sent_at
+
+    def idle_for(self, now: float) -> float:
+        return now - self.last_seen
+
+    def stop(self):
+        """连接已断开：停止写任务并丢弃未发送的消息"""
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._queue.clear()
+        self._keyed.clear()
+        self._live = 0
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "policy": self.policy,
+            "delta_sync": self.delta_sync,
+            "format": self.wire_format,
+            "idle_seconds": round(time.monotonic() - self.last_seen, 1),
+            "rtt_ms": round(self.rtt * 1000, 1) if self.rtt is not None else None,
+        }
+
+
+def connection_from_env(websocket: WebSocket, client_id: str, wire_format: str = FORMAT_JSON) -> ClientConnection:
+    return ClientConnection(
+        websocket,
+        client_id,
+        max_queue=int(os.getenv("WS_SEND_QUEUE_SIZE", "256")),
+        policy=os.getenv("WS_BACKPRESSURE_POLICY", POLICY_LATEST_WINS).lower(),
+        wire_format=wire_format,
+    )
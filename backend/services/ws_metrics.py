@@ -0,0 +1,81 @@
+"""
+WebSocket Metrics - /ws 连接与消息指标
+
+- 收发消息速率：按秒分桶，统计最近 window 秒的平均每秒条数
+- 广播延迟：消息放入发送队列到写出完成的耗时，保留最近的样本计算 p50/p95/p99
+- 连接生命周期计数：连接、断开、心跳超时回收
+"""
+import time
+from collections import deque
+from typing import Deque, Dict, List
+
+
+class RateMeter:
+    """按秒分桶的速率统计"""
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self._buckets: Deque[List[int]] = deque()  # [秒, 次数]
+        self.total = 0
+
+    def mark(self, n: int = 1):
+        now = int(time.monotonic())
+        if self._buckets and self._buckets[-1][0] == now:
+            self._buckets[-1][1] += n
+        else:
+            self._buckets.append([now, n])
+        self.total += n
+        self._trim(now)
+
+    def _trim(self, now: int):
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+
+    def rate(self) -> float:
+        """最近 window 秒的平均每秒次数"""
+        self._trim(int(time.monotonic()))
+        return round(sum(count for _, count in self._buckets) / self.window, 2)
+
+
+def percentiles(samples: List[float], points=(50, 95, 99)) -> Dict[str, float]:
+    """计算百分位（毫秒）"""
+    if not samples:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {f"p{p}": round(ordered[min(last, int(last * p / 100 + 0.5))] * 1000, 2) for p in points}
+
+
+class WSMetrics:
+    """进程内 WebSocket 指标"""
+
+    def __init__(self, window: int = 60, samples: int = 2048):
+        self.received = RateMeter(window)
+        self.sent = RateMeter(window)
+        self.send_latency: Deque[float] = deque(maxlen=samples)
+        self.connected = 0
+        self.disconnected = 0
+        self.reaped = 0
+
+    def on_receive(self):
+        self.received.mark()
+
+    def on_send(self, latency: float):
+        self.sent.mark()
+        self.send_latency.append(latency)
+
+    def summary(self) -> dict:
+        return {
+            "connected_total": self.connected,
+            "disconnected_total": self.disconnected,
+            "reaped_total": self.reaped,
+            "received_per_sec": self.received.rate(),
+            "sent_per_sec": self.sent.rate(),
+            "received_total": self.received.total,
+            "sent_total": self.sent.total,
+            "broadcast_latency_ms": percentiles(list(self.send_latency)),
+        }
+
+
+# 单例实例
+ws_metrics = WSMetrics()
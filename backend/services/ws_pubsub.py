@@ -0,0 +1,478 @@
+"""
+WebSocket Room Bus - 房间消息在 worker 之间的分发
+
+ConnectionManager 只持有本 worker 的连接；房间状态的变更和广播经由 RoomBus:
+- memory: 进程内直接回调，单 worker 开发环境使用（默认）
+- redis: 多 worker / 多实例共享
+    - 房间状态存为 Redis Hash（字段值为 JSON），版本号为计数器；
+      增量由 Lua 脚本原子地写入状态（受限列表按 cap 截断）、分配版本号并 PUBLISH，
+      所有 worker 按同一顺序收到增量，各自更新本地副本后发给本地客户端
+    - 普通广播（WEBRTC_SIGNAL 等）本 worker 直接发送，同时 PUBLISH 给其他 worker
+    - worker 第一次有客户端进入某房间时订阅该房间的频道并从 Redis 加载快照，
+      房间在本 worker 上变空时退订：每个 worker 只接收自己承载的房间的流量
+    - 房间成员表记录每个客户端所在的 worker，定向消息（WEBRTC_SIGNAL 的 targetId）
+      只发布到目标所在 worker 的频道；每个 worker 持有一个定期续期的租约，
+      崩溃的 worker 租约过期后，其残留的成员记录视为已离开
+
+频道: {prefix}:{room_id}（本 worker 承载的房间），
+      ws:node:{node_id}（发给本 worker 上某个客户端的定向消息）
+
+配置:
+    WS_ROOM_BUS=memory|redis
+    WS_ROOM_STATE_TTL_SECONDS    Redis 中房间状态闲置多久后过期
+    WS_NODE_LEASE_SECONDS        worker 租约时长（每 1/3 时长续期一次）
+    REDIS_URL
+"""
+import os
+import json
+import uuid
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from services.json_codec import encode_json
+from services.room_state import DEFAULT_LIST_LIMITS, ListLimits, parse_list_limits
+
+logger = logging.getLogger(__name__)
+
+# on_commit(room_id, message)：按全局顺序应用并发给本地客户端
+CommitHandler = Callable[[str, Dict[str, Any]], Awaitable[None]]
+# on_broadcast(room_id, message, sender_id, key)：其他 worker 发出的广播
+BroadcastHandler = Callable[[str, Dict[str, Any], Optional[str], Optional[str]], Awaitable[None]]
+# on_unicast(room_id, target_id, message)：其他 worker 转来的定向消息
+UnicastHandler = Callable[[str, str, Dict[str, Any]], Awaitable[bool]]
+
+
+class RoomBus:
+    """房间消息总线接口"""
+
+    backend = "base"
+    # 房间状态是否在 worker 之间共享（本 worker 房间已空时其他 worker 可能仍有客户端）
+    shared = False
+
+    def __init__(self):
+        self.on_commit: Optional[CommitHandler] = None
+        self.on_broadcast: Optional[BroadcastHandler] = None
+        self.on_unicast: Optional[UnicastHandler] = None
+
+    def bind(self, on_commit: CommitHandler, on_broadcast: BroadcastHandler, on_unicast: UnicastHandler):
+        self.on_commit = on_commit
+        self.on_broadcast = on_broadcast
+        self.on_unicast = on_unicast
+
+    async def commit(self, room_id: str, message: Dict[str, Any]):
+        """提交一条 STATE_DELTA / ROOM_RESET，定序后经 on_commit 回到每个 worker"""
+        raise NotImplementedError
+
+    async def broadcast(self, room_id: str, message: Dict[str, Any], sender_id: Optional[str], key: Optional[str]):
+        """通知其他 worker（本 worker 的客户端由调用方直接发送）"""
+        raise NotImplementedError
+
+    async def load(self, room_id: str) -> Optional[Tuple[int, Dict[str, Any], Dict[str, int]]]:
+        """读取共享的房间状态快照 (version, data, trimmed)；没有共享存储时返回 None"""
+        return None
+
+    async def open_room(self, room_id: str):
+        """本 worker 开始承载该房间（第一个客户端进入）：开始接收它的增量和广播"""
+
+    async def close_room(self, room_id: str):
+        """本 worker 上该房间已空：不再接收它的流量"""
+
+    async def join(self, room_id: str, client_id: str):
+        """登记本 worker 上的房间成员"""
+
+    async def leave(self, room_id: str, client_id: str):
+        pass
+
+    async def send_to(self, room_id: str, target_id: str, message: Dict[str, Any]) -> bool:
+        """把定向消息转给目标所在的其他 worker；目标不在任何 worker 上时返回 False"""
+        return False
+
+    async def startup(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.backend}
+
+
+class LocalRoomBus(RoomBus):
+    """进程内总线：版本号由本地 RoomState 分配"""
+
+    backend = "memory"
+
+    async def commit(self, room_id: str, message: Dict[str, Any]):
+        await self.on_commit(room_id, message)
+
+    async def broadcast(self, room_id: str, message: Dict[str, Any], sender_id: Optional[str], key: Optional[str]):
+        pass
+
+
+# KEYS[1] 状态 Hash，KEYS[2] 版本计数器，KEYS[3] 列表长度 Hash，KEYS[4] 已丢弃条数 Hash
+# ARGV[1] 频道，ARGV[2] TTL，ARGV[3] 消息 JSON（不含版本号），ARGV[4] 是否重置，
+# ARGV[5..] 每五个一组：op, key, 值 JSON（set 为新值，append 为追加项数组），
+#   值的条数（不是列表时为 -1），cap（ROOM_STATE_LIST_LIMITS，不限时为 -1）
+# 列表追加直接拼接 JSON 文本，避免 cjson 往返改变数据（如空数组变成对象）；
+# 超出 cap 时只扫描要丢弃的前缀，列表长度另行记录，不必每次重新数一遍
+COMMIT_SCRIPT = """
+local state, counter, lengths, trimmed = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+
+-- 从 pos 起跳过 count 个顶层数组元素，返回下一个元素的起始位置；元素不足时返回 nil
+local function skip_items(json, pos, count)
+    local depth, in_string, escaped = 0, false, false
+    for i = pos, #json - 1 do
+        local c = string.byte(json, i)
+        if in_string then
+            if escaped then
+                escaped = false
+            elseif c == 92 then
+                escaped = true
+            elseif c == 34 then
+                in_string = false
+            end
+        elseif c == 34 then
+            in_string = true
+        elseif c == 91 or c == 123 then
+            depth = depth + 1
+        elseif c == 93 or c == 125 then
+            depth = depth - 1
+        elseif c == 44 and depth == 0 then
+            count = count - 1
+            if count == 0 then
+                return i + 1
+            end
+        end
+    end
+    return nil
+end
+
+local function count_items(json)
+    local n, pos = 1, skip_items(json, 2, 1)
+    while pos do
+        n = n + 1
+        pos = skip_items(json, pos, 1)
+    end
+    return n
+end
+
+if ARGV[4] == '1' then
+    redis.call('DEL', state, lengths, trimmed)
+else
+    for i = 5, #ARGV, 5 do
+        local op, key, value = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+        local n, cap = tonumber(ARGV[i + 3]), tonumber(ARGV[i + 4])
+        if op == 'append' then
+            local current = redis.call('HGET', state, key)
+            if current and string.sub(current, 1, 1) == '[' and current ~= '[]' then
+                if cap >= 0 then
+                    n = n + (tonumber(redis.call('HGET', lengths, key)) or count_items(current))
+                end
+                if value ~= '[]' then
+                    value = string.sub(current, 1, -2) .. ',' .. string.sub(value, 2)
+                else
+                    value = current
+                end
+            end
+        else
+            redis.call('HDEL', trimmed, key)
+        end
+        if cap >= 0 and n >= 0 then
+            if n > cap then
+                local pos = skip_items(value, 2, n - cap)
+                value = pos and ('[' .. string.sub(value, pos)) or '[]'
+                redis.call('HINCRBY', trimmed, key, n - cap)
+                n = cap
+            end
+            redis.call('HSET', lengths, key, n)
+        else
+            redis.call('HDEL', lengths, key)
+        end
+        redis.call('HSET', state, key, value)
+    end
+end
+local version = redis.call('INCR', counter)
+for _, key in ipairs({state, counter, lengths, trimmed}) do
+    redis.call('EXPIRE', key, ARGV[2])
+end
+redis.call('PUBLISH', ARGV[1], '{"version":' .. version .. ',"body":' .. ARGV[3] .. '}')
+return version
+"""
+
+
+# 只删除仍指向该 worker 的成员记录（客户端可能已在其他 worker 上重新进入）
+FORGET_MEMBER_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+class RedisRoomBus(RoomBus):
+    """
+    Redis 总线
+
+    键:
+        {prefix}:{room_id}:state    Hash，字段值为 JSON
+        {prefix}:{room_id}:version  版本计数器
+        {prefix}:{room_id}:members  Hash，client_id -> node_id
+        {prefix}:{room_id}:lengths  Hash，受限列表字段 -> 当前条数
+        {prefix}:{room_id}:trimmed  Hash，受限列表字段 -> 超出 cap 已丢弃的条数
+        ws:node:{node_id}:lease     worker 租约（带 TTL，定期续期）
+
+    受限列表（limits）在 Redis 中只保留最近 cap 条，与各 worker 副本的状态一致；
+    更早的条目只留在当时在线的 worker 的历史中。
+    """
+
+    backend = "redis"
+    shared = True
+
+    def __init__(
+        self,
+        url: str,
+        ttl: int = 21600,
+        prefix: str = "ws:room",
+        limits: Optional[ListLimits] = None,
+        lease_ttl: int = 30
+    ):
+        import redis.asyncio as redis
+
+        super().__init__()
+        self.url = url
+        self.ttl = ttl
+        self.prefix = prefix
+        self.limits: ListLimits = limits or {}
+        self.node_id = uuid.uuid4().hex[:8]
+        self._redis = redis.from_url(url)
+        self._commit_script = self._redis.register_script(COMMIT_SCRIPT)
+        self._forget_member_script = self._redis.register_script(FORGET_MEMBER_SCRIPT)
+        self._listener: Optional[asyncio.Task] = None
+        self.lease_ttl = lease_ttl
+        self._lease: Optional[asyncio.Task] = None
+        # 本 worker 承载的房间；_subscribed 为当前订阅连接上实际已订阅的房间
+        self._rooms: Set[str] = set()
+        self._subscribed: Set[str] = set()
+        self._pubsub = None
+        self._subscribe_lock = asyncio.Lock()
+        self.published = 0
+        self.received = 0
+
+    def _channel(self, room_id: str) -> str:
+        return f"{self.prefix}:{room_id}"
+
+    def _state_key(self, room_id: str) -> str:
+        return f"{self.prefix}:{room_id}:state"
+
+    def _version_key(self, room_id: str) -> str:
+        return f"{self.prefix}:{room_id}:version"
+
+    def _members_key(self, room_id: str) -> str:
+        return f"{self.prefix}:{room_id}:members"
+
+    def _lengths_key(self, room_id: str) -> str:
+        return f"{self.prefix}:{room_id}:lengths"
+
+    def _trimmed_key(self, room_id: str) -> str:
+        return f"{self.prefix}:{room_id}:trimmed"
+
+    @staticmethod
+    def _node_channel(node_id: str) -> str:
+        return f"ws:node:{node_id}"
+
+    @staticmethod
+    def _lease_key(node_id: str) -> str:
+        return f"ws:node:{node_id}:lease"
+
+    async def commit(self, room_id: str, message: Dict[str, Any]):
+        args: List[Any] = [
+            self._channel(room_id),
+            self.ttl,
+            encode_json(message),
+            "1" if message["type"] == "ROOM_RESET" else "0",
+        ]
+        for op in message.get("ops", []):
+            value = op["value"] if op["op"] == "set" else op["items"]
+            cap = self.limits[op["key"]][0] if op["key"] in self.limits else -1
+            count = len(value) if isinstance(value, list) else -1
+            args.extend([op["op"], op["key"], encode_json(value), count, cap])
+        keys = [
+            self._state_key(room_id),
+            self._version_key(room_id),
+            self._lengths_key(room_id),
+            self._trimmed_key(room_id),
+        ]
+        await self._commit_script(keys=keys, args=args)
+        self.published += 1
+
+    async def broadcast(self, room_id: str, message: Dict[str, Any], sender_id: Optional[str], key: Optional[str]):
+        envelope = {"node": self.node_id, "sender": sender_id, "key": key, "message": message}
+        await self._redis.publish(self._channel(room_id), encode_json(envelope))
+        self.published += 1
+
+    async def load(self, room_id: str) -> Optional[Tuple[int, Dict[str, Any], Dict[str, int]]]:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(self._state_key(room_id))
+            pipe.get(self._version_key(room_id))
+            pipe.hgetall(self._trimmed_key(room_id))
+            raw_state, version, raw_trimmed = await pipe.execute()
+        data = {field.decode(): json.loads(value) for field, value in raw_state.items()}
+        trimmed = {field.decode(): int(value) for field, value in raw_trimmed.items()}
+        return int(version or 0), data, trimmed
+
+    async def join(self, room_id: str, client_id: str):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hset(self._members_key(room_id), client_id, self.node_id)
+            pipe.expire(self._members_key(room_id), self.ttl)
+            await pipe.execute()
+
+    async def leave(self, room_id: str, client_id: str):
+        await self._redis.hdel(self._members_key(room_id), client_id)
+
+    async def send_to(self, room_id: str, target_id: str, message: Dict[str, Any]) -> bool:
+        node = await self._redis.hget(self._members_key(room_id), target_id)
+        if node is None:
+            return False
+        node_id = node.decode()
+        # 本 worker 的连接已由调用方查过；其他 worker 的租约过期说明它已退出（崩溃时来不及 leave）
+        if node_id == self.node_id or not await self._redis.exists(self._lease_key(node_id)):
+            await self._forget_member_script(keys=[self._members_key(room_id)], args=[target_id, node_id])
+            return False
+        envelope = {"room": room_id, "target": target_id, "message": message}
+        await self._redis.publish(self._node_channel(node_id), encode_json(envelope))
+        self.published += 1
+        return True
+
+    async def open_room(self, room_id: str):
+        self._rooms.add(room_id)
+        await self._sync_subscription(room_id)
+
+    async def close_room(self, room_id: str):
+        self._rooms.discard(room_id)
+        await self._sync_subscription(room_id)
+
+    async def _sync_subscription(self, room_id: str):
+        """按 _rooms 订阅 / 退订；加锁串行执行，并发的进入和清空以最后的状态为准"""
+        async with self._subscribe_lock:
+            wanted = room_id in self._rooms
+            # 订阅连接重建时会订阅 _rooms 中的全部房间
+            if self._pubsub is None or wanted == (room_id in self._subscribed):
+                return
+            try:
+                if wanted:
+                    await self._pubsub.subscribe(self._channel(room_id))
+                    self._subscribed.add(room_id)
+                else:
+                    await self._pubsub.unsubscribe(self._channel(room_id))
+                    self._subscribed.discard(room_id)
+            except Exception as e:
+                logger.error(f"[WS] Room bus (un)subscribe for {room_id} failed: {e}")
+
+    async def startup(self):
+        await self._redis.ping()
+        await self._redis.set(self._lease_key(self.node_id), 1, ex=self.lease_ttl)
+        self._lease = asyncio.create_task(self._renew_lease())
+        self._listener = asyncio.create_task(self._listen())
+        logger.info(f"[WS] Room bus connected to Redis at {self.url} (node {self.node_id})")
+
+    async def _renew_lease(self):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self._redis.set(self._lease_key(self.node_id), 1, ex=self.lease_ttl)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[WS] Node lease renewal failed: {e}")
+
+    async def _listen(self):
+        node_channel = self._node_channel(self.node_id)
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                async with self._subscribe_lock:
+                    await pubsub.subscribe(node_channel, *(self._channel(room_id) for room_id in self._rooms))
+                    self._pubsub = pubsub
+                    self._subscribed = set(self._rooms)
+                async for item in pubsub.listen():
+                    if item["type"] != "message":
+                        continue
+                    channel = item["channel"].decode()
+                    if channel == node_channel:
+                        await self._dispatch_unicast(item["data"])
+                    else:
+                        await self._dispatch(channel, item["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 断线期间错过的增量由副本的版本校验发现，重新加载快照
+                logger.error(f"[WS] Room bus subscription failed: {e}, retrying")
+                await asyncio.sleep(1)
+            finally:
+                self._pubsub = None
+                self._subscribed = set()
+                await pubsub.aclose()
+
+    async def _dispatch(self, channel: str, data: bytes):
+        room_id = channel[len(self.prefix) + 1:]
+        envelope = json.loads(data)
+        self.received += 1
+        try:
+            if "version" in envelope:
+                message = envelope["body"]
+                message["version"] = envelope["version"]
+                message["baseVersion"] = envelope["version"] - 1
+                await self.on_commit(room_id, message)
+            elif envelope.get("node") != self.node_id:
+                await self.on_broadcast(room_id, envelope["message"], envelope.get("sender"), envelope.get("key"))
+        except Exception as e:
+            logger.error(f"[WS] Room bus dispatch to {room_id} failed: {e}")
+
+    async def _dispatch_unicast(self, data: bytes):
+        envelope = json.loads(data)
+        self.received += 1
+        try:
+            await self.on_unicast(envelope["room"], envelope["target"], envelope["message"])
+        except Exception as e:
+            logger.error(f"[WS] Room bus unicast to {envelope.get('target')} failed: {e}")
+
+    async def aclose(self):
+        for task in (self._listener, self._lease):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self._redis.delete(self._lease_key(self.node_id))
+        except Exception as e:
+            logger.warning(f"[WS] Failed to release node lease: {e}")
+        await self._redis.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "node": self.node_id,
+            "rooms": len(self._rooms),
+            "published": self.published,
+            "received": self.received,
+        }
+
+
+def create_room_bus() -> RoomBus:
+    """按环境变量选择后端"""
+    if os.getenv("WS_ROOM_BUS", "memory").lower() == "redis":
+        return RedisRoomBus(
+            os.getenv("REDIS_URL", "redis://localhost:6379"),
+            ttl=int(os.getenv("WS_ROOM_STATE_TTL_SECONDS", "21600")),
+            limits=parse_list_limits(os.getenv("ROOM_STATE_LIST_LIMITS", DEFAULT_LIST_LIMITS)),
+            lease_ttl=int(os.getenv("WS_NODE_LEASE_SECONDS", "30")),
+        )
+    return LocalRoomBus()
+
+
+# 单例实例
+room_bus = create_room_bus()
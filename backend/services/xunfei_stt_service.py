@@ -21,7 +21,8 @@ from time import mktime
 from typing import Optional
 from urllib.parse import urlparse
 from urllib3 import encode_multipart_formdata
-import requests
+
+from services.http_clients import http_clients
 
 logger = logging.getLogger(__name__)
 
@@ -68,7 +69,7 @@ class XunfeiSTTService:
             logger.info(f"[Xunfei] Starting transcription, audio size: {len(audio_data)} bytes")
             
             # 1. 上传文件 (讯飞支持 wav/pcm/mp3，无需转换)
-            file_url = self._upload_file(audio_data, filename)
+            file_url = await self._upload_file(audio_data, filename)
             if not file_url:
                 logger.error("[Xunfei] File upload failed")
                 return None
@@ -76,7 +77,7 @@ class XunfeiSTTService:
             logger.info(f"[Xunfei] File uploaded successfully")
             
             # 2. 创建转写任务
-            task_id = self._create_task(file_url, language)
+            task_id = await self._create_task(file_url, language)
             if not task_id:
                 logger.error("[Xunfei] Task creation failed")
                 return None
@@ -101,7 +102,7 @@ class XunfeiSTTService:
         """生成 RFC1123 格式日期"""
         return format_date_time(mktime(datetime.now().timetuple()))
     
-    def _upload_file(self, audio_data: bytes, filename: str) -> Optional[str]:
+    async def _upload_file(self, audio_data: bytes, filename: str) -> Optional[str]:
         """上传音频文件"""
         try:
             request_id = time.strftime("%Y%m%d%H%M")
@@ -145,7 +146,8 @@ class XunfeiSTTService:
                 "content-type": content_type
             }
             
-            response = requests.post(self.upload_url, headers=headers, data=file_data, timeout=60)
+            client = http_clients.get("xunfei")
+            response = await client.post(self.upload_url, headers=headers, content=file_data, timeout=60)
             
             if response.status_code == 200:
                 result = response.json()
@@ -164,7 +166,7 @@ class XunfeiSTTService:
             traceback.print_exc()
             return None
     
-    def _create_task(self, audio_url: str, language: str) -> Optional[str]:
+    async def _create_task(self, audio_url: str, language: str) -> Optional[str]:
         """创建转写任务"""
         try:
             path = "/v2/ost/pro_create"
@@ -217,7 +219,8 @@ class XunfeiSTTService:
                 "Authorization": auth
             }
             
-            response = requests.post(self.create_url, headers=headers, data=body, timeout=30)
+            client = http_clients.get("xunfei")
+            response = await client.post(self.create_url, headers=headers, content=body, timeout=30)
             
             if response.status_code == 200:
                 result = response.json()
@@ -278,7 +281,8 @@ class XunfeiSTTService:
                     "Authorization": auth
                 }
                 
-                response = requests.post(self.query_url, headers=headers, data=body, timeout=30)
+                client = http_clients.get("xunfei")
+                response = await client.post(self.query_url, headers=headers, content=body, timeout=30)
                 
                 # 注意：讯飞有时返回 HTTP 500 但响应体中包含有效数据
                 # 所以我们不只检查 200，而是尝试解析任何 JSON 响应
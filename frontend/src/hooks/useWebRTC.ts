@@ -14,6 +14,8 @@ export const useWebRTC = ({ role }: UseWebRTCProps) => {
     const peerConnection = useRef<RTCPeerConnection | null>(null);
     const localStreamRef = useRef<MediaStream | null>(null);
     const roleRef = useRef(role);
+    // 对端的客户端 ID：OFFER / ANSWER / CANDIDATE 只发给它
+    const peerIdRef = useRef<string | undefined>(undefined);
 
     // Keep roleRef updated
     useEffect(() => {
@@ -106,7 +108,7 @@ export const useWebRTC = ({ role }: UseWebRTCProps) => {
 
         pc.onicecandidate = (event) => {
             if (event.candidate) {
-                sendSignal({ type: 'CANDIDATE', candidate: event.candidate });
+                sendSignal({ type: 'CANDIDATE', candidate: event.candidate }, peerIdRef.current);
             }
         };
 
@@ -156,7 +158,7 @@ export const useWebRTC = ({ role }: UseWebRTCProps) => {
                     case 'TEACHER_HERE':
                         if (currentRole === 'student') {
                             console.log('[useWebRTC] Teacher is here, announcing presence...');
-                            sendSignal({ type: 'STUDENT_HERE' });
+                            sendSignal({ type: 'STUDENT_HERE' }, senderId);
                         }
                         break;
 
@@ -168,10 +170,11 @@ export const useWebRTC = ({ role }: UseWebRTCProps) => {
                                 break;
                             }
                             console.log('[useWebRTC] Student is here, initiating call...');
+                            peerIdRef.current = senderId;
                             createPeerConnection();
                             const offer = await peerConnection.current!.createOffer();
                             await peerConnection.current!.setLocalDescription(offer);
-                            sendSignal({ type: 'OFFER', sdp: offer });
+                            sendSignal({ type: 'OFFER', sdp: offer }, senderId);
                         }
                         break;
 
@@ -179,11 +182,12 @@ export const useWebRTC = ({ role }: UseWebRTCProps) => {
                     case 'OFFER':
                         if (currentRole === 'student') {
                             console.log('[useWebRTC] Received offer, answering...');
+                            peerIdRef.current = senderId;
                             createPeerConnection();
                             await peerConnection.current!.setRemoteDescription(new RTCSessionDescription(payload.sdp));
                             const answer = await peerConnection.current!.createAnswer();
                             await peerConnection.current!.setLocalDescription(answer);
-                            sendSignal({ type: 'ANSWER', sdp: answer });
+                            sendSignal({ type: 'ANSWER', sdp: answer }, senderId);
                         }
                         break;
 
@@ -199,6 +203,18 @@ export const useWebRTC = ({ role }: UseWebRTCProps) => {
                             await peerConnection.current.addIceCandidate(new RTCIceCandidate(payload.candidate));
                         }
                         break;
+
+                    case 'TARGET_GONE':
+                        // 对端已离开：关闭连接，等待对方重新发出在场通知
+                        if (payload.targetId === peerIdRef.current && peerConnection.current) {
+                            console.log('[useWebRTC] Peer left, closing connection');
+                            peerConnection.current.close();
+                            peerConnection.current = null;
+                            peerIdRef.current = undefined;
+                            setRemoteStream(null);
+                            setConnectionStatus('disconnected');
+                        }
+                        break;
                 }
             } catch (err) {
                 console.error('[useWebRTC] Error handling signal:', err);
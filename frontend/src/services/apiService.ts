@@ -466,6 +466,104 @@ export async function initChatSession(context: ChatContext): Promise<{
     });
 }
 
+const SSE_MAX_RESUME_ATTEMPTS = 3;
+const SSE_RESUME_DELAY_MS = 1000;
+
+/**
+ * 读取 SSE 事件流，断线后自动续传
+ *
+ * 每个事件带 `id:`；读取中途网络断开时，携带 Last-Event-ID 重发同一请求，
+ * 服务端从回放缓冲区补发并接上仍在进行的生成，不会重新调用 LLM。
+ */
+async function* resumableSSE<T extends { type: string }>(
+    endpoint: string,
+    getBody: () => object,
+    label: string
+): AsyncGenerator<T, void, unknown> {
+    let lastEventId: string | null = null;
+    let attempt = 0;
+
+    while (true) {
+        const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+        if (lastEventId) {
+            headers['Last-Event-ID'] = lastEventId;
+        }
+
+        const response = await fetch(`${API_BASE_URL}${endpoint}`, {
+            method: 'POST',
+            headers,
+            body: JSON.stringify(getBody()),
+        });
+
+        if (!response.ok) {
+            yield {
+                type: 'error',
+                content: `API Error: ${response.status} ${response.statusText}`,
+            } as unknown as T;
+            return;
+        }
+
+        const reader = response.body?.getReader();
+        if (!reader) {
+            yield { type: 'error', content: 'No response body' } as unknown as T;
+            return;
+        }
+
+        const decoder = new TextDecoder();
+        let buffer = '';
+        // 当前帧的 id / data，空行分派整帧后 id 才计入 lastEventId（与 EventSource 一致）：
+        // 两行之间断线时，续传不会跳过尚未处理的事件
+        let frameId: string | null = null;
+        let frameData: string | null = null;
+
+        try {
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) return;
+
+                buffer += decoder.decode(value, { stream: true });
+
+                // 解析 SSE 事件
+                const lines = buffer.split('\n');
+                buffer = lines.pop() || ''; // 保留未完成的行
+
+                for (const line of lines) {
+                    if (line.startsWith('id: ')) {
+                        frameId = line.slice(4).trim();
+                    } else if (line.startsWith('data: ')) {
+                        frameData = line.slice(6).trim();
+                    } else if (line === '') {
+                        const data = frameData;
+                        const id = frameId;
+                        frameId = null;
+                        frameData = null;
+                        if (data) {
+                            try {
+                                yield JSON.parse(data) as T;
+                            } catch (e) {
+                                console.warn(`${label} Failed to parse event:`, data);
+                            }
+                        }
+                        if (id !== null) {
+                            lastEventId = id;
+                        }
+                    }
+                }
+            }
+        } catch (e) {
+            // 尚未收到任何事件或重试次数用尽时，按原样抛出
+            if (!lastEventId || attempt >= SSE_MAX_RESUME_ATTEMPTS) {
+                throw e;
+            }
+            attempt += 1;
+            console.warn(`${label} Connection lost, resuming after ${lastEventId} (attempt ${attempt})`);
+            await new Promise((resolve) => setTimeout(resolve, SSE_RESUME_DELAY_MS));
+        } finally {
+            reader.releaseLock();
+        }
+    }
+}
+
 /**
  * 流式聊天 - 返回 AsyncGenerator
  * 
@@ -485,63 +583,15 @@ export async function* chatStream(
     messages: ChatMessage[],
     context?: ChatContext
 ): AsyncGenerator<ChatStreamEvent, void, unknown> {
-    const response = await fetch(`${API_BASE_URL}/api/ai/chat/stream`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
+    yield* resumableSSE<ChatStreamEvent>(
+        '/api/ai/chat/stream',
+        () => ({
             session_id: sessionId,
             messages,
             context,
         }),
-    });
-
-    if (!response.ok) {
-        yield {
-            type: 'error',
-            content: `API Error: ${response.status} ${response.statusText}`,
-        };
-        return;
-    }
-
-    const reader = response.body?.getReader();
-    if (!reader) {
-        yield { type: 'error', content: 'No response body' };
-        return;
-    }
-
-    const decoder = new TextDecoder();
-    let buffer = '';
-
-    try {
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-
-            buffer += decoder.decode(value, { stream: true });
-
-            // 解析 SSE 事件
-            const lines = buffer.split('\n');
-            buffer = lines.pop() || ''; // 保留未完成的行
-
-            for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    const data = line.slice(6).trim();
-                    if (data) {
-                        try {
-                            const event = JSON.parse(data) as ChatStreamEvent;
-                            yield event;
-                        } catch (e) {
-                            console.warn('[chatStream] Failed to parse event:', data);
-                        }
-                    }
-                }
-            }
-        }
-    } finally {
-        reader.releaseLock();
-    }
+        '[chatStream]'
+    );
 }
 
 /**
@@ -584,60 +634,20 @@ export interface InitStreamEvent {
 export async function* initChatStream(
     context: ChatContext
 ): AsyncGenerator<InitStreamEvent, void, unknown> {
-    const response = await fetch(`${API_BASE_URL}/api/ai/chat/init-stream`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-            session_id: '',
+    // 续传时需要带上服务端分配的 session_id
+    let sessionId = '';
+    for await (const event of resumableSSE<InitStreamEvent>(
+        '/api/ai/chat/init-stream',
+        () => ({
+            session_id: sessionId,
             messages: [],
             context,
         }),
-    });
-
-    if (!response.ok) {
-        yield {
-            type: 'error',
-            content: `API Error: ${response.status} ${response.statusText}`,
-        };
-        return;
-    }
-
-    const reader = response.body?.getReader();
-    if (!reader) {
-        yield { type: 'error', content: 'No response body' };
-        return;
-    }
-
-    const decoder = new TextDecoder();
-    let buffer = '';
-
-    try {
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-
-            buffer += decoder.decode(value, { stream: true });
-
-            const lines = buffer.split('\n');
-            buffer = lines.pop() || '';
-
-            for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    const data = line.slice(6).trim();
-                    if (data) {
-                        try {
-                            const event = JSON.parse(data) as InitStreamEvent;
-                            yield event;
-                        } catch (e) {
-                            console.warn('[initChatStream] Failed to parse event:', data);
-                        }
-                    }
-                }
-            }
+        '[initChatStream]'
+    )) {
+        if (event.type === 'session' && event.session_id) {
+            sessionId = event.session_id;
         }
-    } finally {
-        reader.releaseLock();
+        yield event;
     }
 }
@@ -22,7 +22,27 @@ function getWebSocketUrl(): string {
     return envUrl;
 }
 
-const WS_URL = getWebSocketUrl();
+// 课堂房间：页面 URL 的 ?room= 优先，其次环境变量，默认共享房间
+function getRoomId(): string {
+    const fromUrl = new URLSearchParams(window.location.search).get('room');
+    return fromUrl || import.meta.env.VITE_WS_ROOM || 'default';
+}
+
+const ROOM_ID = getRoomId();
+
+function withQuery(url: string, params: Record<string, string>): string {
+    const separator = url.includes('?') ? '&' : '?';
+    const query = Object.entries(params)
+        .map(([key, value]) => `${key}=${encodeURIComponent(value)}`)
+        .join('&');
+    return `${url}${separator}${query}`;
+}
+
+// sync=delta：使用带版本号的增量同步协议（STATE_DELTA / STATE_PATCH）
+const WS_URL = withQuery(getWebSocketUrl(), { room: ROOM_ID, sync: 'delta' });
+
+// 房间历史接口与 WebSocket 同一后端：ws(s)://host/ws -> http(s)://host
+const HISTORY_BASE_URL = getWebSocketUrl().replace(/^ws/, 'http').replace(/\/ws\/?(\?.*)?$/, '');
 
 
 // 需要同步的状态字段（排除函数和临时状态）
@@ -91,9 +111,44 @@ const SYNC_KEYS = [
     'skillQuizWrongAttempt'
 ] as const;
 
+// 完整状态中只带最近条目的列表里，需要完整数据才能正确工作的字段（查词去重、高亮删除）：
+// 收到完整状态后在后台补齐；messages 等其余字段由界面按需调用 loadOlderHistory
+const BACKFILL_KEYS = ['lookups', 'highlights'];
+const HISTORY_PAGE_SIZE = 200;
+
 type SyncKey = typeof SYNC_KEYS[number];
 type SyncPayload = Partial<Record<SyncKey, unknown>>;
 
+// 增量操作：整体替换，或向只增长的列表（messages / highlights 等）追加
+type StateOp =
+    | { op: 'set'; key: string; value: unknown }
+    | { op: 'append'; key: string; items: unknown[] };
+
+// 带版本号的服务器消息（STATE_DELTA / ROOM_RESET）
+interface SequencedMessage {
+    type: string;
+    version: number;
+    baseVersion: number;
+    ops?: StateOp[];
+    senderId?: string;
+}
+
+interface SyncMessage {
+    type: string;
+    payload?: SyncPayload;
+    clientId?: string;
+    senderId?: string;
+    version?: number;
+    baseVersion?: number;
+    stateVersion?: number;
+    ops?: StateOp[];
+    deltas?: SequencedMessage[];
+    ts?: number;
+    targetId?: string;
+    // FULL_STATE 中只带了最近条目的列表：total 为总条数，start 为第一条的下标
+    partial?: Record<string, { total: number; start: number }>;
+}
+
 // 模块状态
 let socket: WebSocket | null = null;
 let isReceiving = false;
@@ -102,6 +157,22 @@ let unsubscribe: (() => void) | null = null;
 let clientId: string = '';
 let currentRole: string = '';
 
+// 增量同步：本地已应用到的房间状态版本；乱序到达的增量按 baseVersion 暂存
+let stateVersion = 0;
+const pendingDeltas = new Map<number, SequencedMessage>();
+let awaitingDeltas = false;
+let deltaRetryTimer: ReturnType<typeof setTimeout> | null = null;
+const DELTA_RETRY_DELAY = 3000;
+
+// 本地列表第一条在房间完整列表中的下标（> 0 表示更早的条目还未拉取）
+const historyStart = new Map<string, number>();
+// 收到新的完整状态或房间重置后，进行中的历史请求结果作废
+let historyEpoch = 0;
+// 列表还不完整时的整体替换（如删除一条高亮）会用截断的列表覆盖服务器上的完整列表：
+// 先只在本地生效，补齐历史后再发送完整列表
+const deferredSets = new Set<string>();
+const backfilling = new Set<string>();
+
 // 重连配置
 const RECONNECT_DELAY = 3000;
 const MAX_RECONNECT_ATTEMPTS = 10;
@@ -113,7 +184,7 @@ let reconnectAttempts = 0;
 export function initSync(role: 'student' | 'coach') {
     currentRole = role;
     console.log(`[Sync] 初始化 WebSocket 同步 (${role})`);
-    console.log(`[Sync] 服务器地址: ${WS_URL}`);
+    console.log(`[Sync] 服务器地址: ${WS_URL} (房间: ${ROOM_ID})`);
 
     connect();
 }
@@ -173,11 +244,16 @@ function connect() {
 /**
  * 处理接收到的消息
  */
-function handleMessage(message: { type: string; payload?: SyncPayload; clientId?: string; senderId?: string }) {
+function handleMessage(message: SyncMessage) {
     switch (message.type) {
         case 'WELCOME':
             clientId = message.clientId || '';
             console.log(`[Sync] 分配客户端ID: ${clientId}`);
+            // 新连接：以服务器当前版本为起点
+            stateVersion = message.stateVersion ?? 0;
+            pendingDeltas.clear();
+            finishDeltaRequest();
+            resetHistory();
             break;
 
         case 'FULL_STATE':
@@ -187,6 +263,29 @@ function handleMessage(message: { type: string; payload?: SyncPayload; clientId?
                 useGameStore.setState(message.payload as Parameters<typeof useGameStore.setState>[0]);
                 isReceiving = false;
             }
+            resetHistory();
+            Object.entries(message.partial ?? {}).forEach(([key, { start }]) => historyStart.set(key, start));
+            if (message.version !== undefined) {
+                stateVersion = message.version;
+                finishDeltaRequest();
+                drainPendingDeltas();
+            }
+            BACKFILL_KEYS.filter(key => historyStart.has(key)).forEach(backfillHistory);
+            break;
+
+        case 'PING':
+            // 服务器心跳：回应后服务器才会把长时间无响应的连接当作半开连接回收
+            socket?.send(JSON.stringify({ type: 'PONG', ts: message.ts }));
+            break;
+
+        case 'STATE_DELTA':
+            receiveSequenced(message as SequencedMessage);
+            break;
+
+        case 'STATE_DELTAS':
+            console.log(`[Sync] 🧩 补齐缺失增量: ${message.deltas?.length ?? 0} 条`);
+            finishDeltaRequest();
+            message.deltas?.forEach(receiveSequenced);
             break;
 
         case 'STATE_UPDATE':
@@ -205,19 +304,201 @@ function handleMessage(message: { type: string; payload?: SyncPayload; clientId?
             break;
 
         case 'ROOM_RESET':
-            console.log(`[Sync] 🔄 房间已被重置，重置本地状态`);
-            isReceiving = true;
-            useGameStore.getState().reset();
-            isReceiving = false;
+            if (message.version !== undefined) {
+                receiveSequenced(message as SequencedMessage);
+            } else {
+                resetLocalState();
+            }
             break;
 
         case 'WEBRTC_SIGNAL':
             // Notify signal subscribers
             signalSubscribers.forEach(cb => cb(message.payload, message.senderId, (message as any).senderRole));
             break;
+
+        case 'SIGNAL_ERROR':
+            // 定向信令的目标已离开房间
+            console.warn(`[Sync] 信令目标已离开: ${message.targetId}`);
+            signalSubscribers.forEach(cb => cb({ type: 'TARGET_GONE', targetId: message.targetId }));
+            break;
+    }
+}
+
+function resetLocalState() {
+    console.log(`[Sync] 🔄 房间已被重置，重置本地状态`);
+    isReceiving = true;
+    useGameStore.getState().reset();
+    isReceiving = false;
+    resetHistory();
+}
+
+function resetHistory() {
+    historyStart.clear();
+    // 新的完整状态 / 房间重置已覆盖本地未发送的修改
+    deferredSets.clear();
+    historyEpoch++;
+}
+
+/**
+ * 拉取列表字段更早的一页条目并插入本地列表开头
+ * 返回是否还有更早的条目
+ */
+export async function loadOlderHistory(key: string, limit = 50): Promise<boolean> {
+    const before = historyStart.get(key);
+    if (!before) return false;
+
+    const epoch = historyEpoch;
+    const url = withQuery(
+        `${HISTORY_BASE_URL}/api/ws/rooms/${encodeURIComponent(ROOM_ID)}/history/${encodeURIComponent(key)}`,
+        { before: String(before), limit: String(limit) }
+    );
+    const response = await fetch(url);
+    if (!response.ok) throw new Error(`History request failed: ${response.status}`);
+    const page: { items: unknown[]; start: number } = await response.json();
+    // 等待期间房间已重置或重新同步：丢弃
+    if (epoch !== historyEpoch || historyStart.get(key) !== before) return historyStart.has(key);
+
+    const current = (useGameStore.getState() as unknown as Record<string, unknown>)[key];
+    isReceiving = true;
+    useGameStore.setState({
+        [key]: [...page.items, ...(Array.isArray(current) ? current : [])]
+    } as Parameters<typeof useGameStore.setState>[0]);
+    isReceiving = false;
+
+    // start 没有前移：更早的条目已被服务端丢弃
+    if (page.start > 0 && page.start < before) {
+        historyStart.set(key, page.start);
+        return true;
+    }
+    historyStart.delete(key);
+    return false;
+}
+
+async function backfillHistory(key: string) {
+    if (backfilling.has(key)) return;
+    backfilling.add(key);
+    try {
+        while (await loadOlderHistory(key, HISTORY_PAGE_SIZE)) { /* 逐页向前补齐 */ }
+        console.log(`[Sync] 📚 已补齐历史: ${key}`);
+        sendDeferredSet(key);
+    } catch (error) {
+        console.error(`[Sync] 历史拉取失败 (${key}):`, error);
+    } finally {
+        backfilling.delete(key);
+    }
+}
+
+function sendDeferredSet(key: string) {
+    if (historyStart.has(key) || !deferredSets.delete(key)) return;
+    if (!socket || socket.readyState !== WebSocket.OPEN) return;
+    const value = (useGameStore.getState() as unknown as Record<string, unknown>)[key];
+    socket.send(JSON.stringify({
+        type: 'STATE_PATCH',
+        ops: [{ op: 'set', key, value }],
+        role: currentRole,
+        timestamp: Date.now()
+    }));
+    console.log(`[Sync] 📤 补齐后发送整体替换: ${key}`);
+}
+
+/**
+ * 按版本顺序处理增量；发现缺口时暂存并向服务器请求缺失部分
+ */
+function receiveSequenced(message: SequencedMessage) {
+    if (message.version <= stateVersion) return; // 已应用过
+
+    if (message.baseVersion !== stateVersion) {
+        pendingDeltas.set(message.baseVersion, message);
+        requestMissingDeltas();
+        return;
+    }
+
+    applySequenced(message);
+    drainPendingDeltas();
+}
+
+function drainPendingDeltas() {
+    for (const version of pendingDeltas.keys()) {
+        if (version < stateVersion) pendingDeltas.delete(version);
+    }
+    let next = pendingDeltas.get(stateVersion);
+    while (next) {
+        pendingDeltas.delete(stateVersion);
+        applySequenced(next);
+        next = pendingDeltas.get(stateVersion);
+    }
+}
+
+function applySequenced(message: SequencedMessage) {
+    if (message.type === 'ROOM_RESET') {
+        resetLocalState();
+    } else if (message.senderId !== clientId && message.ops) {
+        // 自己发出的增量本地已应用，只推进版本号
+        console.log(`[Sync] 📥 收到状态增量 v${message.version}:`, message.ops.map(op => op.key));
+        applyOps(message.ops);
+    }
+    stateVersion = message.version;
+}
+
+function applyOps(ops: StateOp[]) {
+    const current = useGameStore.getState() as unknown as Record<string, unknown>;
+    const next: Record<string, unknown> = {};
+    for (const op of ops) {
+        if (op.op === 'set') {
+            next[op.key] = op.value;
+        } else if (op.op === 'append') {
+            const base = op.key in next ? next[op.key] : current[op.key];
+            next[op.key] = [...(Array.isArray(base) ? base : []), ...op.items];
+        }
+    }
+    isReceiving = true;
+    useGameStore.setState(next as Parameters<typeof useGameStore.setState>[0]);
+    isReceiving = false;
+}
+
+function requestMissingDeltas() {
+    if (awaitingDeltas || !socket || socket.readyState !== WebSocket.OPEN) return;
+    awaitingDeltas = true;
+    console.log(`[Sync] ⚠️ 版本缺口，请求 v${stateVersion} 之后的增量`);
+    socket.send(JSON.stringify({
+        type: 'REQUEST_DELTAS',
+        since: stateVersion,
+        role: currentRole,
+        timestamp: Date.now()
+    }));
+    // 回复丢失时重试
+    deltaRetryTimer = setTimeout(() => {
+        deltaRetryTimer = null;
+        awaitingDeltas = false;
+        if (pendingDeltas.size > 0) requestMissingDeltas();
+    }, DELTA_RETRY_DELAY);
+}
+
+function finishDeltaRequest() {
+    awaitingDeltas = false;
+    if (deltaRetryTimer) {
+        clearTimeout(deltaRetryTimer);
+        deltaRetryTimer = null;
     }
 }
 
+/**
+ * 把字段变化转换为增量操作：列表只在末尾增长时发送新增部分
+ */
+function diffOps(changes: SyncPayload, prevState: Record<string, unknown>): StateOp[] {
+    return Object.entries(changes).map(([key, value]) => {
+        const prev = prevState[key];
+        if (
+            Array.isArray(value) && Array.isArray(prev) &&
+            value.length > prev.length &&
+            prev.every((item, i) => value[i] === item)
+        ) {
+            return { op: 'append', key, items: value.slice(prev.length) };
+        }
+        return { op: 'set', key, value };
+    });
+}
+
 /**
  * 设置 Zustand 订阅
  */
@@ -241,10 +522,18 @@ function setupSubscription() {
             }
         }
 
-        if (Object.keys(changes).length > 0) {
+        // 未补齐的列表暂不发送整体替换，先补齐历史（见 deferredSets）
+        const ops = diffOps(changes, prevState as unknown as Record<string, unknown>).filter(op => {
+            if (op.op !== 'set' || !historyStart.has(op.key)) return true;
+            deferredSets.add(op.key);
+            backfillHistory(op.key);
+            return false;
+        });
+
+        if (ops.length > 0) {
             socket.send(JSON.stringify({
-                type: 'STATE_UPDATE',
-                payload: changes,
+                type: 'STATE_PATCH',
+                ops,
                 role: currentRole,
                 timestamp: Date.now()
             }));
@@ -278,6 +567,7 @@ function scheduleReconnect() {
  * 清理资源
  */
 function cleanup() {
+    finishDeltaRequest();
     if (unsubscribe) {
         unsubscribe();
         unsubscribe = null;
@@ -358,8 +648,9 @@ export function subscribeToSignal(callback: SignalCallback) {
 
 /**
  * 发送 WebRTC 信令消息
+ * 指定 targetId 时只发给该客户端，否则广播给房间内其他客户端
  */
-export function sendSignal(payload: any) {
+export function sendSignal(payload: any, targetId?: string) {
     if (!socket || socket.readyState !== WebSocket.OPEN) {
         console.warn('[Sync] 无法发送信令：WebSocket 未连接');
         return;
@@ -367,6 +658,7 @@ export function sendSignal(payload: any) {
     socket.send(JSON.stringify({
         type: 'WEBRTC_SIGNAL',
         payload,
+        targetId,
         role: currentRole,
         timestamp: Date.now()
     }));